@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import random
+import sys
+import time
+import arq
+import compress
+import fec
+from crc import get_model
+from channel import make_channel
+from framing import (FrameReader, pack_text, pack_options, parse_options,
+                     HANDSHAKE_MODEL, HELLO, WELCOME, MSG, ACK, NACK, PING, PONG, SEQUENCED)
+
+# Headless asyncio chat client: the protocol side of client.py, usable from services, bots and tests.
+#   c = ChatClient('alice')
+#   await c.connect('127.0.0.1', 1234)     # HELLO/WELCOME handshake (CRC model, ARQ, FEC, compression)
+#   await c.send('hello')                  # to the current room; '[join dev]' / '[leave dev]' change rooms
+#   async for text in c: ...               # CRC-verified messages, in order with ARQ
+#   await c.disconnect()                   # sends [bye] and closes
+# Corrupted frames are dropped (or NACKed and received again with ARQ) and counted, never yielded.
+# Everything runs on the caller's event loop, so one process can hold thousands of sessions:
+#   python -m aclient --host H --port P --sessions 2000 --rate 0.5 --duration 60 [--rooms 50]
+
+PORT = 1234
+# defaults offered in the handshake (client.py passes its own settings)
+CRC_OFFER = 'crc-32,crc-16/ccitt,crc-8,crc-3'
+ARQ_WINDOW = arq.WINDOW
+ARQ_TICK = 0.05
+FEC_OFFER = ''
+COMPRESS_OFFER = 'zlib-dict,zlib'
+CHANNEL = 'none'        # no simulated errors unless asked for (see channel.py)
+HANDSHAKE_TIMEOUT = 5.0
+BUFFER_SIZE = 8192      # initial receive buffer per session; it grows for bigger frames
+SHUTDOWN = 'server is shutting down'  # start of the server's shutdown notice (lower case)
+
+
+class ChatClient:
+    def __init__(self, name, crc=CRC_OFFER, arq_window=ARQ_WINDOW, fec_offer=FEC_OFFER,
+                 compress_offer=COMPRESS_OFFER, history=0, channel=CHANNEL, channel_seed=None, log=None, rooms=None):
+        self.name = name
+        self.crc = crc
+        self.arq_window = arq_window
+        self.fec_offer = fec_offer
+        self.compress_offer = compress_offer
+        self.history = history  # chat lines to ask for on joining (servers with --history)
+        self.rooms = rooms      # rooms to join, e.g. 'dev,lobby' (see rooms.py); None: the server's default
+        self.channel = channel
+        self.channel_seed = channel_seed
+        self.log = log or (lambda message: None)
+        self.model = get_model()
+        self.options = {}       # what the server accepted in its WELCOME
+        self.connected = False
+        self.link = None        # simulated noisy link for outgoing chat
+        self.arq_out = None
+        self.arq_in = None
+        self.received = 0
+        self.crc_errors = 0
+        self._writer = None
+        self._incoming = None
+        self._timers = None
+
+    #Function to connect and do the handshake. Returns the options the server accepted.
+    async def connect(self, host, port=PORT, timeout=HANDSHAKE_TIMEOUT):
+        if self.connected:
+            raise ConnectionError('already connected')
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        # the name is followed by what we support; the handshake itself uses the default model
+        offer = {'crc': self.crc, 'arq': self.arq_window} if self.arq_window else {'crc': self.crc}
+        if self.fec_offer:
+            offer['fec'] = self.fec_offer
+        if self.compress_offer:
+            offer['compress'] = self.compress_offer
+        if self.history:
+            offer['history'] = self.history
+        if self.rooms:
+            offer['rooms'] = self.rooms
+        frames = FrameReader(HANDSHAKE_MODEL, BUFFER_SIZE)
+        incoming = frames.iter_stream(reader)
+        try:
+            writer.write(pack_text(HELLO, pack_options(offer, first_line=self.name), HANDSHAKE_MODEL))
+            reply = await asyncio.wait_for(anext(incoming, None), timeout)
+            if reply is None or reply.type != WELCOME or not reply.ok:
+                raise ConnectionError('invalid CRC negotiation reply')
+            _, options = parse_options(str(reply.payload, 'utf-8'))
+            model = get_model(options.get('crc'))
+            # frames after the WELCOME go through the FEC codec and compression the server accepted, if any
+            if options.get('fec'):
+                model = fec.with_fec(model, fec.get_codec(options['fec']))
+            if options.get('compress'):
+                model = compress.with_compression(model, compress.get_codec(options['compress']))
+            window = int(options.get('arq', 0))
+        except BaseException:
+            writer.close()
+            raise
+        # frames already buffered behind the WELCOME are checked with the new model
+        frames.model = self.model = model
+        self.options = options
+        self._writer, self._incoming = writer, incoming
+        self.link = make_channel(self.channel, self.channel_seed)
+        self.arq_out = self.arq_in = None
+        if window:
+            stats = arq.ArqStats()
+            self.arq_out = arq.ArqSender(self._send_noisy, model, window, on_give_up=self._give_up, stats=stats)
+            self.arq_in = arq.ArqReceiver(model, window, stats)
+            self._timers = asyncio.get_running_loop().create_task(self._arq_timers())
+        self.connected = True
+        return options
+
+    # every chat frame (first sends and ARQ retransmissions alike) goes through the simulated link
+    def _send_noisy(self, frame):
+        received, _ = self.link.transmit(frame, self.model)
+        self._writer.write(received)
+
+    def _give_up(self):
+        self.log('[ARQ] Server stopped acknowledging messages. Disconnecting.')
+        self._writer.transport.abort()
+
+    async def _arq_timers(self):
+        while self.connected:
+            await asyncio.sleep(ARQ_TICK)
+            self.arq_out.poll()
+
+    #Function to send a chat line. Sending "[bye]" also closes the connection, as in the Tk client.
+    async def send(self, text):
+        if not self.connected:
+            raise ConnectionError('not connected')
+        if self.arq_out is not None:
+            # numbered and kept until the server ACKs it; corrupted copies are resent automatically
+            self.arq_out.send(text)
+        else:
+            self._send_noisy(pack_text(MSG, text, self.model))
+        await self._writer.drain()
+        if text == '[bye]':
+            await self._close()
+
+    def __aiter__(self):
+        return self.messages()
+
+    #Async iterator of the CRC-verified messages from the server (text), until the connection closes.
+    #Leaving the loop early closes the connection too.
+    async def messages(self):
+        if self._incoming is None:
+            return
+        try:
+            async for frame in self._incoming:
+                # ACK/NACK for our own messages
+                if frame.type in (ACK, NACK):
+                    if self.arq_out is not None:
+                        self.arq_out.on_control(frame)
+                    continue
+                # keepalive: answering shows the server this connection is still alive (see limits.py)
+                if frame.type == PING:
+                    self._writer.write(pack_text(PONG, '', self.model))
+                    continue
+                if frame.type != MSG:
+                    continue
+                if self.arq_in is not None and frame.flags & SEQUENCED:
+                    # corrupted frames are NACKed and resent by the server; payloads come out in order
+                    if not frame.ok:
+                        self.crc_errors += 1
+                        self.log('[CRC ERROR] Error detected in incoming message from server, requesting it again.')
+                    payloads, replies = self.arq_in.receive(frame)
+                    for reply in replies:
+                        self._writer.write(reply)
+                elif not frame.ok:
+                    self.crc_errors += 1
+                    self.log('[CRC ERROR] Error detected in incoming message from server!')
+                    continue
+                else:
+                    payloads = (frame.payload,)
+                for payload in payloads:
+                    self.received += 1
+                    yield str(payload, 'utf-8', 'replace')
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            await self._close()
+
+    #Function to leave the chat: sends [bye] and closes the connection.
+    async def disconnect(self):
+        if not self.connected:
+            return
+        try:
+            self._writer.write(pack_text(MSG, '[bye]', self.model))
+            await self._writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        await self._close()
+
+    async def _close(self):
+        if not self.connected:
+            return
+        self.connected = False
+        if self._timers is not None:
+            self._timers.cancel()
+            self._timers = None
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    #Lines describing this session's counters (ARQ, simulated channel, compression), for logs.
+    def stats(self):
+        lines = []
+        if self.arq_out is not None:
+            lines.append(f'[ARQ] {self.arq_out.stats}')
+        if self.link is not None:
+            lines.append(f'[CHANNEL] {self.link.stats}')
+        if self.model.compression is not None:
+            lines.append(f'[COMPRESS] {self.model.compression.stats}')
+        return lines
+
+
+class DriverStats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0     # sessions that could not connect or finish the handshake
+        self.closed = 0     # sessions the server closed early
+        self.sent = 0
+        self.received = 0
+        self.crc_errors = 0
+
+    def __str__(self):
+        return ' '.join(f'{key}={value}' for key, value in vars(self).items())
+
+
+#Function to run `sessions` clients in this event loop for `duration` seconds, each sending `rate`
+#lines per second (0: listen only). At most `concurrency` handshakes are in progress at a time.
+#With `rooms` the sessions are spread over that many rooms (room0, room1, ...).
+async def drive(host, port, sessions, rate=1.0, duration=10.0, prefix='bot', concurrency=200, report=1.0,
+                log=print, rooms=0, **options):
+    stats = DriverStats()
+    gate = asyncio.Semaphore(concurrency)
+    end = time.monotonic() + duration
+
+    async def listen(client):
+        async for _ in client:
+            stats.received += 1
+
+    async def session(i):
+        seed = options.get('channel_seed')
+        client = ChatClient(f'{prefix}{i}', rooms=f'room{i % rooms}' if rooms else None,
+                            **dict(options, channel_seed=None if seed is None else seed + i))
+        async with gate:
+            try:
+                await client.connect(host, port)
+            except (OSError, ConnectionError, asyncio.TimeoutError):
+                stats.failed += 1
+                return
+        stats.connected += 1
+        listener = asyncio.create_task(listen(client))
+        sent = 0
+        if rate > 0:
+            # spread the sessions' sends over the interval
+            next_send = time.monotonic() + random.random() / rate
+            while client.connected and next_send < end:
+                await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+                next_send += 1.0 / rate
+                try:
+                    await client.send(f'message {sent} from {client.name}')
+                except (ConnectionError, OSError):
+                    break
+                sent += 1
+                stats.sent += 1
+        await asyncio.sleep(max(0.0, end - time.monotonic()))
+        if client.connected:
+            await client.disconnect()
+        else:
+            stats.closed += 1
+        await listener
+        stats.crc_errors += client.crc_errors
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(report)
+            log(f'[DRIVER] {stats}')
+
+    progress = asyncio.create_task(reporter()) if report else None
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    if progress is not None:
+        progress.cancel()
+    return stats
+
+
+#Function to allow as many open sockets as the hard limit does (one per session).
+def _raise_fd_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run many headless chat sessions (bots / soak tests)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=1.0, help='lines per second per session (0: listen only)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds each session stays after connecting')
+    parser.add_argument('--prefix', default='bot', help='session names are PREFIX0, PREFIX1, ...')
+    parser.add_argument('--concurrency', type=int, default=200, help='handshakes in progress at a time')
+    parser.add_argument('--rooms', type=int, default=0, help='spread the sessions over this many rooms')
+    parser.add_argument('--crc', default=CRC_OFFER, help='CRC models to offer')
+    parser.add_argument('--arq-window', type=int, default=ARQ_WINDOW, help='reliable-delivery window (0: off)')
+    parser.add_argument('--fec', default=FEC_OFFER, help='FEC codecs to offer, e.g. rs:16')
+    parser.add_argument('--compress', default=COMPRESS_OFFER, help="compression to offer ('' for none)")
+    parser.add_argument('--channel', default=CHANNEL, help='simulated errors on sent chat (see channel.py)')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the simulated channels')
+    args = parser.parse_args(argv)
+
+    _raise_fd_limit()
+    started = time.monotonic()
+    stats = asyncio.run(drive(args.host, args.port, args.sessions, args.rate, args.duration, args.prefix,
+                              args.concurrency, rooms=args.rooms, crc=args.crc, arq_window=args.arq_window, fec_offer=args.fec,
+                              compress_offer=args.compress, channel=args.channel, channel_seed=args.seed))
+    print(f'[DRIVER] done in {time.monotonic() - started:.1f} s: {stats}')
+    return 0 if stats.connected and not stats.failed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
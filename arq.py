@@ -0,0 +1,220 @@
+import threading
+import time
+from collections import deque
+from crc import get_model
+from framing import (FrameCache, pack_frame, pack_seqs, parse_seqs, split_seq, ACK, NACK, SEQ_MOD)
+
+# Selective-repeat ARQ (reliable delivery) over the frame protocol, used by client.py and both
+# server engines when the handshake agrees on it ("arq=<window>").
+# Every data frame carries a sequence number (framing.seq_tag). The receiver ACKs each frame that
+# arrives intact (the ACK also carries the next sequence number it expects, so it covers every
+# earlier frame whose ACK was lost) and NACKs one whose payload CRC failed; the sender retransmits only the NACKed
+# frames, plus any frame not ACKed before its timer runs out (e.g. when the tag itself was hit).
+# At most `window` frames are unacknowledged at a time; the receiver buffers out-of-order frames
+# and hands payloads on in sequence order.
+# Both classes are sans-IO: the caller feeds them frames and sends what they produce, and calls
+# ArqSender.poll() every few tens of milliseconds to run the retransmit timers.
+
+WINDOW = 32
+TIMEOUT = 0.25      # seconds before an unacknowledged frame is resent (doubles on every retry)
+MAX_TIMEOUT = 4.0
+MAX_RETRIES = 8     # after this many resends the link is considered dead
+BACKLOG = 1024      # payloads waiting for room in the window (the oldest is dropped beyond this)
+
+
+class ArqStats:
+    def __init__(self):
+        self.sent = 0          # new data frames
+        self.retransmits = 0
+        self.timeouts = 0      # resends caused by a timer (the rest were NACKed)
+        self.acked = 0
+        self.nacks_received = 0
+        self.given_up = 0
+        self.backlog_dropped = 0
+        self.max_in_flight = 0
+        self.delivered = 0     # receiver: payloads handed on in order
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.crc_errors = 0
+        self.nacks_sent = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        return ' '.join(f'{key}={value}' for key, value in vars(self).items() if value)
+
+
+class _Pending:
+    __slots__ = ('frames', 'deadline', 'retries')
+
+    def __init__(self, frames, deadline):
+        self.frames = frames
+        self.deadline = deadline
+        self.retries = 0
+
+
+#Sending half: numbers outgoing payloads, keeps them until ACKed and resends them when needed.
+#Thread-safe; `transmit(frame)` is called with the lock held so frames leave in sequence order.
+class ArqSender:
+    def __init__(self, transmit, model=None, window=WINDOW, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+                 backlog=BACKLOG, on_give_up=None, stats=None):
+        self.transmit = transmit
+        self.model = get_model(model)
+        self.window = window
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.on_give_up = on_give_up  # called (without the lock) when a frame is never ACKed
+        self.stats = stats or ArqStats()
+        self.next_seq = 0
+        self.in_flight = {}  # seq -> _Pending, oldest first
+        self.backlog = deque(maxlen=backlog)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.in_flight)
+
+    #Function to send a payload (text, bytes or a FrameCache shared with other recipients).
+    def send(self, message):
+        frames = message if isinstance(message, FrameCache) else FrameCache(message)
+        with self.lock:
+            if self.backlog or not self._has_room():
+                if len(self.backlog) == self.backlog.maxlen:
+                    self.stats.backlog_dropped += 1
+                self.backlog.append(frames)
+            else:
+                self._start(frames, time.monotonic())
+
+    #Function to handle an ACK or NACK frame from the peer.
+    def on_control(self, frame):
+        if not frame.ok:
+            return  # a damaged ACK/NACK is ignored; the timer covers it
+        seqs = parse_seqs(frame.payload)
+        now = time.monotonic()
+        with self.lock:
+            if frame.type == ACK and seqs:
+                # first the receiver's next expected number: everything before it has arrived
+                expected = seqs[0]
+                done = [seq for seq in self.in_flight if 0 < (expected - seq) % SEQ_MOD <= self.window]
+                for seq in done + seqs[1:]:
+                    if self.in_flight.pop(seq, None) is not None:
+                        self.stats.acked += 1
+                self._fill(now)
+            elif frame.type == NACK:
+                for seq in seqs:
+                    pending = self.in_flight.get(seq)
+                    if pending is not None:
+                        self.stats.nacks_received += 1
+                        self._resend(seq, pending, now)
+
+    #Function to run the retransmit timers. Returns False once the link has been given up on.
+    def poll(self, now=None):
+        now = time.monotonic() if now is None else now
+        failed = False
+        with self.lock:
+            for seq, pending in list(self.in_flight.items()):
+                if pending.deadline > now:
+                    continue
+                if pending.retries >= self.max_retries:
+                    del self.in_flight[seq]
+                    self.stats.given_up += 1
+                    failed = True
+                    continue
+                self.stats.timeouts += 1
+                self._resend(seq, pending, now)
+            if not failed:
+                self._fill(now)
+        if failed and self.on_give_up is not None:
+            self.on_give_up()
+        return not failed
+
+    def _has_room(self):
+        if not self.in_flight:
+            return True
+        base = next(iter(self.in_flight))
+        return (self.next_seq - base) % SEQ_MOD < self.window
+
+    def _start(self, frames, now):
+        seq = self.next_seq
+        self.next_seq = (seq + 1) % SEQ_MOD
+        self.in_flight[seq] = _Pending(frames, now + self.timeout)
+        self.stats.sent += 1
+        self.stats.max_in_flight = max(self.stats.max_in_flight, len(self.in_flight))
+        self.transmit(frames.sequenced(self.model, seq))
+
+    def _resend(self, seq, pending, now):
+        pending.retries += 1
+        pending.deadline = now + min(self.timeout * 2 ** pending.retries, MAX_TIMEOUT)
+        self.stats.retransmits += 1
+        self.transmit(pending.frames.sequenced(self.model, seq))
+
+    def _fill(self, now):
+        while self.backlog and self._has_room():
+            self._start(self.backlog.popleft(), now)
+
+
+#Receiving half: ACKs/NACKs data frames and returns their payloads in sequence order.
+#Not thread-safe: feed it from the connection's reader only.
+class ArqReceiver:
+    def __init__(self, model=None, window=WINDOW, stats=None):
+        self.model = get_model(model)
+        self.window = window
+        self.stats = stats or ArqStats()
+        self.expected = 0
+        self.buffer = {}    # seq -> payload received ahead of `expected`
+        self.nacked = set()
+
+    #Function to handle a SEQUENCED frame. Returns (payloads now deliverable, ACK/NACK frames to send).
+    def receive(self, frame):
+        body, seq = split_seq(frame.payload)
+        if not frame.ok:
+            self.stats.crc_errors += 1
+        if seq is None:
+            return [], []  # can't tell which frame this was: the sender's timer will resend it
+        offset = (seq - self.expected) % SEQ_MOD
+        if not frame.ok:
+            if offset < self.window and seq not in self.buffer:
+                return [], [self._nack([seq])]
+            return [], []
+        if offset >= self.window or seq in self.buffer:
+            # already delivered (our ACK was lost) or already buffered: just ACK it again
+            self.stats.duplicates += 1
+            return [], [self._ack(seq)]
+
+        self.buffer[seq] = bytes(body)
+        replies = []
+        if offset:
+            self.stats.out_of_order += 1
+            # frames skipped over were damaged beyond recognition: ask for them now, not on timeout
+            missing = [s % SEQ_MOD for s in range(self.expected, self.expected + offset)
+                       if s % SEQ_MOD not in self.buffer and s % SEQ_MOD not in self.nacked]
+            if missing:
+                replies.append(self._nack(missing))
+
+        payloads = []
+        while self.expected in self.buffer:
+            payloads.append(self.buffer.pop(self.expected))
+            self.nacked.discard(self.expected)
+            self.expected = (self.expected + 1) % SEQ_MOD
+        self.stats.delivered += len(payloads)
+        replies.insert(0, self._ack(seq))
+        return payloads, replies
+
+    #ACK payload: the next sequence number expected, then the one being acknowledged.
+    def _ack(self, seq):
+        return pack_frame(ACK, pack_seqs([self.expected, seq]), self.model)
+
+    def _nack(self, seqs):
+        self.nacked.update(seqs)
+        self.stats.nacks_sent += len(seqs)
+        return pack_frame(NACK, pack_seqs(seqs), self.model)
+
+
+#Function for the server side of the handshake: the window to use with a client that offered
+#`offered` (the "arq" option, or None), capped at the server's own `window`. 0 means no ARQ.
+def negotiate(offered, window=WINDOW):
+    try:
+        offered = int(offered)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, min(offered, window))
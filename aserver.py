@@ -0,0 +1,365 @@
+import asyncio
+import signal
+import sys
+import threading
+import time
+from functools import partial
+import arq
+import common
+import compress
+import fec
+import limits
+import metrics
+import rooms
+from crc import get_model
+import notices
+from logsink import StdoutSink
+from channel import make_channel
+from session import Session, SessionRegistry
+from outbound import AsyncOutboundQueue, Coalescing, DROP_OLDEST, BACKPRESSURE, write_report
+from framing import FrameReader, FrameCache, FramingError, pack_text, pack_options, HANDSHAKE_MODEL, HELLO, WELCOME
+
+# asyncio engine: one coroutine per client instead of one thread per client.
+# Same join, [bye], CRC-drop and broadcast behaviour as the thread engine in server.py,
+# and no tkinter, so it runs headless. Select it with: python -m server --engine asyncio
+
+# address to listen on when none is given (None: this host's IP, see common.default_host)
+HOST = None
+PORT = 1234
+# Outbound queue length per client, and what to do when it fills up (see outbound.py)
+QUEUE_SIZE = 256
+QUEUE_POLICY = DROP_OLDEST
+# how writer tasks batch frames into one write (see outbound.py)
+COALESCE = Coalescing()
+# Largest ARQ window granted to clients (0 turns reliable delivery off) and how often the
+# retransmit timers run (see arq.py)
+ARQ_WINDOW = arq.WINDOW
+ARQ_TICK = 0.05
+# FEC codec families clients may ask for (see fec.py); empty turns FEC off
+FEC_CODECS = tuple(fec.CODECS)
+# compression codec families clients may ask for (see compress.py) and the smallest payload compressed
+COMPRESS_CODECS = tuple(compress.CODECS)
+COMPRESS_MIN = compress.MIN_SIZE
+# simulated noisy link for server-typed broadcasts (see channel.py); server.py shares its channel
+channel = make_channel('flips:1@0.1')
+# set in worker processes (python -m server --workers N, see cluster.py)
+REUSE_PORT = False
+bus = None
+# chat log for late joiners (--history, see chatlog.py); server.py shares its log with this engine
+history = None
+HISTORY_MAX = 1000
+# connection limits (see limits.py); server.py shares its settings with this engine
+LIMITS = limits.Limits()
+
+sessions = SessionRegistry()  # map StreamWriter -> Session (name, CRC model, outbound queue, counters)
+tasks = set()    # one handle_client task per connection
+arq_task = None
+keepalive_task = None
+loop = None
+server = None
+server_running = False
+loop_thread = None
+
+# where log lines go (see logsink.py); server.py shares its sink with this engine
+log_sink = StdoutSink()
+
+
+def log(message):
+    log_sink(message)
+
+
+#Function to run the server on an event loop in a background thread (used by the GUI).
+def start_server(port=PORT, host=None):
+    global loop, loop_thread
+    if server_running:
+        log('Server already running')
+        return
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    loop_thread = threading.Thread(target=_run_loop, args=(host or HOST or common.default_host(), port, started), name='event-loop', daemon=True)
+    loop_thread.start()
+    started.wait()
+
+
+def _run_loop(host, port, started):
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(_start(host, port))
+    finally:
+        started.set()
+    if server_running:
+        loop.run_forever()
+    loop.close()
+
+
+async def _start(host, port):
+    global server, server_running, arq_task, keepalive_task
+    try:
+        server = await asyncio.start_server(handle_client, host, port, reuse_address=True,
+                                            reuse_port=REUSE_PORT or None)
+    except Exception as e:
+        log(f'Failed to start server: {e}')
+        return
+    server_running = True
+    arq_task = asyncio.get_running_loop().create_task(_arq_timers())
+    if LIMITS.keepalive_on:
+        keepalive_task = asyncio.get_running_loop().create_task(_keepalive_timers())
+    log(f'Server started successfully! Server running on {host}:{port}')
+    log(f'IP Address: {host}')
+    log(f'Port: {port}')
+    log('Waiting for connections...\n')
+
+
+#Function to stop a server started with start_server (safe to call from any thread).
+def stop_server():
+    if not server_running:
+        log('Server not running')
+        return
+    asyncio.run_coroutine_threadsafe(_shutdown(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+async def _shutdown():
+    global server, server_running
+    if not server_running:
+        return
+    log('[SERVER SHUTDOWN]')
+    log(f'[CHANNEL] {channel.stats}')
+    for codec in compress.codecs():
+        log(f'[COMPRESS] {codec.spec}: {codec.stats}')
+    log(f'[WRITES] {write_report()}')
+    if history is not None:
+        history.flush()
+    broadcast_raw(notices.NoticeFrames(notices.SHUTDOWN))
+    server.close()
+    arq_task.cancel()
+    if keepalive_task is not None:
+        keepalive_task.cancel()
+    #Each writer task sends what is still queued (the shutdown notice) and then closes its stream
+    closing = [s.queue for s in sessions.clear()]
+    for q in closing:
+        q.close()
+    for task in list(tasks):
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if closing:
+        await asyncio.wait([q.task for q in closing], timeout=1.0)
+    await server.wait_closed()
+    server = None
+    server_running = False
+
+
+#This function removes a client; its writer task closes the stream.
+def drop_client(writer, flush=False):
+    common.drop_client(sessions, writer, flush)
+
+
+#This function sends a message to all connected clients (or the members of `in_rooms`), except
+#optionally the sender. Must run on the event loop. `message` is text, payload bytes, or a FrameCache: it is framed
+#once per CRC model and the same bytes are queued for every recipient. Returns the queues that are over their limit, which
+#the sender should wait on when the policy is backpressure.
+def broadcast_raw(message, sender_writer=None, in_rooms=None):
+    start = time.perf_counter()
+    frames = message if isinstance(message, FrameCache) else FrameCache(message)
+    congested = []
+    for session in sessions.recipients(in_rooms):
+        if session.conn is sender_writer:
+            continue
+        if session.arq_out is not None:
+            session.arq_out.send(frames)
+            sent = session.conn in sessions
+        else:
+            sent = common.deliver(sessions, session, frames[session.model])
+        if sent and session.queue.full():
+            congested.append((session.conn, session.queue))
+    metrics.broadcasts.inc()
+    metrics.fanout_seconds.observe(time.perf_counter() - start)
+    return congested
+
+
+#Retransmit timers of every ARQ session.
+async def _arq_timers():
+    while True:
+        await asyncio.sleep(ARQ_TICK)
+        common.poll_arq(sessions, time.monotonic())
+
+
+#Pings quiet clients and evicts the ones that stopped answering (gone, or half-open).
+async def _keepalive_timers():
+    while True:
+        await asyncio.sleep(limits.KEEPALIVE_TICK)
+        common.keepalive(sessions, LIMITS, log, time.monotonic())
+
+
+#This coroutine applies backpressure: the sender waits until every congested recipient has room.
+async def wait_for_space(congested):
+    for writer, q in congested:
+        if q.policy == BACKPRESSURE and not await q.wait_for_space():
+            drop_client(writer)
+
+
+def _call_on_loop(func, *args):
+    if loop is not None and threading.current_thread() is not loop_thread:
+        loop.call_soon_threadsafe(func, *args)
+    else:
+        func(*args)
+
+
+#Notices come from the pre-encoded notice cache; in a worker they go through the bus
+def broadcast_notice(notice_text, in_rooms=None):
+    if bus is not None:
+        bus.notice(notice_text, in_rooms)
+    else:
+        _call_on_loop(broadcast_raw, notices.NoticeFrames(notice_text), None, in_rooms)
+
+
+def broadcast_with_retry(message, sender_writer=None):
+    _call_on_loop(_broadcast_with_retry, message, sender_writer)
+
+
+def _broadcast_with_retry(message, sender_writer=None):
+    #The trial is simulated with the default model; clients on other models get a clean copy.
+    model = get_model()
+    frames = FrameCache(message)
+    encoded = frames[model]
+
+    #Sends the trial through the simulated channel, which also checks if it would be considered valid.
+    trial, ok = channel.transmit(encoded, model)
+    if ok:
+        frames[model] = trial
+        broadcast_raw(frames, sender_writer)
+    else:
+        log(notices.CRC_REBROADCAST)
+        broadcast_notice(notices.CRC_REBROADCAST)
+        broadcast_raw(frames, sender_writer)
+
+
+#This coroutine handles communication with a client.
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info('peername')
+    #admission control: over --max-clients the connection is told the server is full and closed
+    if not LIMITS.admit(len(sessions)):
+        metrics.rejected.inc()
+        log(f'[REJECTED] {addr}: server is full.')
+        writer.write(notices.notice_frame(notices.SERVER_FULL, HANDSHAKE_MODEL))
+        writer.close()
+        return
+    log(f'[CONNECTED] {addr}')
+    metrics.connections.inc()
+    tasks.add(asyncio.current_task())
+    session = Session(writer, addr)
+    session.queue = AsyncOutboundQueue(writer, QUEUE_SIZE, QUEUE_POLICY, on_error=lambda: drop_client(writer),
+                                       coalesce=COALESCE)
+    sessions.add(session)
+    frames = FrameReader(HANDSHAKE_MODEL)
+    incoming = frames.iter_stream(reader)
+    try:
+        #The first frame is the name, followed by the CRC models the client offers, within --handshake-timeout
+        hello = await asyncio.wait_for(anext(incoming, None), LIMITS.handshake_timeout)
+        if hello is None or hello.type != HELLO or not hello.ok:
+            common.send(sessions, session, notices.notice_frame(notices.INVALID_NAME, HANDSHAKE_MODEL))
+            drop_client(writer, flush=True)
+            return
+
+        agreement = common.negotiate(hello, ARQ_WINDOW, FEC_CODECS, COMPRESS_CODECS, COMPRESS_MIN, history)
+        name, wanted = agreement.name, agreement.wanted
+        common.send(sessions, session, pack_text(WELCOME, pack_options(agreement.accepted), HANDSHAKE_MODEL))
+        frames.model = agreement.model
+        common.start_session(sessions, session, agreement, LIMITS)
+
+        replay = None
+        if agreement.wants_history:
+            replay = partial(common.send_history, sessions, session, agreement.options, history, HISTORY_MAX, log)
+        if bus is not None:
+            #worker: the join takes effect when the bus hands it back, at the same point on every worker
+            bus.join(session, replay, wanted)
+        else:
+            #history first, then live lines (nothing else runs on the loop in between)
+            if replay is not None:
+                replay()
+            if not sessions.join(session):
+                return
+            for room in wanted:
+                sessions.enter(session, room)
+            session.room = wanted[0]
+            await wait_for_space(broadcast_raw(notices.NoticeFrames(notices.joined(name)), in_rooms=wanted))
+        log(f'[NEW CONNECTION] Client {name} connected.')
+        #"name: " is encoded once; each chat line is this prefix plus the payload bytes as received
+        prefix = f'{name}: '.encode()
+
+        async for frame in incoming:
+            for payload in common.received(sessions, session, frame, log):
+                if payload == b'[bye]':
+                    break
+                room = common.chat_room(sessions, session, payload, LIMITS, log, broadcast_raw, bus)
+                if room is None:
+                    continue
+                line = rooms.label(room) + prefix + payload
+                if bus is not None:
+                    bus.chat(session, room, line)
+                    continue
+                if history is not None and room == rooms.DEFAULT:
+                    history.append(line)
+                #only the room's members get it; stop reading from this client while a recipient's
+                #queue is full (backpressure policy)
+                await wait_for_space(broadcast_raw(line, sender_writer=writer, in_rooms=(room,)))
+            else:
+                continue
+            log(f'[DISCONNECTED] {name}')
+            if bus is not None:
+                bus.notice(notices.left(name), tuple(session.rooms))
+            else:
+                broadcast_raw(notices.NoticeFrames(notices.left(name)), in_rooms=tuple(session.rooms))
+            break
+
+    except asyncio.TimeoutError:
+        #only the handshake has a timeout
+        metrics.handshake_timeouts.inc()
+        log(f'[HANDSHAKE TIMEOUT] {addr}')
+        common.send(sessions, session, notices.notice_frame(notices.HANDSHAKE_TIMEOUT, HANDSHAKE_MODEL))
+        drop_client(writer, flush=True)
+    except FramingError as e:
+        log(f'[PROTOCOL ERROR] {e}')
+    except (ConnectionError, OSError):
+        pass
+    except asyncio.CancelledError:
+        # cancelled by _shutdown; finish normally so the stream callback sees a clean exit
+        pass
+    finally: #cleanup if connection crash or client disconnects
+        tasks.discard(asyncio.current_task())
+        drop_client(writer)
+        if bus is not None:
+            bus.forget(session)
+        if session.arq_out is not None:
+            log(f'[ARQ] {session.name}: {session.arq_out.stats}')
+        if session.model is not None and session.model.fec is not None:
+            log(f'[FEC] {session.name}: {session.model.fec.spec}, corrected {session.corrected}')
+
+
+#Function to run the server headless in the current thread until interrupted.
+def run(host=None, port=PORT):
+    global loop, loop_thread
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.current_thread()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(_start(host or HOST or common.default_host(), port))
+    if not server_running:
+        return
+    try:
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    except (NotImplementedError, RuntimeError):
+        pass  # not available on this platform / thread
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    try:
+        loop.run_until_complete(_shutdown())
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    # same as: python -m server --engine asyncio [options]
+    import server
+    sys.exit(server.main(['--engine', 'asyncio'] + sys.argv[1:]))
@@ -0,0 +1,9 @@
+# Benchmarks for the chat server and the CRC code. Run from the repository root, e.g.
+#   python -m benchmarks.bench_crc
+#   python -m benchmarks.bench_fec --flips 1 4
+#   python -m benchmarks.bench_compress --sizes 48 120 --notices
+#   python -m benchmarks.bench_channel --channels ber:1e-3 ge:1e-4,0.05
+#   python -m benchmarks.bench_server --clients 50 --rate 20 --duration 10
+#   python -m benchmarks.bench_server --clients 200 --workers 4   (extra options go to the server)
+#   python -m benchmarks.bench_server --clients 100 --rate 20 --coalesce 2
+#   python -m benchmarks.bench_startup --runs 10
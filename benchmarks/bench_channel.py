@@ -0,0 +1,55 @@
+import argparse
+import random
+import time
+import crc
+from channel import make_channel, np
+
+# Throughput of the channel simulator and how well each CRC model catches what it does.
+# A batch of random messages is CRC-encoded once (crc.encode_batch, binary trailers), corrupted
+# with channel.corrupt_batch (the whole codeword, trailer included, is exposed) and checked with
+# crc.verify_batch. A corrupted message that still verifies is a missed error.
+
+CHANNELS = ('flips:1@0.1', 'flips:3@0.1', 'ber:1e-4', 'ber:1e-3', 'ge:1e-4,0.05')
+
+
+def run(spec, models=None, size=40, messages=200000, seed=1, use_numpy=None):
+    rng = random.Random(seed)
+    payloads = [rng.getrandbits(size * 8).to_bytes(size, 'big') for _ in range(messages)]
+    buffer, offsets = crc.pack_batch(payloads)
+    rows = []
+    for name in models or crc.models:
+        model = crc.get_model(name)
+        encoded, enc_offsets = crc.encode_batch(buffer, offsets, model, binary=True)
+        channel = make_channel(spec, seed)
+        start = time.perf_counter()
+        received, hit = channel.corrupt_batch(encoded, enc_offsets, skip=0, use_numpy=use_numpy)
+        elapsed = time.perf_counter() - start
+        ok, _ = crc.verify_batch(received, enc_offsets, model, binary=True)
+        corrupted = sum(hit)
+        missed = sum(1 for h, good in zip(hit, ok) if h and good)
+        rows.append((spec, model.name, messages / elapsed, corrupted, channel.stats.bit_errors, missed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Channel simulator throughput and CRC detection rates')
+    parser.add_argument('--channels', nargs='+', default=CHANNELS, help='channel specs (see channel.make_channel)')
+    parser.add_argument('--models', nargs='+', default=None, help='CRC models (default: all registered)')
+    parser.add_argument('--size', type=int, default=40, help='payload bytes per message')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-numpy', action='store_true', help='time the pure-Python path')
+    args = parser.parse_args(argv)
+
+    use_numpy = False if args.no_numpy else np is not None
+    print(f'{args.messages} messages of {args.size} B, {"NumPy" if use_numpy else "pure Python"}, seed {args.seed}')
+    print(f'{"channel":<16}{"model":<14}{"Mframes/s":>10}{"corrupted":>11}{"bit errs":>10}{"missed":>8}{"miss rate":>11}')
+    for spec in args.channels:
+        for channel, model, rate, corrupted, bit_errors, missed in run(spec, args.models, args.size, args.messages,
+                                                                        args.seed, use_numpy):
+            miss_rate = missed / corrupted if corrupted else 0.0
+            print(f'{channel:<16}{model:<14}{rate / 1e6:>10.2f}{corrupted:>11}{bit_errors:>10}{missed:>8}{miss_rate:>11.2e}')
+
+
+if __name__ == '__main__':
+    main()
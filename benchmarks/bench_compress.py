@@ -0,0 +1,72 @@
+import argparse
+import random
+import time
+import compress
+import crc
+import framing
+
+# Wire bytes and CPU cost of compressed vs plain chat frames. Chat lines of a given length are
+# made from words (and, with --notices, the server notices mixed in), framed once per codec as a
+# broadcast would, and inflated again by a FrameReader. "wire" is framed bytes per message,
+# header and CRC included, so it shows what the threshold saves on short lines.
+
+SCHEMES = ('plain', 'zlib', 'zlib-dict', 'zlib-dict:1', 'zlib-dict:9')
+SIZES = (16, 48, 120, 400)
+WORDS = ('the lab', 'I think', 'we should', 'hello everyone', 'what do you think', 'CRC', 'frame', 'is it',
+         'working', 'thanks', 'okay', 'the server', 'sounds good', 'see you later', 'my code', 'now')
+
+
+def lines(size, count, seed, with_notices=False):
+    rng = random.Random(seed)
+    out = []
+    for i in range(count):
+        if with_notices and i % 4 == 0:
+            out.append(rng.choice(compress.NOTICES).encode())
+            continue
+        text = f'user{rng.randrange(100)}: '
+        while len(text) < size:
+            text += rng.choice(WORDS) + ' '
+        out.append(text[:size].encode())
+    return out
+
+
+def run(scheme, payloads, model='crc-32', min_size=compress.MIN_SIZE):
+    model = crc.get_model(model)
+    if scheme != 'plain':
+        model = compress.with_compression(model, compress.get_codec(scheme, min_size))
+    reader = framing.FrameReader(model)
+    wire = 0
+    start = time.perf_counter()
+    for payload in payloads:
+        frame = framing.FrameCache(payload)[model]
+        wire += len(frame)
+        reader.feed(frame)
+        for received in reader.frames():
+            assert received.ok and bytes(received.payload) == payload
+    elapsed = time.perf_counter() - start
+    plain = sum(len(p) for p in payloads)
+    return {'wire': wire / len(payloads), 'ratio': wire / (plain + len(payloads) * (framing.HEADER_SIZE + 4)),
+            'us': elapsed / len(payloads) * 1e6}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='plain vs zlib vs zlib with the preset dictionary on chat lines')
+    parser.add_argument('--schemes', nargs='+', default=SCHEMES, help="'plain' and/or codec specs like zlib-dict:6")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='chat line lengths in bytes')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--min-size', type=int, default=compress.MIN_SIZE, help='compression threshold')
+    parser.add_argument('--notices', action='store_true', help='make every 4th message a server notice')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f'{args.messages} messages, crc-32 frames, threshold {args.min_size} B')
+    print(f'{"scheme":<14}{"size":>6}{"wire/msg":>10}{"vs plain":>10}{"us/msg":>8}')
+    for size in args.sizes:
+        payloads = lines(size, args.messages, args.seed, args.notices)
+        for scheme in args.schemes:
+            r = run(scheme, payloads, min_size=args.min_size)
+            print(f'{scheme:<14}{size:>6}{r["wire"]:>10.1f}{r["ratio"]:>10.2f}{r["us"]:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
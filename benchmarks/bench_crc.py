@@ -0,0 +1,61 @@
+import argparse
+import random
+import string
+import timeit
+import crc
+import framing
+
+# Microbenchmarks for the CRC hot path: the string API (encode_message / decode_message),
+# the legacy bit-string mod2_division it replaced, and binary frame packing / checking,
+# across message lengths and CRC models. Times are per call, in microseconds.
+
+LENGTHS = (8, 64, 256, 1024, 4096)
+
+
+def per_call_us(func, min_time=0.2):
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    return elapsed / number * 1e6
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice(string.ascii_letters + string.digits + ' ') for _ in range(length))
+
+
+def run(lengths=LENGTHS, models=None, legacy_max=1024, min_time=0.2):
+    rng = random.Random(1)
+    models = [crc.get_model(m) for m in (models or crc.models)]
+    rows = []
+    for length in lengths:
+        text = random_text(rng, length)
+        if length <= legacy_max:
+            bits = crc.str_to_bin(text) + '0' * (len(crc.generator) - 1)
+            rows.append(('mod2_division', 'crc-3', length, per_call_us(lambda: crc.mod2_division(bits, crc.generator), min_time)))
+        for model in models:
+            encoded = crc.encode_message(text, model)
+            frame = framing.pack_text(framing.MSG, text, model)
+            rows.append(('encode_message', model.name, length, per_call_us(lambda: crc.encode_message(text, model), min_time)))
+            rows.append(('decode_message', model.name, length, per_call_us(lambda: crc.decode_message(encoded, model), min_time)))
+            rows.append(('pack_text', model.name, length, per_call_us(lambda: framing.pack_text(framing.MSG, text, model), min_time)))
+            rows.append(('unpack_frame', model.name, length, per_call_us(lambda: framing.unpack_frame(frame, model), min_time)))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='CRC microbenchmarks')
+    parser.add_argument('--lengths', type=int, nargs='+', default=LENGTHS)
+    parser.add_argument('--models', nargs='+', default=None, help='CRC models to time (default: all registered)')
+    parser.add_argument('--legacy-max', type=int, default=1024, help='longest message to time with mod2_division (it is slow)')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds spent timing each case')
+    args = parser.parse_args(argv)
+
+    print(f'{"function":<16}{"model":<14}{"length":>8}{"us/call":>12}{"MB/s":>10}')
+    for name, model, length, us in run(args.lengths, args.models, args.legacy_max, args.min_time):
+        print(f'{name:<16}{model:<14}{length:>8}{us:>12.2f}{length / us:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import random
+import time
+import crc
+import fec
+import framing
+from channel import FixedFlipsChannel, make_channel
+
+# Goodput of CRC-only vs FEC+CRC framing on a noisy link. Every message is framed, sent through
+# the same error model as the chat clients (with probability p a frame is hit and gets --flips
+# bit errors, see channel.FixedFlipsChannel; --channel picks any other channel.py model instead),
+# and resent until it arrives with a valid CRC, as the ARQ layer would. Goodput is delivered
+# payload bytes per byte put on the wire, retransmissions included.
+
+SCHEMES = ('crc', 'hamming:16', 'hamming:4', 'rs:16', 'rs:32')
+PROBS = (0.0, 0.01, 0.1, 0.5, 1.0)  # probability that a frame is hit
+MAX_ATTEMPTS = 16
+
+
+def run(scheme, error_prob, flips=1, size=100, messages=2000, model='crc-32', seed=1, channel=None):
+    rng = random.Random(seed)
+    link = make_channel(channel, seed) if channel else FixedFlipsChannel(flips, error_prob, seed)
+    model = crc.get_model(model)
+    if scheme != 'crc':
+        model = fec.with_fec(model, fec.get_codec(scheme))
+    wire = delivered = attempts = lost = undetected = 0
+    start = time.perf_counter()
+    for i in range(messages):
+        payload = rng.getrandbits(size * 8).to_bytes(size, 'big')
+        frame = framing.pack_frame(framing.MSG, payload, model)
+        for _ in range(MAX_ATTEMPTS):
+            attempts += 1
+            wire += len(frame)
+            received = framing.unpack_frame(link.apply(frame), model)
+            if received.ok:
+                delivered += size
+                undetected += bytes(received.payload) != payload
+                break
+        else:
+            lost += 1
+    elapsed = time.perf_counter() - start
+    return {'goodput': delivered / wire, 'attempts': attempts / messages, 'lost': lost, 'undetected': undetected,
+            'us': elapsed / attempts * 1e6}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='CRC-only vs FEC+CRC goodput on a simulated noisy link')
+    parser.add_argument('--schemes', nargs='+', default=SCHEMES, help="'crc' and/or FEC specs like hamming:16, rs:16")
+    parser.add_argument('--probs', type=float, nargs='+', default=PROBS, help='probability that a frame is hit')
+    parser.add_argument('--flips', type=int, nargs='+', default=(1,), help='bits flipped in a frame that is hit')
+    parser.add_argument('--size', type=int, default=100, help='payload bytes per message')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--crc', default='crc-32', help='CRC model')
+    parser.add_argument('--channel', nargs='+', help='channel specs (ber:R, ge:...) to run instead of --probs/--flips')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f'payload {args.size} B, {args.messages} messages, {args.crc}, up to {MAX_ATTEMPTS} attempts each')
+    if args.channel:
+        print(f'{"scheme":<12}{"channel":>20}{"goodput":>9}{"tx/msg":>8}{"lost":>6}{"undet":>6}{"us/tx":>8}')
+        for spec in args.channel:
+            for scheme in args.schemes:
+                r = run(scheme, 0, 0, args.size, args.messages, args.crc, args.seed, spec)
+                print(f'{scheme:<12}{spec:>20}{r["goodput"]:>9.3f}{r["attempts"]:>8.2f}'
+                      f'{r["lost"]:>6}{r["undetected"]:>6}{r["us"]:>8.1f}')
+        return
+    print(f'{"scheme":<12}{"p":>6}{"flips":>6}{"goodput":>9}{"tx/msg":>8}{"lost":>6}{"undet":>6}{"us/tx":>8}')
+    for flips in args.flips:
+        for p in args.probs:
+            for scheme in args.schemes:
+                r = run(scheme, p, flips, args.size, args.messages, args.crc, args.seed)
+                print(f'{scheme:<12}{p:>6.2f}{flips:>6}{r["goodput"]:>9.3f}{r["attempts"]:>8.2f}'
+                      f'{r["lost"]:>6}{r["undetected"]:>6}{r["us"]:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+import framing
+
+# Load generator for the chat server. Starts `python -m server` headless on localhost,
+# connects N simulated clients that speak the normal HELLO/WELCOME handshake, and has each
+# one send MSG frames at a fixed rate. Every payload carries its send time, so each
+# delivery to another client gives one broadcast fan-out latency sample.
+# Reports delivered messages per second, latency p50/p99, the server's CPU and RSS, and (from its
+# metrics endpoint) how many socket writes the deliveries took, so runs with and without
+# --coalesce MS show what batching saves and what it adds to latency.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, p):
+    if not samples:
+        return float('nan')
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+#CPU seconds (user + system) and RSS bytes of a process, from /proc (Linux).
+def proc_usage(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+        return cpu, rss
+    except (OSError, IndexError, ValueError):
+        return float('nan'), float('nan')
+
+
+#Function to start the server in a subprocess and wait until it accepts connections.
+def start_server(port, engine='thread', extra_args=()):
+    cmd = [sys.executable, '-m', 'server', '--host', '127.0.0.1', '--port', str(port),
+           '--engine', engine, '--log', 'null', '--metrics-port', str(free_port()), *extra_args]
+    proc = subprocess.Popen(cmd, cwd=ROOT)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('server did not start')
+
+
+#Function to read counters from the server's metrics endpoint (the port is in its command line).
+def server_counters(proc, names):
+    port = proc.args[proc.args.index('--metrics-port') + 1]
+    try:
+        text = urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=2).read().decode()
+    except OSError:
+        return {}
+    values = {}
+    for line in text.splitlines():
+        name, _, value = line.partition(' ')
+        if name in names:
+            values[name] = float(value)
+    return values
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.sent = 0
+        self.received = 0
+        self.crc_errors = 0
+        self.latencies = []
+
+
+#One simulated client: handshake, then send `rate` messages/s of `size` bytes while reading broadcasts.
+async def client(idx, port, crc_model, rate, size, duration, stats, start_evt):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    frames = framing.FrameReader(framing.HANDSHAKE_MODEL)
+    writer.write(framing.pack_text(framing.HELLO, framing.pack_options({'crc': crc_model}, first_line=f'bench{idx}'),
+                                   framing.HANDSHAKE_MODEL))
+    incoming = frames.iter_stream(reader)
+    welcome = await anext(incoming)
+    _, options = framing.parse_options(str(welcome.payload, 'utf-8'))
+    frames.model = model = options['crc']
+    stats.connected += 1
+    await start_evt.wait()
+
+    async def read_loop():
+        async for frame in incoming:
+            if not frame.ok:
+                stats.crc_errors += 1
+                continue
+            # "benchN: <send time ns> padding"; anything else is a server notice
+            _, _, body = bytes(frame.payload).partition(b': ')
+            stamp = body.split(b' ', 1)[0]
+            if stamp.isdigit():
+                stats.received += 1
+                stats.latencies.append((time.perf_counter_ns() - int(stamp)) / 1e6)
+
+    read_task = asyncio.create_task(read_loop())
+    if rate > 0:
+        interval = 1.0 / rate
+        pad = b'x' * max(0, size - 21)
+        end = time.monotonic() + duration
+        next_send = time.monotonic() + interval * (idx % 10) / 10
+        while time.monotonic() < end:
+            await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+            next_send += interval
+            payload = b'%d %s' % (time.perf_counter_ns(), pad)
+            writer.write(framing.pack_frame(framing.MSG, payload, model))
+            stats.sent += 1
+            await writer.drain()
+    else:
+        await asyncio.sleep(duration)
+    # let in-flight broadcasts arrive
+    await asyncio.sleep(0.5)
+    read_task.cancel()
+    writer.close()
+
+
+async def run_load(port, clients, senders, rate, size, duration, crc_model, server_pid):
+    stats = Stats()
+    start_evt = asyncio.Event()
+    tasks = [asyncio.create_task(client(i, port, crc_model, rate if i < senders else 0, size, duration, stats, start_evt))
+             for i in range(clients)]
+    # connect everyone first, then start sending
+    while stats.connected < clients and not any(t.done() for t in tasks):
+        await asyncio.sleep(0.05)
+    cpu0, _ = proc_usage(server_pid)
+    t0 = time.monotonic()
+    start_evt.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    cpu1, rss = proc_usage(server_pid)
+    # rates are per second of load; CPU also covers the drain time after it
+    return stats, duration, (cpu1 - cpu0) / (time.monotonic() - t0) * 100, rss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Chat server load benchmark')
+    parser.add_argument('--clients', type=int, default=20, help='connected clients')
+    parser.add_argument('--senders', type=int, default=None, help='clients that send (default: all)')
+    parser.add_argument('--rate', type=float, default=10, help='messages per second per sender')
+    parser.add_argument('--size', type=int, default=100, help='message payload size in bytes')
+    parser.add_argument('--duration', type=float, default=5, help='seconds of load')
+    parser.add_argument('--crc', default='crc-32', help='CRC model the clients offer')
+    parser.add_argument('--engine', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--port', type=int, default=None)
+    args, server_args = parser.parse_known_args(argv)
+    senders = args.clients if args.senders is None else args.senders
+
+    port = args.port or free_port()
+    proc = start_server(port, args.engine, server_args)
+    try:
+        stats, elapsed, cpu, rss = asyncio.run(run_load(port, args.clients, senders, args.rate, args.size,
+                                                        args.duration, args.crc, proc.pid))
+        counters = server_counters(proc, ('chat_send_writes_total', 'chat_coalesced_frames_total'))
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+    expected = stats.sent * (args.clients - 1)
+    print(f'engine={args.engine} clients={args.clients} senders={senders} rate={args.rate}/s size={args.size}B crc={args.crc}')
+    print(f'sent            {stats.sent} msgs ({stats.sent / elapsed:.0f}/s)')
+    print(f'delivered       {stats.received} msgs ({stats.received / elapsed:.0f}/s, {stats.received / max(expected, 1):.1%} of fan-out)')
+    print(f'crc errors      {stats.crc_errors}')
+    print(f'latency p50     {percentile(stats.latencies, 50):.2f} ms')
+    print(f'latency p99     {percentile(stats.latencies, 99):.2f} ms')
+    print(f'server cpu      {cpu:.0f}%')
+    print(f'server rss      {rss / 1e6:.1f} MB')
+    if counters:
+        writes, saved = counters.get('chat_send_writes_total', 0), counters.get('chat_coalesced_frames_total', 0)
+        print(f'server writes   {writes:.0f} for {writes + saved:.0f} frames ({saved / max(writes + saved, 1):.0%} saved)')
+
+
+if __name__ == '__main__':
+    main()
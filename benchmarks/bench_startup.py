@@ -0,0 +1,85 @@
+import argparse
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import framing
+from benchmarks.bench_server import ROOT, free_port
+
+# Startup benchmark: how long a fresh process takes to import each module (cold: a new
+# interpreter per run, so nothing is cached in sys.modules), and how long `python -m server`
+# takes from launch until it accepts a connection and answers a HELLO with a WELCOME.
+# Import times exclude the interpreter's own startup, which is reported once as `python`.
+# Reports the median and the best of --runs runs, in milliseconds.
+
+MODULES = ('crc', 'framing', 'server', 'aserver', 'client', 'aclient')
+
+_IMPORT = 'import time; t = time.perf_counter(); import {}; print(time.perf_counter() - t)'
+
+
+#Function to time one cold import of `module` in a new interpreter. Returns seconds.
+def import_time(module):
+    code = _IMPORT.format(module) if module else 'print(0.0)'
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return float(out) if module else time.perf_counter() - start
+
+
+#Function to launch the server and time it until the first connection gets its WELCOME. Returns
+#(seconds to the first accepted connection, seconds to the WELCOME).
+def first_connection(engine='thread', extra_args=(), timeout=10):
+    port = free_port()
+    cmd = [sys.executable, '-m', 'server', '--host', '127.0.0.1', '--port', str(port),
+           '--engine', engine, '--log', 'null', *extra_args]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+                break
+            except OSError:
+                if time.monotonic() > deadline or proc.poll() is not None:
+                    raise RuntimeError('server did not start')
+                time.sleep(0.002)
+        accepted = time.perf_counter() - start
+        with sock:
+            sock.sendall(framing.pack_text(framing.HELLO, framing.pack_options({'crc': 'crc-32'}, first_line='bench'),
+                                           framing.HANDSHAKE_MODEL))
+            welcome = next(framing.FrameReader(framing.HANDSHAKE_MODEL).iter_socket(sock))
+            welcomed = time.perf_counter() - start
+        if welcome.type != framing.WELCOME:
+            raise RuntimeError(f'expected WELCOME, got frame type {welcome.type}')
+        return accepted, welcomed
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def summary(samples):
+    return f'{statistics.median(samples) * 1000:8.1f} {min(samples) * 1000:8.1f}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold import and server startup benchmark')
+    parser.add_argument('--runs', type=int, default=5, help='runs per measurement')
+    parser.add_argument('--modules', nargs='+', default=MODULES, help='modules to import')
+    parser.add_argument('--engines', nargs='+', choices=('thread', 'asyncio'), default=('thread', 'asyncio'))
+    args, server_args = parser.parse_known_args(argv)
+
+    print(f'{"cold import":<28} {"median":>8} {"best":>8}  (ms, {args.runs} runs)')
+    print(f'{"python":<28} {summary([import_time(None) for _ in range(args.runs)])}')
+    for module in args.modules:
+        print(f'{module:<28} {summary([import_time(module) for _ in range(args.runs)])}')
+    print()
+    print(f'{"server startup":<28} {"median":>8} {"best":>8}')
+    for engine in args.engines:
+        runs = [first_connection(engine, server_args) for _ in range(args.runs)]
+        print(f'{engine + " first accept":<28} {summary([accepted for accepted, _ in runs])}')
+        print(f'{engine + " first WELCOME":<28} {summary([welcomed for _, welcomed in runs])}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+import math
+import random
+import sys
+from crc import load_numpy
+from framing import HEADER_SIZE, unpack_frame
+
+np = None  # optional, imported by the first corrupt_batch (which falls back to pure Python without it)
+
+# Simulated noisy link. A channel flips bits in frames (never in the header, like
+# framing.introduce_frame_error) with its own seeded RNG, so a run can be reproduced exactly.
+# Models, by spec (see make_channel):
+#   flips:K@P      with probability P a frame gets exactly K distinct bit errors ('flips:1@0.1' is
+#                  the original introduce_error behaviour)
+#   ber:R          every bit is flipped independently with probability R
+#   ge:PGB,PBG[,RG,RB]
+#                  Gilbert-Elliott bursts: a two-state Markov chain per bit moving good -> bad with
+#                  probability PGB and bad -> good with PBG; bits flip with probability RG in the
+#                  good state and RB in the bad one (defaults 0 and 0.5). The state carries over
+#                  from frame to frame, so a burst can span several frames.
+#   none           no errors
+# Error positions are drawn as geometric gaps between flipped bits rather than one coin per bit,
+# and corrupt_batch() does that for a whole buffer of frames at once (vectorized with NumPy).
+
+
+class ChannelStats:
+    def __init__(self):
+        self.frames = 0
+        self.corrupted = 0    # frames that got at least one bit error
+        self.bit_errors = 0
+        self.detected = 0     # corrupted frames the CRC rejected
+        self.missed = 0       # corrupted frames the CRC accepted (undetected errors)
+        self.corrected = 0    # corrupted frames the FEC codec repaired
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        return ' '.join(f'{key}={value}' for key, value in vars(self).items())
+
+
+class Channel:
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self._np_rng = None
+        self.stats = ChannelStats()
+
+    @property
+    def np_rng(self):
+        if self._np_rng is None:
+            self._np_rng = np.random.default_rng(self.seed)
+        return self._np_rng
+
+    #Function to pass one frame through the channel. An untouched frame is returned as the same object.
+    def apply(self, frame, skip=HEADER_SIZE):
+        nbits = (len(frame) - skip) * 8
+        positions = self._frame_positions(nbits) if nbits > 0 else ()
+        self.stats.frames += 1
+        if not positions:
+            return frame
+        data = bytearray(frame)
+        for bit in positions:
+            data[skip + (bit >> 3)] ^= 0x80 >> (bit & 7)
+        self.stats.corrupted += 1
+        self.stats.bit_errors += len(positions)
+        return bytes(data)
+
+    #Function to send a frame built with `model` through the channel and record whether the CRC
+    #catches the damage. Returns (frame as received, whether its CRC checks out).
+    def transmit(self, frame, model):
+        received = self.apply(frame)
+        if received is frame:
+            return frame, True
+        result = unpack_frame(received, model)
+        if not result.ok:
+            self.stats.detected += 1
+        elif bytes(result.payload) == unpack_frame(frame, model).payload:
+            self.stats.corrected += 1
+        else:
+            self.stats.missed += 1
+        return received, result.ok
+
+    #Function to corrupt many frames at once: `buffer` holds them back to back and offsets[i]:offsets[i+1]
+    #is frame i (the layout of crc.pack_batch). The first `skip` bytes of every frame are left alone.
+    #Returns (corrupted copy of the buffer as a bytearray, list of which frames were hit).
+    def corrupt_batch(self, buffer, offsets, skip=HEADER_SIZE, use_numpy=None):
+        global np
+        np = load_numpy()
+        if use_numpy is None or np is None:
+            use_numpy = np is not None
+        count = len(offsets) - 1
+        if use_numpy:
+            data = bytearray(buffer)
+            out = np.frombuffer(data, dtype=np.uint8)
+            offs = np.asarray(offsets, dtype=np.int64)
+            starts = np.minimum(offs[:-1] + skip, offs[1:])
+            sizes = (offs[1:] - starts) * 8
+            frame_idx, bits = self._batch_positions_np(sizes)
+            if len(bits):
+                byte_pos = starts[frame_idx] + (bits >> 3)
+                np.bitwise_xor.at(out, byte_pos, (0x80 >> (bits & 7)).astype(np.uint8))
+            hit = np.zeros(count, dtype=bool)
+            hit[frame_idx] = True
+            self._count(count, int(hit.sum()), len(bits))
+            return data, hit.tolist()
+
+        out = bytearray(buffer)
+        hit = []
+        flipped = 0
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            start = min(start + skip, end)
+            positions = self._frame_positions((end - start) * 8) if end > start else ()
+            for bit in positions:
+                out[start + (bit >> 3)] ^= 0x80 >> (bit & 7)
+            hit.append(bool(positions))
+            flipped += len(positions)
+        self._count(count, sum(hit), flipped)
+        return out, hit
+
+    def _count(self, frames, corrupted, bit_errors):
+        self.stats.frames += frames
+        self.stats.corrupted += corrupted
+        self.stats.bit_errors += bit_errors
+
+    #Bit positions (within nbits) to flip in one frame; may contain a position twice (flips cancel).
+    def _frame_positions(self, nbits):
+        raise NotImplementedError
+
+    #(frame index, bit position) arrays for frames of `sizes` bits each.
+    def _batch_positions_np(self, sizes):
+        raise NotImplementedError
+
+
+#Positions of a Bernoulli(p) process over n bits, drawn as geometric gaps (pure Python).
+def _bernoulli_positions(rng, n, p):
+    if p <= 0 or n <= 0:
+        return []
+    if p >= 1:
+        return list(range(n))
+    log_q = math.log1p(-p)
+    positions = []
+    pos = -1
+    while True:
+        pos += 1 + int(math.log(1.0 - rng.random()) / log_q)
+        if pos >= n:
+            return positions
+        positions.append(pos)
+
+
+#The same with NumPy, for n bits in total.
+def _bernoulli_positions_np(rng, n, p):
+    if p <= 0 or n <= 0:
+        return np.empty(0, dtype=np.int64)
+    if p >= 1:
+        return np.arange(n, dtype=np.int64)
+    positions = []
+    last = -1
+    while last < n:
+        gaps = rng.geometric(p, size=int(n * p * 1.1) + 16)
+        chunk = last + np.cumsum(gaps, dtype=np.int64)
+        positions.append(chunk)
+        last = int(chunk[-1])
+    positions = np.concatenate(positions)
+    return positions[:np.searchsorted(positions, n)]
+
+
+#Function to map positions in the concatenation of frames of `sizes` bits to (frame index, bit in frame).
+def _split_positions(positions, sizes):
+    ends = np.cumsum(sizes)
+    frame_idx = np.searchsorted(ends, positions, side='right')
+    return frame_idx, positions - (ends[frame_idx] - sizes[frame_idx])
+
+
+class BitErrorChannel(Channel):
+    def __init__(self, ber, seed=None):
+        super().__init__(seed)
+        self.ber = ber
+
+    def _frame_positions(self, nbits):
+        return _bernoulli_positions(self.rng, nbits, self.ber)
+
+    def _batch_positions_np(self, sizes):
+        return _split_positions(_bernoulli_positions_np(self.np_rng, int(sizes.sum()), self.ber), sizes)
+
+    def __repr__(self):
+        return f'BitErrorChannel(ber={self.ber})'
+
+
+class GilbertElliottChannel(Channel):
+    def __init__(self, p_gb, p_bg, ber_good=0.0, ber_bad=0.5, seed=None):
+        super().__init__(seed)
+        self.p_gb = p_gb
+        self.p_bg = p_bg
+        self.ber_good = ber_good
+        self.ber_bad = ber_bad
+        self.bad = True   # current state; the first run switches it to good
+        self.left = 0     # bits left in the current run of that state
+
+    #Function to cut the next n bits into runs of the two states: [(start, length, bad), ...].
+    def _runs(self, n):
+        runs = []
+        pos = 0
+        while pos < n:
+            if not self.left:
+                self.bad = not self.bad
+                # run length ~ geometric(probability of leaving the state)
+                p = self.p_bg if self.bad else self.p_gb
+                if p <= 0:
+                    self.left = sys.maxsize
+                elif p >= 1:
+                    self.left = 1
+                else:
+                    self.left = 1 + int(math.log(1.0 - self.rng.random()) / math.log1p(-p))
+            length = min(self.left, n - pos)
+            runs.append((pos, length, self.bad))
+            self.left -= length
+            pos += length
+        return runs
+
+    def _frame_positions(self, nbits):
+        positions = []
+        for start, length, bad in self._runs(nbits):
+            positions.extend(start + bit for bit in
+                             _bernoulli_positions(self.rng, length, self.ber_bad if bad else self.ber_good))
+        return positions
+
+    #The same as _runs() for NumPy: arrays of run starts, lengths and states (1 = bad).
+    def _runs_np(self, n):
+        rng = self.np_rng
+        starts, lengths, states = [], [], []
+        pos = 0
+        while pos < n:
+            if self.left:
+                length = min(self.left, n - pos)
+                starts.append([pos]), lengths.append([length]), states.append([int(self.bad)])
+                self.left -= length
+                pos += length
+                continue
+            # a batch of alternating runs, starting with the other state
+            first, second = (self.p_bg, self.p_gb) if not self.bad else (self.p_gb, self.p_bg)
+            mean = sum(1 / p if p > 0 else n for p in (first, second))
+            k = int((n - pos) / mean) + 4
+            run = np.empty(2 * k, dtype=np.int64)
+            for slot, p in ((0, first), (1, second)):
+                run[slot::2] = rng.geometric(p, k) if 0 < p < 1 else (1 if p >= 1 else n)
+            state = np.empty(2 * k, dtype=np.int64)
+            state[0::2], state[1::2] = int(not self.bad), int(self.bad)
+            ends = pos + np.cumsum(run)
+            last = min(int(np.searchsorted(ends, n)), 2 * k - 1)
+            starts.append(ends[:last + 1] - run[:last + 1]), lengths.append(run[:last + 1]), states.append(state[:last + 1])
+            self.bad = bool(state[last])
+            self.left = max(0, int(ends[last]) - n)
+            lengths[-1][-1] -= self.left
+            pos = int(ends[last]) - self.left
+        return np.concatenate(starts), np.concatenate(lengths), np.concatenate(states)
+
+    def _batch_positions_np(self, sizes):
+        # runs come from a vectorized walk of the chain; the flips inside the runs of each state
+        # are then drawn in one pass
+        starts, lengths, states = self._runs_np(int(sizes.sum()))
+        runs = np.stack((starts, lengths, states), axis=1)
+        positions = []
+        for bad, ber in ((0, self.ber_good), (1, self.ber_bad)):
+            state_runs = runs[runs[:, 2] == bad]
+            if not len(state_runs):
+                continue
+            idx, offset = _split_positions(_bernoulli_positions_np(self.np_rng, int(state_runs[:, 1].sum()), ber),
+                                           state_runs[:, 1])
+            positions.append(state_runs[idx, 0] + offset)
+        positions = np.sort(np.concatenate(positions)) if positions else np.empty(0, dtype=np.int64)
+        return _split_positions(positions, sizes)
+
+    def __repr__(self):
+        return (f'GilbertElliottChannel(p_gb={self.p_gb}, p_bg={self.p_bg}, ber_good={self.ber_good}, '
+                f'ber_bad={self.ber_bad})')
+
+
+class FixedFlipsChannel(Channel):
+    def __init__(self, flips=1, error_prob=0.1, seed=None):
+        super().__init__(seed)
+        self.flips = flips
+        self.error_prob = error_prob
+
+    def _frame_positions(self, nbits):
+        if not self.flips or self.rng.random() >= self.error_prob:
+            return ()
+        return self.rng.sample(range(nbits), min(self.flips, nbits))
+
+    def _batch_positions_np(self, sizes):
+        rng = self.np_rng
+        hit = np.flatnonzero((rng.random(len(sizes)) < self.error_prob) & (sizes > 0)) if self.flips else \
+            np.empty(0, dtype=np.int64)
+        flips = np.minimum(self.flips, sizes[hit])
+        frame_idx = np.repeat(hit, flips)
+        bits = (rng.random(len(frame_idx)) * np.repeat(sizes[hit], flips)).astype(np.int64)
+        # the K positions in a frame must differ: redraw the (rare) repeats until there are none
+        while True:
+            order = np.lexsort((bits, frame_idx))
+            frame_idx, bits = frame_idx[order], bits[order]
+            repeats = np.flatnonzero((np.diff(frame_idx) == 0) & (np.diff(bits) == 0)) + 1
+            if not len(repeats):
+                return frame_idx, bits
+            bits[repeats] = (rng.random(len(repeats)) * sizes[frame_idx[repeats]]).astype(np.int64)
+
+    def __repr__(self):
+        return f'FixedFlipsChannel(flips={self.flips}, error_prob={self.error_prob})'
+
+
+#Function to build a channel from a spec (see the top of this file), e.g. 'ber:1e-4' or 'flips:1@0.1'.
+def make_channel(spec, seed=None):
+    kind, _, args = spec.strip().lower().partition(':')
+    try:
+        if kind == 'none':
+            return FixedFlipsChannel(0, 0.0, seed)
+        if kind == 'flips':
+            flips, _, prob = args.partition('@')
+            return FixedFlipsChannel(int(flips or 1), float(prob or 1.0), seed)
+        if kind == 'ber':
+            return BitErrorChannel(float(args), seed)
+        if kind == 'ge':
+            return GilbertElliottChannel(*(float(x) for x in args.split(',')), seed=seed)
+    except (TypeError, ValueError):
+        pass
+    raise ValueError(f'Bad channel spec: {spec} (expected none, flips:K@P, ber:R or ge:PGB,PBG[,RG,RB])')
@@ -0,0 +1,347 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_right
+from crc import get_model
+from framing import FrameReader, FramingError, pack_frame, trailer_size, HEADER, HEADER_SIZE, MAGIC, MSG
+
+# Persistent chat history: python -m server --history DIR
+# An append-only log of chat lines split into segments. A segment file holds complete MSG frames
+# back to back, exactly as a client on LOG_MODEL receives them, so replaying a range to such a
+# client is one memory-mapped slice per segment and nothing is re-encoded; the frame CRC also
+# checks every record when the log is recovered. Record n is the n-th line ever logged (its
+# sequence number); a segment is named after the sequence number of its first record.
+# Next to each segment, a sparse index holds (seq, timestamp, offset) for every INDEX_INTERVAL-th
+# record; a lookup bisects the index and walks frame headers from there.
+# Appends are buffered and written by a background thread in batches, with one fsync per batch
+# (group commit), so a burst of lines costs one write and one fsync, not one per line.
+#   DIR/00000000000000000000.log   frames of records 0 ...
+#   DIR/00000000000000000000.idx   INDEX entries for that segment
+
+LOG_MODEL = get_model('crc-32')
+INDEX = struct.Struct('<QQQ')  # seq, timestamp (ms since the epoch), byte offset in the segment
+INDEX_INTERVAL = 64
+SEGMENT_BYTES = 16 * 1024 * 1024
+FLUSH_INTERVAL = 0.05  # seconds a line may wait before its batch is written
+BATCH = 512            # pending lines that trigger a write right away
+_TRAILER = trailer_size(LOG_MODEL)
+
+
+def _name(base, ext):
+    return f'{base:020d}.{ext}'
+
+
+#Function to walk the frames of a segment from `offset` (record `seq`) up to record `stop` or the
+#end of the complete frames. Returns (offset, seq) where it stopped.
+def _walk(data, offset, seq, stop=None, end=None):
+    end = len(data) if end is None else end
+    while stop is None or seq < stop:
+        if offset + HEADER_SIZE > end:
+            break
+        magic, _, _, length = HEADER.unpack_from(data, offset)
+        size = HEADER_SIZE + length + _TRAILER
+        if magic != MAGIC or offset + size > end:
+            break
+        offset += size
+        seq += 1
+    return offset, seq
+
+
+#Read side: finds and maps records. Used on its own by worker processes (the supervisor writes).
+class LogReader:
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = []  # base sequence numbers, ascending
+        self.index = {}     # base -> [(seq, ts, offset)], every INDEX_INTERVAL-th record
+        self._maps = {}     # base -> mmap of a sealed segment (they never change)
+        #Client threads (head() in the handshake) and the bus thread (read()) use one reader at
+        #once; refreshing and reading hold this, so the index is never loaded twice over
+        self.read_lock = threading.RLock()
+
+    def _path(self, base, ext):
+        return os.path.join(self.directory, _name(base, ext))
+
+    #Function to pick up segments and index entries written since the last call.
+    def refresh(self):
+        with self.read_lock:
+            self._refresh()
+
+    def _refresh(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        stale = set(self.segments[-2:])  # may have grown since the last call, even if sealed now
+        for base in sorted(int(name[:-4]) for name in names if name.endswith('.log') and name[:-4].isdigit()):
+            if base not in self.index:
+                self.segments.append(base)
+                self.index[base] = []
+                stale.add(base)
+        self.segments.sort()
+        stale.update(self.segments[-2:])
+        for base in sorted(stale):
+            self._load_index(base)
+
+    def _load_index(self, base):
+        entries = self.index[base]
+        try:
+            with open(self._path(base, 'idx'), 'rb') as f:
+                f.seek(len(entries) * INDEX.size)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        entries.extend(INDEX.iter_unpack(data[:len(data) - len(data) % INDEX.size]))
+
+    #Function to map a segment. Sealed segments stay mapped; the last one is mapped per read.
+    def _map(self, base):
+        cached = self._maps.get(base)
+        if cached is not None:
+            return cached
+        with open(self._path(base, 'log'), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+        if base != self.segments[-1] and size:
+            self._maps[base] = data
+        return data
+
+    #Function to find where record `seq` starts in segment `base` (None: the end of its complete
+    #records), from the sparse index. Returns (offset, seq) as _walk does.
+    def _seek(self, base, data, seq=None):
+        entries = self.index[base]
+        i = len(entries) if seq is None else bisect_right(entries, (seq, float('inf')))
+        start_seq, _, offset = entries[i - 1] if i else (base, 0, 0)
+        return _walk(data, offset, start_seq, stop=seq)
+
+    #Sequence number the next record will get (records below it are readable).
+    def head(self):
+        with self.read_lock:
+            self.refresh()
+            if not self.segments:
+                return 0
+            base = self.segments[-1]
+            return self._seek(base, self._map(base))[1]
+
+    #Function to get the first record at or after `timestamp` (seconds since the epoch), to the
+    #index granularity: the result may be up to INDEX_INTERVAL records early, never late.
+    def seq_at(self, timestamp):
+        with self.read_lock:
+            self.refresh()
+            ms = int(timestamp * 1000)
+            found = None
+            for base in reversed(self.segments):
+                entries = self.index[base]
+                before = [entry for entry in entries if entry[1] < ms]
+                if before:
+                    return before[-1][0]
+                found = base
+            return found if found is not None else 0
+
+    #Function to read the records from `since` (a sequence number) on, or the last `last` records,
+    #or both (the last ones after `since`). Returns (first seq, record count, list of byte ranges),
+    #each range being complete frames back to back, ready to send to a LOG_MODEL client.
+    def read(self, since=None, last=None):
+        with self.read_lock:
+            return self._read(since, last)
+
+    def _read(self, since, last):
+        head = self.head()
+        first = 0 if since is None else max(0, since)
+        if last is not None:
+            first = max(first, head - max(0, last))
+        if first >= head:
+            return head, 0, []
+        chunks = []
+        i = max(0, bisect_right(self.segments, first) - 1)
+        for base in self.segments[i:]:
+            data = self._map(base)
+            start, seq = self._seek(base, data, max(first, base)) if first > base else (0, base)
+            end, _ = _walk(data, start, seq)
+            if end > start:
+                chunks.append(bytes(data[start:end]))
+        return first, head - first, chunks
+
+    #Nothing to write on the read side.
+    def flush(self, sync=True):
+        pass
+
+    def close(self):
+        for data in self._maps.values():
+            data.close()
+        self._maps.clear()
+
+    def __str__(self):
+        return f'{self.directory} (read-only)'
+
+
+class LogStats:
+    def __init__(self):
+        self.records = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.bytes = 0
+        self.segments = 0
+        self.replays = 0
+
+    def __str__(self):
+        return ' '.join(f'{key}={value}' for key, value in vars(self).items())
+
+
+#Write side: one per log directory (the server, or the supervisor of a sharded server).
+class ChatLog(LogReader):
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, flush_interval=FLUSH_INTERVAL, batch=BATCH,
+                 sync=True):
+        super().__init__(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.batch = batch
+        self.sync = sync
+        self.stats = LogStats()
+        self.pending = []  # (seq, timestamp ms, frame) not written yet
+        self.lock = threading.Lock()        # guards pending and next_seq
+        self.write_lock = threading.Lock()  # one batch written at a time
+        self.wake = threading.Event()
+        self.closed = False
+        self.recovered_bad = 0  # records with a bad CRC found when the log was opened
+        self.refresh()
+        self._recover()
+        self.thread = threading.Thread(target=self._flusher, name='chatlog', daemon=True)
+        self.thread.start()
+
+    #Function to open the last segment for appending, cutting off a frame left half-written by a crash.
+    def _recover(self):
+        if not self.segments:
+            self._open_segment(0)
+            self.next_seq = 0
+            return
+        base = self.segments[-1]
+        with open(self._path(base, 'log'), 'rb') as f:
+            data = f.read()
+        entries = self.index[base]
+        offset, seq = _walk(data, 0, base)
+        # records past the last good one (a torn write) are dropped, with their index entries
+        while entries and entries[-1][2] >= offset:
+            entries.pop()
+        self.recovered_bad = len(payloads([data[:offset]], checked=False))
+        self.active = open(self._path(base, 'log'), 'r+b')
+        self.active.truncate(offset)
+        self.active.seek(offset)
+        self.active_index = open(self._path(base, 'idx'), 'r+b' if os.path.exists(self._path(base, 'idx')) else 'w+b')
+        self.active_index.truncate(len(entries) * INDEX.size)
+        self.active_index.seek(0, os.SEEK_END)
+        self.active_base, self.active_size, self.next_seq = base, offset, seq
+
+    def _open_segment(self, base):
+        self.active = open(self._path(base, 'log'), 'ab')
+        self.active_index = open(self._path(base, 'idx'), 'ab')
+        self.active_base, self.active_size = base, 0
+        if base not in self.index:
+            self.segments.append(base)
+            self.index[base] = []
+        self.stats.segments += 1
+
+    #Function to log a chat line (payload bytes). Returns its sequence number; the line is on disk
+    #after the next batch (at most flush_interval seconds later).
+    def append(self, payload, timestamp=None):
+        frame = pack_frame(MSG, payload, LOG_MODEL)
+        ms = int((time.time() if timestamp is None else timestamp) * 1000)
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.pending.append((seq, ms, frame))
+            if len(self.pending) >= self.batch:
+                self.wake.set()
+        return seq
+
+    def head(self):
+        return self.next_seq
+
+    def _flusher(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush(self.sync)
+
+    #Function to write the pending lines now, with one write per segment and (if `sync`) one fsync.
+    def flush(self, sync=True):
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if not pending:
+                return
+            parts, entries = [], []
+            for seq, ms, frame in pending:
+                if self.active_size >= self.segment_bytes:
+                    self._write(parts, entries, sync=True)
+                    parts, entries = [], []
+                    self.active.close()
+                    self.active_index.close()
+                    self._open_segment(seq)
+                if (seq - self.active_base) % INDEX_INTERVAL == 0:
+                    entries.append((seq, ms, self.active_size))
+                parts.append(frame)
+                self.active_size += len(frame)
+            self._write(parts, entries, sync)
+            self.stats.records += len(pending)
+            self.stats.batches += 1
+
+    def _write(self, parts, entries, sync):
+        if parts:
+            data = b''.join(parts)
+            self.active.write(data)
+            self.stats.bytes += len(data)
+        if entries:
+            self.active_index.write(b''.join(INDEX.pack(*entry) for entry in entries))
+            self.index[self.active_base].extend(entries)
+        self.active.flush()
+        self.active_index.flush()
+        if sync:
+            os.fsync(self.active.fileno())
+            os.fsync(self.active_index.fileno())
+            self.stats.fsyncs += 1
+
+    #Reads see every appended line: anything still pending is written first (without an fsync).
+    def read(self, since=None, last=None):
+        self.flush(sync=False)
+        self.stats.replays += 1
+        return super().read(since, last)
+
+    def refresh(self):
+        if not self.segments:
+            super().refresh()
+
+    def __str__(self):
+        return f'{self.directory}: {self.stats}'
+
+    def close(self):
+        self.closed = True
+        self.wake.set()
+        self.thread.join()
+        self.flush(sync=True)
+        self.active.close()
+        self.active_index.close()
+        super().close()
+
+
+#Function to turn replayed ranges into frames for a client on `model`: the ranges as they are for
+#LOG_MODEL, otherwise one frame per record re-encoded for the client's model.
+def frames_for(chunks, model):
+    if model is LOG_MODEL:
+        return chunks
+    return [pack_frame(MSG, payload, model) for payload in payloads(chunks)]
+
+
+#Function to get the payload of every record in replayed ranges (e.g. for an ARQ session).
+#With checked=False it returns the records whose CRC does not match instead.
+def payloads(chunks, checked=True):
+    out = []
+    for chunk in chunks:
+        reader = FrameReader(LOG_MODEL, size=len(chunk) or 1)
+        reader.feed(chunk)
+        try:
+            out.extend(bytes(frame.payload) for frame in reader.frames() if frame.ok == checked)
+        except FramingError:
+            pass
+    return out
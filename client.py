@@ -1,29 +1,61 @@
 # client.py
-import socket
+import asyncio
 import threading
-import tkinter as tk
-from tkinter import scrolledtext
-from crc import encode_message, decode_message, introduce_error
+import aclient
+
+# Tk chat client. The connection itself is an aclient.ChatClient (handshake, CRC checks, ARQ, FEC,
+# compression) running on an asyncio event loop in a background thread; this module only turns
+# button presses into calls on it and shows the messages it yields.
+# Importing it has no side effects: tkinter is loaded and the window built by main() (python client.py).
 
 PORT = 1234
-client_socket = None
-receive_thread = None
+# CRC models offered to the server at connect time, strongest first
+CRC_OFFER = aclient.CRC_OFFER
+# reliable delivery: window asked for at connect time (0 = plain drop-and-notify, see arq.py)
+ARQ_WINDOW = aclient.ARQ_WINDOW
+# forward error correction codecs to offer, e.g. 'rs:16' or 'hamming:16,rs:16' ('' = CRC only, see fec.py)
+FEC_OFFER = ''
+# compression codecs to offer, best first ('' = none, see compress.py)
+COMPRESS_OFFER = aclient.COMPRESS_OFFER
+# chat lines to ask for on joining, from servers that keep a log (--history); 0 = none
+HISTORY = 50
+# simulated noisy link for outgoing chat (see channel.py): the original 10% chance of one flipped bit.
+# Each connection gets its own channel; set CHANNEL_SEED to replay the same errors.
+CHANNEL = 'flips:1@0.1'
+CHANNEL_SEED = None
+# the current aclient.ChatClient, and the event loop (in its own thread) it runs on
+session = None
+loop = None
 connected = False
 
-# display text in window
+# widgets, created by build_gui()
+root = None
+entry_ip = entry_port = entry_name = entry_msg = None
+btn_connect = btn_disconnect = btn_send = None
+txt = None
+log_pipeline = None
+
+# how often queued log lines are flushed into the window, and how many lines it keeps
+LOG_FLUSH_MS = 50
+SCROLLBACK_LINES = 1000
+
+# display text in window: lines from any thread are queued and written in batches
 def gui_log(message):
-    def append():
-        txt.configure(state='normal')
-        txt.insert(tk.END, message + '\n')
-        txt.see(tk.END)
-        txt.configure(state='disabled')
-    try:
-        root.after(0, append)
-    except Exception:
-        append()
+    if log_pipeline is None:
+        print(message)
+    else:
+        log_pipeline(message)
+
+# runs a coroutine on the client's event loop (started on first use) and waits for its result
+def run(coro, timeout=None):
+    global loop
+    if loop is None:
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name='event-loop', daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
 
 def connect_to_server():
-    global client_socket, receive_thread, connected
+    global session, connected
     if connected:
         gui_log('Already connected')
         return
@@ -39,163 +71,84 @@ def connect_to_server():
     except ValueError:
         gui_log('Port must be a number')
         return
-    # create tcp socket object
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # establish connection
-    try:
-        client_socket.connect((server_ip, port))
-    except Exception as e:
-        gui_log(f'Connection failed: {e}')
-        client_socket = None
-        return
 
-    # appends CRC bits to the username string and encdoded to send to server
-    name_msg = encode_message(name)
+    # the HELLO frame carries the name and what we support; the server answers with what it picked
+    session = aclient.ChatClient(name, CRC_OFFER, ARQ_WINDOW, FEC_OFFER, COMPRESS_OFFER, HISTORY, CHANNEL,
+                                 CHANNEL_SEED, log=gui_log)
     try:
-        client_socket.send(name_msg.encode())
+        options = run(session.connect(server_ip, port))
     except Exception as e:
-        gui_log(f'Failed to send name: {e}')
-        client_socket.close()
-        client_socket = None
+        gui_log(f'Connection failed: {e}')
+        session = None
         return
 
     connected = True
-    gui_log(f'Connected to {server_ip}:{port} as {name}')
+    model = session.model
+    gui_log(f'Connected to {server_ip}:{port} as {name} (CRC: {options.get("crc")}'
+            + (f', FEC: {model.fec.spec}' if model.fec else '')
+            + (f', compression: {model.compression.spec}' if model.compression else '')
+            + (f', ARQ window {options["arq"]})' if int(options.get('arq', 0)) else ')'))
     set_connected_state(True)
-    # create a background thread for listening for incoming messages from the server
-    receive_thread = threading.Thread(target=receive_messages, daemon=True)
-    receive_thread.start()
+    # messages are shown as the session yields them, on the event loop
+    asyncio.run_coroutine_threadsafe(receive_messages(session), loop)
 
 def disconnect_from_server():
-    global client_socket, connected
-    if not connected or client_socket is None:
+    global connected
+    if not connected or session is None:
         gui_log('Not connected')
         return
+    connected = False
     try:
-        bye_msg = encode_message('[bye]')
-        client_socket.send(bye_msg.encode())
-    except:
-        pass
-    try:
-        client_socket.close()
-    except:
+        run(session.disconnect(), timeout=5)
+    except Exception:
         pass
-    client_socket = None
-    connected = False
+    for line in session.stats():
+        gui_log(line)
     gui_log('Disconnected')
     set_connected_state(False)
 
-def receive_messages():
-    global client_socket, connected
-    while connected and client_socket:
-        try:
-            # read up to 4096 bytes from the server
-            msg = client_socket.recv(4096).decode()
-            if not msg:
-                gui_log('Disconnected from server.')
-                break
-            
-            text, ok = decode_message(msg)
-            if not ok:
-                gui_log('[CRC ERROR] Error detected in incoming message from server!')
-                continue
-
-            if text.lower().startswith('server is shutting down'):
-                gui_log('Server is shutting down...')
-                try:
-                    root.after(0, root.destroy)
-                except Exception:
-                    pass
-                break
-            # display crc-verified message
-            gui_log(text)
-        except Exception:
+async def receive_messages(current):
+    global connected
+    async for text in current:
+        if text.lower().startswith(aclient.SHUTDOWN):
+            gui_log('Server is shutting down...')
+            try:
+                root.after(0, root.destroy)
+            except Exception:
+                pass
             break
-    try:
-        if client_socket:
-            client_socket.close()
-    except:
-        pass
-    client_socket = None
-    connected = False
-    set_connected_state(False)
+        # display crc-verified message
+        gui_log(text)
+    # the server (not the Disconnect button) ended this session
+    if current is session and connected:
+        gui_log('Disconnected from server.')
+        connected = False
+        set_connected_state(False)
 
 def send_message():
-    global client_socket, connected
-    if not connected or client_socket is None:
+    global connected
+    if not connected or session is None:
         gui_log('Not connected')
         return
     msg = entry_msg.get().strip()
     if not msg:
         return
 
-    msg_crc = encode_message(msg)
-    msg_crc = introduce_error(msg_crc, error_prob=0.1)
-
     try:
-        client_socket.send(msg_crc.encode())
+        # with ARQ the line is numbered and kept until the server ACKs it; "[bye]" also closes the connection
+        run(session.send(msg), timeout=5)
     except Exception as e:
         gui_log(f'Failed to send: {e}')
-        entry_msg.delete(0, tk.END)
+        entry_msg.delete(0, 'end')
         return
     
     gui_log(f'You: {msg}')
 
     if msg == '[bye]':
-        try:
-            client_socket.close()
-        except:
-            pass
         connected = False
         set_connected_state(False)
 
-    entry_msg.delete(0, tk.END)
-
-# tkinter gui
-# client window
-root = tk.Tk()
-root.title('Chat Client')
-
-# connection input fields
-frame_top = tk.Frame(root)
-frame_top.grid(row=0, column=0, padx=8, pady=8)
-
-# server IP input field
-tk.Label(frame_top, text='Server IP:').grid(row=0, column=0)
-entry_ip = tk.Entry(frame_top, width=15)
-entry_ip.grid(row=0, column=1)
-
-# port input field w/ default value
-tk.Label(frame_top, text='Port:').grid(row=0, column=2)
-entry_port = tk.Entry(frame_top, width=6)
-entry_port.grid(row=0, column=3)
-entry_port.insert(0, str(PORT))
-
-# name imput field
-tk.Label(frame_top, text='Your Name:').grid(row=0, column=4)
-entry_name = tk.Entry(frame_top, width=15)
-entry_name.grid(row=0, column=5)
-
-btn_connect = tk.Button(frame_top, text='Connect', width=10, command=connect_to_server)
-btn_connect.grid(row=0, column=6, padx=6)
-
-btn_disconnect = tk.Button(frame_top, text='Disconnect', width=10, command=disconnect_from_server)
-btn_disconnect.grid(row=0, column=7)
-
-# a scrollable text box where chat messages will appear
-txt = scrolledtext.ScrolledText(root, state='disabled', width=60, height=20)
-txt.grid(row=1, column=0, padx=8, pady=4)
-
-frame_bottom = tk.Frame(root)
-frame_bottom.grid(row=2, column=0, padx=8, pady=4)
-
-# input message field
-entry_msg = tk.Entry(frame_bottom, width=50)
-entry_msg.grid(row=0, column=0)
-
-# send button
-btn_send = tk.Button(frame_bottom, text='Send', width=10, command=send_message)
-btn_send.grid(row=0, column=1, padx=6)
+    entry_msg.delete(0, 'end')
 
 def set_connected_state(is_connected):
     # button and field state changes must run in main thread
@@ -218,6 +171,8 @@ def set_connected_state(is_connected):
                 entry_name.config(state='disabled')
             except Exception:
                 pass
+    if root is None:
+        return
     try:
         root.after(0, apply)
     except Exception:
@@ -227,10 +182,69 @@ def on_closing():
     disconnect_from_server()
     root.destroy()
 
-root.protocol('WM_DELETE_WINDOW', on_closing)
+# tkinter gui
+def build_gui():
+    global root, entry_ip, entry_port, entry_name, entry_msg, btn_connect, btn_disconnect, btn_send, txt, log_pipeline
+    import tkinter as tk
+    from tkinter import scrolledtext
+    from guilog import LogPipeline
 
-if __name__ == '__main__':
+    # client window
+    root = tk.Tk()
+    root.title('Chat Client')
+
+    # connection input fields
+    frame_top = tk.Frame(root)
+    frame_top.grid(row=0, column=0, padx=8, pady=8)
+
+    # server IP input field
+    tk.Label(frame_top, text='Server IP:').grid(row=0, column=0)
+    entry_ip = tk.Entry(frame_top, width=15)
+    entry_ip.grid(row=0, column=1)
+
+    # port input field w/ default value
+    tk.Label(frame_top, text='Port:').grid(row=0, column=2)
+    entry_port = tk.Entry(frame_top, width=6)
+    entry_port.grid(row=0, column=3)
+    entry_port.insert(0, str(PORT))
+
+    # name imput field
+    tk.Label(frame_top, text='Your Name:').grid(row=0, column=4)
+    entry_name = tk.Entry(frame_top, width=15)
+    entry_name.grid(row=0, column=5)
+
+    btn_connect = tk.Button(frame_top, text='Connect', width=10, command=connect_to_server)
+    btn_connect.grid(row=0, column=6, padx=6)
+
+    btn_disconnect = tk.Button(frame_top, text='Disconnect', width=10, command=disconnect_from_server)
+    btn_disconnect.grid(row=0, column=7)
+
+    # a scrollable text box where chat messages will appear
+    txt = scrolledtext.ScrolledText(root, state='disabled', width=60, height=20)
+    txt.grid(row=1, column=0, padx=8, pady=4)
+    log_pipeline = LogPipeline(root, txt, LOG_FLUSH_MS, SCROLLBACK_LINES)
+
+    frame_bottom = tk.Frame(root)
+    frame_bottom.grid(row=2, column=0, padx=8, pady=4)
+
+    # input message field
+    entry_msg = tk.Entry(frame_bottom, width=50)
+    entry_msg.grid(row=0, column=0)
+
+    # send button
+    btn_send = tk.Button(frame_bottom, text='Send', width=10, command=send_message)
+    btn_send.grid(row=0, column=1, padx=6)
+
+
+    root.protocol('WM_DELETE_WINDOW', on_closing)
     # initial button states
     btn_disconnect.config(state='disabled')
     btn_send.config(state='disabled')
+    return root
+
+def main():
+    build_gui()
     root.mainloop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import struct
+import threading
+import metrics
+import notices
+import rooms
+from chatlog import ChatLog, LogReader
+from crc import get_model
+from logsink import make_sink
+from shmring import SharedRing, EXTERNAL
+from framing import (Frame, FrameCache, FrameReader, pack_frame, split_seq, trailer_size, HEADER, HEADER_SIZE,
+                     SEQ_MOD)
+
+# Sharded server: python -m server --workers N
+# The supervisor process starts N worker processes. Each runs a normal engine (thread or asyncio)
+# listening on the same port with SO_REUSEPORT, so the kernel spreads new connections over them
+# and each worker owns the clients it accepted. Workers are joined by a broadcast bus: one
+# socketpair per worker to a hub in the supervisor. A worker publishes every chat line, join and
+# notice to the hub instead of broadcasting it; the hub numbers each event and sends the same frame
+# to every worker (the publisher included), and each worker fans it out to its own clients.
+# So a line reaches every client exactly once, and all clients see joins, leaves and chat in one
+# global order. A new client only becomes a recipient when its JOIN comes back from the hub.
+# Its worker picks the room its lines go to when it publishes the JOIN (or a room change), though:
+# lines the client sends before the event comes back are published for that room, behind the event.
+# Bus frames use the normal frame format; the payload starts with the publishing worker and the
+# session id of the client it is about (0 for none), and the hub appends a sequence tag.
+# Rooms (rooms.py): each worker indexes its own clients by room. Chat lines and notices carry the
+# rooms they are for, and "[join ROOM]" / "[leave ROOM]" go through the hub as well, so a client
+# starts (or stops) getting a room's lines at the same point of the global order on every worker.
+# With --history the hub appends every chat line of rooms.DEFAULT to the log in bus order and writes out the
+# pending lines before it forwards a JOIN, so the worker replaying history to the new client
+# (from the log files) sees every line ordered before the join.
+# With --metrics-port P, worker N serves its own metrics on port P + N.
+# Transport from the hub to the workers (--bus):
+#   shm     the hub writes each numbered frame once into a shared-memory ring (shmring.py) and
+#           every worker reads it in place; the socketpair only carries a doorbell to a worker
+#           that is idle, and the odd frame too big for a ring slot (a placeholder entry in the
+#           ring keeps its place in the order). A worker that falls a whole ring behind loses
+#           the overwritten events and logs how many.
+#   socket  the hub sends every frame down every worker's socketpair.
+
+BUS_MODEL = get_model('crc-32')
+ORIGIN = struct.Struct('>HI')  # worker number, session id
+
+# bus frame types (only used between the supervisor and its workers)
+BUS_JOIN = 16    # a client finished its handshake; data: "name\nroom,room"
+BUS_NOTICE = 17  # server notice; data: "room,room\ntext" ("*" for every client)
+BUS_MSG = 18     # chat line; data: "room\nname: text", for the room's members but the sender
+BUS_WAKE = 19    # hub -> worker doorbell: there are new entries in the ring
+BUS_ROOM = 20    # a client joins or leaves a room; data: "join|leave\nroom\nname"
+
+WAKE_TIMEOUT = 0.05  # an idle worker also checks the ring this often, in case a doorbell was missed
+_DOORBELL = pack_frame(BUS_WAKE, b'', BUS_MODEL)
+_DEFAULT_ROOM = rooms.DEFAULT.encode()
+
+
+#Function to parse a complete bus frame held in a ring slot, without copying it out.
+def _parse(view):
+    _, ftype, flags, length = HEADER.unpack_from(view)
+    payload = view[HEADER_SIZE:HEADER_SIZE + length]
+    trailer = view[HEADER_SIZE + length:HEADER_SIZE + length + trailer_size(BUS_MODEL)]
+    ok = len(payload) == length and BUS_MODEL.compute(payload) == int.from_bytes(trailer, 'big')
+    return Frame(ftype, flags, payload, ok)
+
+
+#Worker side of the bus. `sessions` and `broadcast` are the engine's registry and broadcast_raw;
+#`call` runs a function on the engine's own thread (aserver._call_on_loop), if it has one;
+#`ring` is this worker's shmring.RingReader with the shm transport.
+class WorkerBus:
+    def __init__(self, link, worker, sessions, broadcast, call=None, log=print, ring=None):
+        self.link = link
+        self.ring = ring
+        self.external = False  # the ring is at a placeholder: the frame itself comes down the link
+        self.worker = worker
+        self.sessions = sessions
+        self.broadcast = broadcast
+        self.call = call or (lambda func, *args: func(*args))
+        self.log = log
+        self.local = {}  # session id -> Session, for clients of this worker that joined the bus
+        self.replays = {}  # session id -> function sending that client its history before it joins
+        self.lock = threading.Lock()
+        self.expected = 0
+        self.published = 0
+        self.delivered = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._receive, name='bus', daemon=True)
+        self.thread.start()
+
+    #Function to announce a client; it is added to the registry when the hub sends the JOIN back
+    #(after `replay()`, if given, has queued its history). Its lines go to wanted[0] from now on.
+    def join(self, session, replay=None, wanted=(rooms.DEFAULT,)):
+        self.local[session.id] = session
+        session.room = wanted[0]
+        if replay is not None:
+            self.replays[session.id] = replay
+        self._publish(BUS_JOIN, session.id, f'{session.name}\n{",".join(wanted)}'.encode())
+
+    #Function to send a notice to the members of `in_rooms`, or to every client.
+    def notice(self, text, in_rooms=None):
+        target = '*' if in_rooms is None else ','.join(in_rooms)
+        self._publish(BUS_NOTICE, 0, f'{target}\n{text}'.encode())
+
+    def chat(self, session, room, payload):
+        self._publish(BUS_MSG, session.id, room.encode() + b'\n' + payload)
+
+    def room(self, session, verb, room):
+        session.room = rooms.switched(session, verb, room)
+        self._publish(BUS_ROOM, session.id, f'{verb}\n{room}\n{session.name}'.encode())
+
+    #Function to forget a client that disconnected (its events already on the bus are still delivered).
+    def forget(self, session):
+        self.local.pop(session.id, None)
+        self.replays.pop(session.id, None)
+
+    def _publish(self, ftype, member, data):
+        frame = pack_frame(ftype, ORIGIN.pack(self.worker, member % SEQ_MOD) + data, BUS_MODEL)
+        with self.lock:
+            try:
+                self.link.sendall(frame)
+                self.published += 1
+            except OSError:
+                pass  # the supervisor is gone and will not forward anything any more
+
+    def _receive(self):
+        if self.ring is None:
+            try:
+                for frame in FrameReader(BUS_MODEL).iter_socket(self.link):
+                    self._handle(frame)
+            except OSError:
+                pass
+            return
+
+        reader = FrameReader(BUS_MODEL)
+        while True:
+            for frame in reader.frames():
+                if frame.type == BUS_WAKE:
+                    continue
+                # a frame too big for the ring: deliver what comes before its placeholder first
+                self._drain()
+                self._handle(frame)
+                self.external = False
+            self._drain()
+            # ask for a doorbell, then look once more so an entry written meanwhile is not missed
+            self.ring.waiting()
+            self._drain()
+            try:
+                readable, _, _ = select.select([self.link], [], [], WAKE_TIMEOUT)
+                received = reader.recv_into(self.link) if readable else True
+            except (OSError, ValueError):
+                received = False
+            self.ring.waiting(False)
+            if not received:
+                return
+
+    #Function to deliver the entries waiting in the ring, up to a placeholder.
+    def _drain(self):
+        while not self.external:
+            entry = self.ring.read()
+            if entry is None:
+                break
+            seq, flags, view = entry
+            if flags & EXTERNAL:
+                self.external = True
+                break
+            event = self._event(_parse(view))
+            del view
+            if self.ring.check(seq) and event is not None:
+                self.call(self._dispatch, *event)
+        if self.ring.lost:
+            self.log(f'[BUS] ring overflow: {self.ring.lost} events lost')
+            self.ring.lost = 0
+
+    def _handle(self, frame):
+        event = self._event(frame)
+        if event is not None:
+            self.call(self._dispatch, *event)
+
+    #Function to check a numbered bus frame. Returns (type, origin, member, data) with the data copied out.
+    def _event(self, frame):
+        body, seq = split_seq(frame.payload)
+        if not frame.ok or seq is None:
+            self.log('[BUS] corrupted frame from the hub')
+            return None
+        if seq != self.expected:
+            self.log(f'[BUS] expected event {self.expected}, got {seq}')
+        self.expected = (seq + 1) % SEQ_MOD
+        origin, member = ORIGIN.unpack_from(body)
+        return frame.type, origin, member, bytes(body[ORIGIN.size:])
+
+    def _dispatch(self, ftype, origin, member, data):
+        self.delivered += 1
+        session = self.local.get(member) if origin == self.worker else None
+        if ftype == BUS_JOIN:
+            name, _, wanted = str(data, 'utf-8', 'replace').partition('\n')
+            wanted = tuple(wanted.split(','))
+            if session is not None:
+                replay = self.replays.pop(member, None)
+                if replay is not None:
+                    replay()
+                if self.sessions.join(session):
+                    for room in wanted:
+                        self.sessions.enter(session, room)
+            self.broadcast(notices.NoticeFrames(notices.joined(name)), None, wanted)
+        elif ftype == BUS_NOTICE:
+            target, _, text = str(data, 'utf-8', 'replace').partition('\n')
+            self.broadcast(notices.NoticeFrames(text), None, None if target == '*' else tuple(target.split(',')))
+        elif ftype == BUS_MSG:
+            room, _, line = data.partition(b'\n')
+            self.broadcast(line, session.conn if session is not None else None, (room.decode(),))
+        elif ftype == BUS_ROOM:
+            verb, room, name = str(data, 'utf-8', 'replace').split('\n', 2)
+            rooms.apply(self.sessions, self.broadcast, session, name, verb, room, switch=False)
+
+    def __str__(self):
+        return f'published={self.published} delivered={self.delivered}'
+
+
+#Supervisor side: numbers events from every worker and sends each one to all of them
+#(through `ring`, a shmring.SharedRing with one reader per worker, when given).
+class Hub:
+    def __init__(self, log=print, ring=None, history=None):
+        self.log = log
+        self.ring = ring
+        self.history = history  # chatlog.ChatLog of every chat line, with --history
+        self.links = {}  # worker number -> socket
+        self.lock = threading.Lock()  # held while an event is numbered and sent, so all workers get one order
+        self.seq = 0
+        self.events = 0
+        self.doorbells = 0
+        self.external = 0  # frames that did not fit a ring slot
+
+    def add(self, worker, link):
+        self.links[worker] = link
+
+    def start(self):
+        for link in self.links.values():
+            threading.Thread(target=self._serve, args=(link,), name='hub', daemon=True).start()
+
+    def _serve(self, link):
+        reader = FrameReader(BUS_MODEL)
+        try:
+            for frame in reader.iter_socket(link):
+                if not frame.ok or len(frame.payload) < ORIGIN.size:
+                    self.log('[BUS] corrupted frame from a worker')
+                    continue
+                self.publish(frame.type, bytes(frame.payload))
+        except OSError:
+            pass
+        with self.lock:
+            for worker, known in list(self.links.items()):
+                if known is link:
+                    del self.links[worker]
+
+    def publish(self, ftype, payload):
+        with self.lock:
+            if self.history is not None:
+                if ftype == BUS_MSG:
+                    room, _, line = payload[ORIGIN.size:].partition(b'\n')
+                    if room == _DEFAULT_ROOM:
+                        self.history.append(line)
+                elif ftype == BUS_JOIN:
+                    self.history.flush(sync=False)
+            frame = FrameCache(payload, ftype).sequenced(BUS_MODEL, self.seq)
+            self.seq = (self.seq + 1) % SEQ_MOD
+            self.events += 1
+            if self.ring is None:
+                self._send_all(frame)
+            elif len(frame) > self.ring.capacity:
+                self.external += 1
+                self.ring.write(b'', EXTERNAL)
+                self._send_all(frame)
+            else:
+                self.ring.write(frame)
+                for worker in list(self.links):
+                    if self.ring.wants_wakeup(worker):
+                        self.doorbells += 1
+                        self._send(worker, _DOORBELL)
+
+    def _send_all(self, frame):
+        for worker in list(self.links):
+            self._send(worker, frame)
+
+    def _send(self, worker, frame):
+        try:
+            self.links[worker].sendall(frame)
+        except OSError:
+            del self.links[worker]
+
+    def close(self):
+        with self.lock:
+            for link in self.links.values():
+                link.close()
+            self.links = {}
+        if self.ring is not None:
+            self.ring.close()
+            self.ring.unlink()
+        if self.history is not None:
+            self.log(f'[HISTORY] {self.history}')
+            self.history.close()
+
+    def __str__(self):
+        return f'events={self.events} doorbells={self.doorbells} external={self.external}'
+
+
+#Entry point of a worker process: configure the engine like the supervisor's command line says,
+#attach it to the bus and serve until SIGTERM.
+def worker_main(worker, link, args, ring_name=None):
+    import server
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches every process; the supervisor stops us
+    if args.log.startswith('file:'):
+        args.log = f'{args.log}.{worker}'  # one file per worker
+    if args.metrics_port is not None:
+        args.metrics_port += worker  # one endpoint per worker, labelled with its number
+        metrics.registry.labels = f'worker="{worker}"'
+    server.configure(args)
+    sink = server.log_sink
+    server.log_sink = lambda message: sink(f'[worker {worker}] {message}')
+    server.REUSE_PORT = True
+    server.PROFILE_PREFIX = f'worker{worker}'
+    server.history = LogReader(args.history) if args.history else None
+    selected = server.engine()
+    ring = SharedRing(name=ring_name) if ring_name else None
+    selected.bus = WorkerBus(link, worker, selected.sessions, selected.broadcast_raw,
+                             getattr(selected, '_call_on_loop', None), server.log,
+                             ring.reader(worker) if ring else None)
+    selected.bus.start()
+    server.serve(args)
+    server.log(f'[BUS] {selected.bus}')
+
+
+#Function to run the supervisor: the hub plus `args.workers` worker processes.
+def run(args):
+    log = make_sink(args.log)
+    ring = SharedRing(args.bus_slots, args.bus_slot_size, args.workers) if args.bus == 'shm' else None
+    hub = Hub(log, ring, ChatLog(args.history) if args.history else None)
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    for worker in range(args.workers):
+        ours, theirs = socket.socketpair()
+        hub.add(worker, ours)
+        process = context.Process(target=worker_main, args=(worker, theirs, args, ring and ring.name),
+                                  name=f'worker-{worker}')
+        process.start()
+        theirs.close()
+        workers.append(process)
+    hub.start()
+    log(f'[CLUSTER] {args.workers} workers on port {args.port} (engine {args.engine}, bus {args.bus})')
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    #SIGUSR1 to the supervisor profiles every worker
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: [os.kill(p.pid, signal.SIGUSR1) for p in workers if p.pid])
+    try:
+        while not stopped.wait(1.0):
+            if not any(process.is_alive() for process in workers):
+                break
+    except KeyboardInterrupt:
+        pass
+    for process in workers:
+        process.terminate()  # SIGTERM: the worker shuts down like a single server would
+    for process in workers:
+        process.join(5.0)
+        if process.is_alive():
+            process.kill()
+    hub.close()
+    log(f'[CLUSTER] stopped: {hub}')
+    return 0 if all(process.exitcode == 0 for process in workers) else 1
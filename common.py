@@ -0,0 +1,235 @@
+import socket
+import time
+from collections import namedtuple
+from functools import lru_cache
+import arq
+import chatlog
+import compress
+import fec
+import limits
+import metrics
+import notices
+import rooms
+from crc import select_model
+from framing import parse_options, ACK, NACK, MSG, SEQUENCED
+
+# The parts of serving a client that do not depend on the engine, shared by the thread engine
+# (server.py) and the asyncio engine (aserver.py): the HELLO negotiation, reading chat lines out of
+# frames (ARQ, CRC errors, rate limits, room commands), history replay and the keepalive and ARQ
+# timers. The functions take the engine's SessionRegistry and log function, and the engine
+# settings they need, as arguments; how a client is read, waited on and broadcast to stays in the
+# engines.
+
+# What the server agreed to in a client's HELLO; `accepted` is what goes in the WELCOME.
+Agreement = namedtuple('Agreement', 'name options model window accepted wanted wants_history')
+
+
+#Address to listen on when none is given: this host's IP, looked up on first use (not at import).
+@lru_cache(maxsize=None)
+def default_host():
+    return socket.gethostbyname(socket.gethostname())
+
+
+#Function to remove a client; its writer (thread or task) closes the connection, after sending
+#what is still queued if `flush`.
+def drop_client(sessions, conn, flush=False):
+    session = sessions.remove(conn)
+    if session is not None:
+        session.queue.close(flush)
+
+
+#Function to queue a frame for a client. Returns False (and drops the client) if the queue policy gave up on it.
+def deliver(sessions, session, frame):
+    if not session.queue.put(frame):
+        metrics.dropped_clients.inc()
+        drop_client(sessions, session.conn)
+        return False
+    return True
+
+
+#Function to queue a frame for a client that may have been dropped meanwhile.
+def send(sessions, session, frame):
+    return sessions.get(session.conn) is session and deliver(sessions, session, frame)
+
+
+#Function for the server side of the handshake. `hello` is the client's first frame: its name,
+#then the options it offers, e.g. "Alice\ncrc=crc-32,crc-3\narq=32\nfec=rs:16\nrooms=dev,lobby".
+def negotiate(hello, arq_window, fec_codecs, compress_codecs, compress_min, history=None):
+    name, options = parse_options(str(hello.payload, 'utf-8', 'replace'), has_first_line=True)
+    #The server answers with the model it picked; every later frame uses it
+    model = select_model(options.get('crc', ''))
+    #Reliable delivery (ARQ) if the client asked for it, e.g. "arq=32"
+    window = arq.negotiate(options.get('arq'), arq_window)
+    accepted = {'crc': model.name, 'arq': window} if window else {'crc': model.name}
+    #Forward error correction if the client offered a codec we allow, e.g. "fec=rs:16"
+    codec = fec.select_codec(options.get('fec'), fec_codecs)
+    if codec is not None:
+        accepted['fec'] = codec.spec
+        model = fec.with_fec(model, codec)
+    #Compression if the client offered a codec we allow, e.g. "compress=zlib-dict,zlib"
+    compressor = compress.select_codec(options.get('compress'), compress_codecs, compress_min)
+    if compressor is not None:
+        accepted['compress'] = compressor.spec
+        model = compress.with_compression(model, compressor)
+    #Rooms the client asked for (the first is where its lines go)
+    wanted = rooms.parse(options.get('rooms'))
+    if 'rooms' in options:
+        accepted['rooms'] = ','.join(wanted)
+    #With a chat log, a client asking for history is told the log position, e.g. "seq=1200"; the log
+    #holds rooms.DEFAULT only, so a client not joining it gets no history
+    wants_history = (history is not None and rooms.DEFAULT in wanted
+                     and ('history' in options or 'since' in options))
+    if wants_history:
+        accepted['seq'] = history.head()
+    return Agreement(name, options, model, window, accepted, wanted, wants_history)
+
+
+#Function to set a client up with what it negotiated, once its WELCOME is queued.
+def start_session(sessions, session, agreement, policy):
+    model, window = agreement.model, agreement.window
+    if window:
+        stats = arq.ArqStats()
+        session.arq_out = arq.ArqSender(lambda frame: deliver(sessions, session, frame), model, window,
+                                        on_give_up=lambda: drop_client(sessions, session.conn), stats=stats)
+        session.arq_in = arq.ArqReceiver(model, window, stats)
+    session.name, session.model = agreement.name, model
+    session.msg_bucket, session.byte_bucket = policy.buckets()
+    metrics.joined(agreement.name)
+
+
+#Function to send a late joiner the history it asked for: "history=N" (the last N lines) and/or
+#"since=SEQ" (the lines from sequence number SEQ on), at most `max_lines`. The log's mapped segments
+#are queued as they are for clients on its CRC model; only other models or ARQ sessions get the
+#lines re-framed.
+def send_history(sessions, session, options, history, max_lines, log):
+    try:
+        last = int(options['history']) if 'history' in options else None
+        since = int(options['since']) if 'since' in options else None
+    except ValueError:
+        return 0
+    if last is None and since is None:
+        return 0
+    first, count, chunks = history.read(since, min(max_lines, max_lines if last is None else last))
+    if session.arq_out is not None:
+        for payload in chatlog.payloads(chunks):
+            session.arq_out.send(payload)
+    else:
+        for frame in chatlog.frames_for(chunks, session.model):
+            deliver(sessions, session, frame)
+    if count:
+        log(f'[HISTORY] {count} lines from #{first} to {session.name}')
+    return count
+
+
+#Function to handle a frame from a joined client. Returns the chat payloads it carries, in order:
+#none for ACK/NACK and other control frames, for a corrupted frame (the client is told it was not
+#delivered; with ARQ it is NACKed and comes back on its own) or for one ARQ holds back until the
+#frames before it arrive.
+def received(sessions, session, frame, log):
+    #Any frame (PONGs included) shows the client is still there
+    session.last_seen = time.monotonic()
+    #ACK/NACK for frames we sent this client
+    if frame.type in (ACK, NACK):
+        if session.arq_out is not None:
+            session.arq_out.on_control(frame)
+        return ()
+    if frame.type != MSG:
+        return ()
+    session.received += 1
+    session.corrected += frame.corrected
+    metrics.messages_in.inc()
+
+    if session.arq_in is not None and frame.flags & SEQUENCED:
+        if not frame.ok:
+            session.crc_errors += 1
+            metrics.crc_failures.inc()
+            log(f'[CRC ERROR]: Corrupted message from {session.name}, retransmission requested.')
+        payloads, replies = session.arq_in.receive(frame)
+        for reply in replies:
+            deliver(sessions, session, reply)
+        return payloads
+    #CORRUPTED/INVALID: the frame's CRC trailer did not match its payload; it is not broadcast
+    if not frame.ok:
+        session.crc_errors += 1
+        metrics.crc_failures.inc()
+        log(f'[CRC ERROR]: Dropped corrupted message from {session.name}.')
+        send(sessions, session, notices.notice_frame(notices.CRC_DROPPED, session.model))
+        return ()
+    return (frame.payload,)
+
+
+#Function to check a chat payload against the client's rate limits and room commands. Returns the
+#room the line goes to, or None when there is nothing to broadcast (dropped, or a "[join ROOM]" /
+#"[leave ROOM]" that was carried out with `broadcast` or through the cluster `bus`).
+def chat_room(sessions, session, payload, policy, log, broadcast, bus=None):
+    #Over the client's line or byte rate: dropped, like a corrupted line
+    limit = policy.check(session, len(payload))
+    if limit is not None:
+        rate_limited(sessions, session, limit, log)
+        return None
+    session.limited = False
+    command = rooms.command(payload)
+    if command is not None:
+        change_room(sessions, session, *command, broadcast, bus)
+        return None
+    room = session.room
+    if room is None:
+        send(sessions, session, notices.notice_frame(notices.NO_ROOM, session.model))
+        return None
+    #NOT CORRUPTED/VALID: logged in the format "[room] name > text"
+    log(f"{rooms.label(room).decode()}{session.name} > {str(payload, 'utf-8', 'replace')}")
+    return room
+
+
+#Function to drop a chat line over a client's rate limit. The client is told once, until a line gets through again.
+def rate_limited(sessions, session, limit, log):
+    (metrics.rate_limited if limit == 'messages' else metrics.byte_limited).inc()
+    if session.limited:
+        return
+    session.limited = True
+    log(f'[RATE LIMIT] {session.name} is over the {limit} limit; dropping messages.')
+    deliver(sessions, session, notices.notice_frame(notices.RATE_LIMITED, session.model))
+
+
+#Function for "[join ROOM]" / "[leave ROOM]" typed by a client (see rooms.py).
+def change_room(sessions, session, verb, room, broadcast, bus=None):
+    if not rooms.valid(room):
+        deliver(sessions, session, notices.notice_frame(notices.INVALID_ROOM, session.model))
+    elif verb == rooms.JOIN and room in session.rooms:
+        session.room = room
+        deliver(sessions, session, notices.notice_frame(notices.ROOM_CURRENT.format(room=room), session.model))
+    elif verb == rooms.JOIN and len(session.rooms) >= rooms.MAX_ROOMS:
+        deliver(sessions, session, notices.notice_frame(notices.TOO_MANY_ROOMS, session.model))
+    elif verb == rooms.LEAVE and room not in session.rooms:
+        return
+    elif bus is not None:
+        #Worker: the change takes effect when the bus hands it back, in the same order on every worker
+        bus.room(session, verb, room)
+    else:
+        rooms.apply(sessions, broadcast, session, session.name, verb, room)
+
+
+#Function to run the retransmit timers of every ARQ session.
+def poll_arq(sessions, now):
+    for session in sessions.snapshot():
+        if session.arq_out is not None:
+            session.arq_out.poll(now)
+
+
+#Function to ping quiet clients and evict the ones that stopped answering (gone, or half-open).
+#The engines call it every limits.KEEPALIVE_TICK seconds.
+def keepalive(sessions, policy, log, now):
+    for session in sessions.snapshot():
+        action = policy.keepalive_action(session.last_seen, session.last_ping, now)
+        if action == 'ping':
+            session.last_ping = now
+            metrics.pings.inc()
+            deliver(sessions, session, limits.ping_frame(session.model))
+        elif action == 'evict':
+            metrics.evictions.inc()
+            log(f'[IDLE] Evicted {session.name}: nothing received for {now - session.last_seen:.0f} s.')
+            #Frames still queued mean it stopped reading too; then there is no point in a goodbye
+            stuck = len(session.queue) > 0
+            if not stuck:
+                deliver(sessions, session, notices.notice_frame(notices.IDLE, session.model))
+            drop_client(sessions, session.conn, flush=not stuck)
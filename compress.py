@@ -0,0 +1,162 @@
+import copy
+import time
+import zlib
+import notices
+from framing import MAX_PAYLOAD
+
+# Payload compression for chat frames, negotiated in the handshake like FEC: the client offers
+# codecs ("compress=zlib-dict,zlib") and the server answers with the one it accepted. The codec is
+# attached to the connection's CRC model (with_compression), so every frame built with that model
+# is compressed by its sender and inflated by the FrameReader on the other side.
+# A compressed frame has the COMPRESSED flag and carries the deflated payload; its CRC trailer (and
+# FEC, if any) covers the bytes actually sent, so a damaged frame is caught before inflating it.
+# Payloads shorter than the codec's min_size, or that would not get smaller, are sent as they are
+# (without the flag): a short chat line costs no CPU and no bytes.
+# Raw deflate streams (no zlib header or Adler-32, the frame CRC already checks them):
+#   zlib:L       deflate at level L (1-9, default 6)
+#   zlib-dict:L  the same with DICTIONARY preset, which short lines benefit from most. The
+#                dictionary is part of the protocol: both ends must have the same bytes.
+
+MIN_SIZE = 32  # payloads shorter than this are never compressed
+LEVEL = 6
+WBITS = -15    # raw deflate, 32 KiB window
+
+# Common chat phrases and the server notices (see notices.py). Deflate matches strings near the
+# end of the dictionary with the shortest distances, so the most frequent ones come last.
+PHRASES = (
+    'what do you think', 'I don\'t know', 'sounds good', 'see you later', 'good night', 'good morning',
+    'thank you', 'thanks', 'no problem', 'of course', 'by the way', 'let me know', 'I think', 'right now',
+    'are you there?', 'how are you?', 'hello everyone', 'hi everyone', 'hahaha', 'okay', 'yes', 'sure',
+)
+NOTICES = (notices.SHUTDOWN, notices.INVALID_NAME, notices.CRC_DROPPED, notices.CRC_REBROADCAST,
+           notices.LEFT.format(name=''), notices.JOINED.format(name=''))
+DICTIONARY = '\n'.join(PHRASES + NOTICES).encode()
+
+
+#Raised for a payload that does not inflate (or inflates beyond MAX_PAYLOAD).
+class CompressError(ValueError):
+    pass
+
+
+#Counters of one codec, for every connection using it in this process. `ratio` is the compressed
+#size over the original size of the payloads that were compressed.
+class CompressStats:
+    def __init__(self):
+        self.compressed = 0      # payloads sent compressed
+        self.skipped = 0         # payloads sent as they are (below min_size or incompressible)
+        self.bytes_in = 0        # original size of the compressed payloads
+        self.bytes_out = 0
+        self.inflated = 0        # compressed payloads received
+        self.compress_time = 0.0  # seconds in deflate / inflate
+        self.inflate_time = 0.0
+
+    @property
+    def ratio(self):
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    def __str__(self):
+        return (f'compressed={self.compressed} skipped={self.skipped} bytes={self.bytes_in}->{self.bytes_out} '
+                f'ratio={self.ratio:.2f} inflated={self.inflated} '
+                f'cpu={self.compress_time * 1000:.1f}ms+{self.inflate_time * 1000:.1f}ms')
+
+
+class Zlib:
+    def __init__(self, level=LEVEL, dictionary=None, min_size=MIN_SIZE):
+        if not 1 <= level <= 9:
+            raise CompressError(f'zlib level must be 1..9, not {level}')
+        self.level = level
+        self.dictionary = dictionary
+        self.min_size = min_size
+        self.spec = f'{"zlib-dict" if dictionary else "zlib"}:{level}'
+        self.stats = CompressStats()
+        # a compressor with the dictionary already loaded; each payload gets a copy of it
+        self._deflate = zlib.compressobj(level, zlib.DEFLATED, WBITS, **self._zdict())
+
+    def _zdict(self):
+        return {'zdict': self.dictionary} if self.dictionary else {}
+
+    #Function to compress a payload. Returns the compressed bytes, or None when it should be sent as is.
+    def compress(self, payload):
+        if len(payload) < self.min_size:
+            self.stats.skipped += 1
+            return None
+        start = time.perf_counter()
+        deflate = self._deflate.copy()
+        data = deflate.compress(payload) + deflate.flush()
+        self.stats.compress_time += time.perf_counter() - start
+        if len(data) >= len(payload):
+            self.stats.skipped += 1
+            return None
+        self.stats.compressed += 1
+        self.stats.bytes_in += len(payload)
+        self.stats.bytes_out += len(data)
+        return data
+
+    def decompress(self, data):
+        start = time.perf_counter()
+        inflate = zlib.decompressobj(WBITS, **self._zdict())
+        try:
+            payload = inflate.decompress(data, MAX_PAYLOAD)
+        except zlib.error as e:
+            raise CompressError(f'bad compressed payload ({e})') from None
+        finally:
+            self.stats.inflate_time += time.perf_counter() - start
+        if inflate.unconsumed_tail or not inflate.eof:
+            raise CompressError('compressed payload is truncated or larger than MAX_PAYLOAD')
+        self.stats.inflated += 1
+        return payload
+
+
+CODECS = {'zlib': None, 'zlib-dict': DICTIONARY}
+
+_codecs = {}
+
+
+#Function to get the codec for a spec, e.g. 'zlib' or 'zlib-dict:9' (no level: the default).
+#Codecs are shared by spec and min_size, so their stats cover every connection using them.
+def get_codec(spec, min_size=MIN_SIZE):
+    family, _, param = spec.strip().lower().partition(':')
+    try:
+        level = int(param) if param else LEVEL
+        key = family, level, min_size
+        codec = _codecs.get(key)
+        if codec is None:
+            codec = _codecs[key] = Zlib(level, CODECS[family], min_size)
+        return codec
+    except (KeyError, ValueError) as e:
+        raise CompressError(f'Unknown compression codec: {spec} ({e})') from None
+
+
+#Function for the server side of the handshake: the first codec in a peer's comma-separated offer
+#whose family is in `allowed`, or None.
+def select_codec(offered, allowed=tuple(CODECS), min_size=MIN_SIZE):
+    for spec in (offered or '').split(','):
+        if spec.strip() and spec.strip().lower().partition(':')[0] in allowed:
+            try:
+                return get_codec(spec, min_size)
+            except CompressError:
+                continue
+    return None
+
+
+#Function to get every codec used so far in this process (for the stats at shutdown).
+def codecs():
+    return [codec for codec in _codecs.values() if codec.stats.compressed or codec.stats.skipped
+            or codec.stats.inflated]
+
+
+_compressed = {}
+
+
+#Function to attach a codec to a CRC model (which may already carry an FEC codec). As with
+#fec.with_fec, the same object is returned for the same pair, so frame caches keyed by model are
+#shared by every connection using that combination.
+def with_compression(model, codec):
+    if codec is None:
+        return model
+    key = model, codec
+    compressed = _compressed.get(key)
+    if compressed is None:
+        compressed = _compressed[key] = copy.copy(model)
+        compressed.compression = codec
+    return compressed
@@ -1,4 +1,31 @@
+import binascii
 import random
+import sys
+from functools import cached_property
+
+try:
+    from crc_tables import TABLES  # precomputed lookup tables (python crc.py --write-tables)
+except ImportError:
+    TABLES = {}
+
+# NumPy is optional (the batch API falls back to pure Python) and slow to import, so it is only
+# loaded by the first batch call, see load_numpy().
+np = None
+_numpy_checked = False
+TABLES_MODULE = 'crc_tables.py'
+
+
+#Function to import NumPy on first use. Returns the module, or None if it is not installed.
+def load_numpy():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
 
 # G(x) = x^3 + x + 1 -> '1011'
 generator = '1011'
@@ -28,23 +55,212 @@ def mod2_division(dividend, divisor):
     return ''.join(dividend[-(n - 1):])
 
 
-#Function to encode a message with CRC before sending over the network.
-def encode_message(message):
-    k = len(generator)
+#A CRC model: width, generator polynomial (without the top bit), initial register,
+#bit order and final XOR. Its lookup table is loaded from crc_tables.py, or built, on first use.
+class CrcModel:
+    fec = None  # forward error correction codec applied to framed payloads (fec.with_fec)
+    compression = None  # payload compression codec (compress.with_compression)
+
+    def __init__(self, name, width, poly, init=0, reflected=False, xorout=0, check=None):
+        self.name = name
+        self.width = width
+        self.poly = poly
+        self.init = init
+        self.reflected = reflected
+        self.xorout = xorout
+        self.check = check  # CRC of b'123456789', used to verify the model
+        #CRCs narrower than a byte are computed in an 8-bit register with the
+        #polynomial aligned to the top, then shifted back down at the end.
+        self.reg_bits = max(width, 8)
+        self.mask = (1 << self.reg_bits) - 1
+        if reflected:
+            self.reg_poly = int(format(poly, '0%db' % width)[::-1], 2)
+            self.reg_init = int(format(init, '0%db' % width)[::-1], 2)
+        else:
+            self.reg_poly = poly << (self.reg_bits - width)
+            self.reg_init = init << (self.reg_bits - width)
+        self._fast = self._fast_path()
+
+    #Generator polynomial as a string of '0'/'1', the form mod2_division takes.
+    @property
+    def generator(self):
+        return '1' + format(self.poly, '0%db' % self.width)
+
+    #What the lookup table depends on; its key in crc_tables.TABLES.
+    @property
+    def table_key(self):
+        return self.reg_bits, self.reg_poly, self.reflected
+
+    #The byte-wise lookup table. Models with a C implementation (see _fast_path) only need it for
+    #the NumPy batch kernel, so it is not made until something asks for it.
+    @cached_property
+    def table(self):
+        return TABLES.get(self.table_key) or self._make_table()
+
+    #Function to build the byte-wise lookup table.
+    #table[b] is the register left after feeding the 8 bits of b into an empty register,
+    #so the division can advance a whole byte per step instead of one bit at a time.
+    def _make_table(self):
+        table = []
+        for byte in range(256):
+            if self.reflected:
+                reg = byte
+                for _ in range(8):
+                    reg = (reg >> 1) ^ self.reg_poly if reg & 1 else reg >> 1
+            else:
+                top = 1 << (self.reg_bits - 1)
+                reg = byte << (self.reg_bits - 8)
+                for _ in range(8):
+                    reg = ((reg << 1) ^ self.reg_poly) & self.mask if reg & top else (reg << 1) & self.mask
+            table.append(reg)
+        return table
+
+    #The standard CRC-32 and CCITT polynomials have C implementations in binascii.
+    def _fast_path(self):
+        if self.reflected and self.width == 32 and self.poly == 0x04C11DB7:
+            return lambda data, reg: binascii.crc32(data, reg ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+        if not self.reflected and self.width == 16 and self.poly == 0x1021:
+            return binascii.crc_hqx
+        return None
+
+    #Function to feed a bytes-like object (bytes, bytearray, memoryview) into the register.
+    def update(self, reg, data):
+        if self._fast is not None:
+            return self._fast(data, reg)
+        table = self.table
+        if self.reflected:
+            for b in data:
+                reg = table[(reg ^ b) & 0xFF] ^ (reg >> 8)
+        elif self.reg_bits == 8:
+            for b in data:
+                reg = table[reg ^ b]
+        else:
+            shift = self.reg_bits - 8
+            mask = self.mask
+            for b in data:
+                reg = table[(reg >> shift) ^ b] ^ ((reg << 8) & mask)
+        return reg
+
+    #Function to feed single bits (a string of '0'/'1') into the register, for characters wider than 8 bits.
+    def update_bits(self, reg, bits):
+        if self.reflected:
+            for bit in bits:
+                reg ^= (bit == '1')
+                reg = (reg >> 1) ^ self.reg_poly if reg & 1 else reg >> 1
+            return reg
+        top = 1 << (self.reg_bits - 1)
+        for bit in bits:
+            if bit == '1':
+                reg ^= top
+            reg = ((reg << 1) ^ self.reg_poly) & self.mask if reg & top else (reg << 1) & self.mask
+        return reg
+
+    #Function to turn the register into the final CRC value.
+    def finish(self, reg):
+        if not self.reflected:
+            reg >>= self.reg_bits - self.width
+        return reg ^ self.xorout
+
+    def compute(self, data):
+        return self.finish(self.update(self.reg_init, data))
+
+    def __repr__(self):
+        return 'CrcModel(%r)' % self.name
+
+
+#Registry of named CRC models
+models = {}
+
+
+def register_model(model):
+    models[model.name] = model
+    return model
+
+
+# 'crc-3' is the original G(x) = x^3 + x + 1 and stays the default so old peers still verify.
+register_model(CrcModel('crc-3', 3, int(generator[1:], 2), check=0x3))
+register_model(CrcModel('crc-8', 8, 0x07, check=0xF4))
+register_model(CrcModel('crc-16/ccitt', 16, 0x1021, init=0xFFFF, check=0x29B1))
+register_model(CrcModel('crc-32', 32, 0x04C11DB7, init=0xFFFFFFFF, reflected=True, xorout=0xFFFFFFFF, check=0xCBF43926))
+
+DEFAULT_MODEL = 'crc-3'
+
+
+#Function to look a model up by name. None gives the default model, a CrcModel is returned as is.
+def get_model(model=None):
+    if model is None:
+        return models[DEFAULT_MODEL]
+    if isinstance(model, CrcModel):
+        return model
+    try:
+        return models[model.lower()]
+    except KeyError:
+        raise ValueError(f'Unknown CRC model: {model}') from None
+
+
+#Function to pick the first model we support from a peer's comma-separated list of model names.
+def select_model(offered):
+    for name in offered.split(','):
+        name = name.strip().lower()
+        if name in models:
+            return models[name]
+    return get_model()
+
+
+#Streaming API: state = new_state(model); state = update(state, chunk) ...; crc = finalize(state)
+#lets large payloads be checksummed chunk by chunk.
+def new_state(model=None):
+    model = get_model(model)
+    return model, model.reg_init
 
-    #converts ASCII message into binary string and appends k-1 zeros at the end
-    data_bits = str_to_bin(message) + '0' * (k - 1) 
-    #perform mod2 division to get the remainder
-    remainder = mod2_division(data_bits, generator)
+
+def update(state, chunk):
+    model, reg = state
+    return model, model.update(reg, chunk)
+
+
+def finalize(state):
+    model, reg = state
+    return model.finish(reg)
+
+
+#Function to compute the CRC of a bytes-like object (bytes, bytearray, memoryview) using the lookup table.
+#For the default model it gives the same remainder as mod2_division(data bits + zeros, generator), as an integer.
+def crc_bytes(data, model=None):
+    return get_model(model).compute(data)
+
+
+#Function to compute the CRC remainder of a text message as a string of '0'/'1' (width characters).
+def crc_remainder(message, model=None):
+    model = get_model(model)
+    try:
+        #every character fits in 8 bits, same bits as str_to_bin
+        reg = model.update(model.reg_init, message.encode('latin-1'))
+    except UnicodeEncodeError:
+        #str_to_bin writes characters above 255 with more than 8 bits,
+        #so feed the extra high bits one by one and the low byte through the table
+        reg = model.reg_init
+        for c in message:
+            o = ord(c)
+            if o > 0xFF:
+                reg = model.update_bits(reg, format(o, 'b')[:-8])
+            reg = model.update(reg, bytes((o & 0xFF,)))
+    return format(model.finish(reg), '0%db' % model.width)
+
+
+#Function to encode a message with CRC before sending over the network.
+def encode_message(message, model=None):
+    #table-driven equivalent of mod2_division(str_to_bin(message) + k-1 zeros, generator)
+    remainder = crc_remainder(message, model)
 
     # Append remainder (string of '0'/'1') directly to message as characters.
-    # Format: original message (ASCII chars) + crc_bits (k-1 characters '0' or '1')
+    # Format: original message (ASCII chars) + crc_bits (k-1 characters '0' or '1', k-1 = model width)
     return message + remainder
 
 
 #Function to verify a message received over the network by checking its CRC.
-def decode_message(msg_with_crc):
-    k = len(generator)
+def decode_message(msg_with_crc, model=None):
+    k = get_model(model).width + 1
     #Ensure the message is at least k-1 bits long to extract CRC
     if len(msg_with_crc) < (k - 1):
         return None, False
@@ -53,16 +269,155 @@ def decode_message(msg_with_crc):
     msg = msg_with_crc[:-(k - 1)]
     crc_received = msg_with_crc[-(k - 1):]
 
-    #Convert Message to Binary and Append Zeros
-    data_bits = str_to_bin(msg) + '0' * (k - 1)
-    #Perform Modulo-2 Division to get the remainder
-    remainder = mod2_division(data_bits, generator)
+    #Recompute the remainder of the received message with the lookup table
+    remainder = crc_remainder(msg, model)
 
     #Return the original message and a boolean whether the message pass CRC validity
     return msg, (remainder == crc_received)
 
 
-#Function to randomly add transmission errors in a message with CRC.
+#Batch API: many messages concatenated in one buffer, message i being buffer[offsets[i]:offsets[i + 1]].
+#Messages are 8-bit characters (the bytes of str_to_bin), or raw payloads for binary=True.
+
+#Function to pack text messages into (buffer, offsets) for the batch API. Characters must fit in 8 bits.
+def pack_batch(messages):
+    offsets = [0]
+    parts = []
+    for message in messages:
+        data = message.encode('latin-1') if isinstance(message, str) else bytes(message)
+        parts.append(data)
+        offsets.append(offsets[-1] + len(data))
+    return b''.join(parts), offsets
+
+
+#NumPy kernel: advances the registers of all messages one byte position per step. Messages are
+#sorted longest first so the ones still running at position j are always a prefix of the arrays.
+def _crc_batch_numpy(model, buffer, starts, lengths):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    order = np.argsort(-lengths, kind='stable')
+    starts = starts[order]
+    lengths = lengths[order]
+    count = len(lengths)
+    table = np.array(model.table, dtype=np.uint64)
+    reg = np.full(count, model.reg_init, dtype=np.uint64)
+    longest = int(lengths[0]) if count else 0
+    # active[j] = number of messages longer than j
+    active = count - np.searchsorted(lengths[::-1], np.arange(longest), side='right')
+    shift = np.uint64(model.reg_bits - 8)
+    mask = np.uint64(model.mask)
+    eight = np.uint64(8)
+    for j in range(longest):
+        k = active[j]
+        r = reg[:k]
+        b = data[starts[:k] + j].astype(np.uint64)
+        if model.reflected:
+            reg[:k] = table[((r ^ b) & np.uint64(0xFF)).astype(np.intp)] ^ (r >> eight)
+        elif model.reg_bits == 8:
+            reg[:k] = table[(r ^ b).astype(np.intp)]
+        else:
+            reg[:k] = table[((r >> shift) ^ b).astype(np.intp)] ^ ((r << eight) & mask)
+    if not model.reflected:
+        reg >>= np.uint64(model.reg_bits - model.width)
+    reg ^= np.uint64(model.xorout)
+    result = np.empty(count, dtype=np.uint64)
+    result[order] = reg
+    return result
+
+
+#Function to compute the CRC of every message in the buffer in one pass. Returns a list of ints.
+#Table-driven models use the NumPy kernel when NumPy is installed; models with a C
+#implementation in binascii (crc-32, crc-16/ccitt) are already faster message by message.
+def crc_batch(buffer, offsets, model=None, use_numpy=None):
+    return _crc_spans(get_model(model), buffer, offsets[:-1], offsets[1:], use_numpy)
+
+
+def _crc_spans(model, buffer, starts, ends, use_numpy):
+    if use_numpy is None:
+        use_numpy = model._fast is None and len(starts) > 16 and load_numpy() is not None
+    if use_numpy and len(starts) and load_numpy() is not None:
+        starts = np.asarray(starts, dtype=np.int64)
+        return _crc_batch_numpy(model, buffer, starts, np.asarray(ends, dtype=np.int64) - starts).tolist()
+    view = memoryview(buffer)
+    return [model.compute(view[start:end]) for start, end in zip(starts, ends)]
+
+
+#Function to append a CRC to every message in the buffer: the '0'/'1' characters of
+#encode_message, or the big-endian trailer of a frame with binary=True. Returns (buffer, offsets).
+def encode_batch(buffer, offsets, model=None, binary=False, use_numpy=None):
+    model = get_model(model)
+    crcs = crc_batch(buffer, offsets, model, use_numpy)
+    view = memoryview(buffer)
+    parts = []
+    out_offsets = [0]
+    for i, value in enumerate(crcs):
+        if binary:
+            trailer = value.to_bytes((model.width + 7) // 8, 'big')
+        else:
+            trailer = format(value, '0%db' % model.width).encode()
+        parts.append(view[offsets[i]:offsets[i + 1]])
+        parts.append(trailer)
+        out_offsets.append(out_offsets[-1] + offsets[i + 1] - offsets[i] + len(trailer))
+    return b''.join(parts), out_offsets
+
+
+#Function to verify every message in the buffer in one pass.
+#Returns (mask, payloads): mask[i] is True if message i passes its CRC, and payloads[i] is the
+#message without its CRC, exactly what decode_message returns for it (None if it is too short).
+#With binary=True the trailers are frame trailers and the payloads are memoryviews into the buffer.
+def verify_batch(buffer, offsets, model=None, binary=False, use_numpy=None):
+    model = get_model(model)
+    tsize = (model.width + 7) // 8 if binary else model.width
+    count = len(offsets) - 1
+    if use_numpy is None:
+        use_numpy = count > 16 and load_numpy() is not None
+    elif use_numpy:
+        use_numpy = load_numpy() is not None
+    # CRC of every payload (message minus trailer); messages shorter than a trailer get an empty payload
+    starts = offsets[:-1]
+    ends = [max(start, end - tsize) for start, end in zip(starts, offsets[1:])]
+    crcs = _crc_spans(model, buffer, starts, ends, use_numpy and model._fast is None)
+    long_enough = [end - start >= tsize for start, end in zip(starts, offsets[1:])]
+
+    if use_numpy and count:
+        # compare all trailers at once: one row of trailer bytes per message
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        ok_len = np.array(long_enough)
+        cols = np.where(ok_len, np.asarray(ends, dtype=np.int64), 0)[:, None] + np.arange(tsize)
+        trailers = data[np.minimum(cols, max(len(data) - 1, 0))].astype(np.uint64) if len(data) else \
+            np.zeros((count, tsize), dtype=np.uint64)
+        if binary:
+            weights = np.uint64(8) * np.arange(tsize - 1, -1, -1, dtype=np.uint64)
+            values = np.bitwise_or.reduce(trailers << weights, axis=1) if tsize else np.zeros(count, np.uint64)
+            valid = ok_len
+        else:
+            weights = np.arange(tsize - 1, -1, -1, dtype=np.uint64)
+            bits = trailers - np.uint64(ord('0'))
+            valid = ok_len & np.all((trailers == ord('0')) | (trailers == ord('1')), axis=1)
+            values = np.bitwise_or.reduce(np.where(valid[:, None], bits, 0).astype(np.uint64) << weights, axis=1)
+        mask = (valid & (values == np.asarray(crcs, dtype=np.uint64))).tolist()
+    else:
+        view = memoryview(buffer)
+        mask = []
+        for i in range(count):
+            trailer = view[ends[i]:ends[i] + tsize]
+            if not long_enough[i]:
+                mask.append(False)
+            elif binary:
+                mask.append(int.from_bytes(trailer, 'big') == crcs[i])
+            else:
+                mask.append(trailer == format(crcs[i], '0%db' % model.width).encode())
+
+    if binary:
+        view = memoryview(buffer)
+        payloads = [view[start:end] if ok else None for start, end, ok in zip(starts, ends, long_enough)]
+    else:
+        # decode the buffer once; slicing the str is cheaper than decoding every message
+        text = str(buffer, 'latin-1')
+        payloads = [text[start:end] if ok else None for start, end, ok in zip(starts, ends, long_enough)]
+    return mask, payloads
+
+
+#Function to randomly add transmission errors in a message with CRC (a string, or bytes).
 def introduce_error(msg_with_crc, error_prob=0.1):
     if not msg_with_crc:
         return msg_with_crc
@@ -74,6 +429,9 @@ def introduce_error(msg_with_crc, error_prob=0.1):
         ch = msg_with_crc[index]
         # choose a bit to flip in the 8-bit char (0..7), creates the bit mask
         bit_to_flip = 1 << random.randint(0, 7)
+        if isinstance(msg_with_crc, (bytes, bytearray)):
+            # binary data (e.g. a frame): flip the bit of the selected byte
+            return bytes(msg_with_crc[:index]) + bytes((msg_with_crc[index] ^ bit_to_flip,)) + bytes(msg_with_crc[index + 1:])
         # XOR the ASCII value of the character with the bit mask to flip the selected bit
         flipped_ord = ord(ch) ^ bit_to_flip
         # convert the modified ASCII value back to a character
@@ -84,3 +442,32 @@ def introduce_error(msg_with_crc, error_prob=0.1):
     
     # No error is introduced, return the original string unchanged
     return msg_with_crc
+
+
+#Function to write the lookup tables of the registered models as a module (crc_tables.py next to
+#this file), so processes load them instead of building them.
+def write_tables(path=None):
+    import os
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), TABLES_MODULE)
+    lines = ['# Generated by `python crc.py --write-tables`: byte-wise lookup tables of the registered CRC',
+             '# models, keyed by (register bits, register polynomial, reflected). crc.py builds any table',
+             '# that is missing here, so this file only saves the time to compute them.', 'TABLES = {']
+    for key in sorted({m.table_key for m in models.values()}):
+        model = next(m for m in models.values() if m.table_key == key)
+        digits = (model.reg_bits + 3) // 4
+        lines.append(f'    ({key[0]}, {key[1]:#x}, {key[2]}): (  # {model.name}')
+        table = model._make_table()
+        for row in range(0, 256, 8):
+            lines.append('        ' + ' '.join(f'0x{v:0{digits}x},' for v in table[row:row + 8]))
+        lines.append('    ),')
+    lines.append('}')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+#python crc.py --write-tables regenerates crc_tables.py (the checks are in tests/test_crc.py).
+if __name__ == '__main__':
+    if sys.argv[1:] != ['--write-tables']:
+        sys.exit('usage: python crc.py --write-tables')
+    print(f'wrote {write_tables()}')
@@ -0,0 +1,284 @@
+import copy
+
+# Forward error correction for framed payloads. A codec is applied to everything after the frame
+# header (payload + CRC trailer): the sender encodes it, the receiver corrects what it can and
+# only then checks the CRC, so a corrected frame costs no retransmission and a frame the code
+# could not fix is still caught by the CRC.
+# Both codes are systematic (the data bytes are sent unchanged, followed by check bytes), so the
+# receiver first tries the CRC on strip()ped data and only runs the slower decode() when it fails.
+# Codecs are named by a spec with their rate parameter; the client offers specs in the handshake
+# ("fec=rs:16") and the server answers with the one it accepted:
+#   hamming:M  extended Hamming code over blocks of M data bytes; corrects 1 bit per block and
+#              detects 2. 1 check byte per block for M <= 4, 2 for M up to 2047.
+#              hamming:4 -> rate 0.80, hamming:16 -> 0.89, hamming:64 -> 0.97
+#   rs:N       Reed-Solomon over GF(256), N parity bytes per block of up to 255 - N data bytes;
+#              corrects N // 2 wrong bytes per block (so also bursts). rs:16 -> rate 0.94
+
+
+class FecError(ValueError):
+    pass
+
+
+def _parity(x):
+    return bin(x).count('1') & 1
+
+
+#Function to drop the check bytes of a systematic code: blocks of `block` data bytes + `check` bytes.
+def _strip(data, block, check):
+    view = memoryview(data)
+    step = block + check
+    return b''.join(view[start:min(start + step, len(view)) - check] for start in range(0, len(view), step))
+
+
+# Hamming: data bit i (0 = LSB) of byte j in a block gets the syndrome ((j + 1) << 4) | (i + 8).
+# Those values are distinct and never a power of two (which marks a flipped check bit), and the
+# syndrome of a block can be built a byte at a time from two 256-entry tables.
+_BYTE_PARITY = [_parity(v) for v in range(256)]
+_BIT_SYNDROME = []
+for _v in range(256):
+    _s = 0
+    for _i in range(8):
+        if _v >> _i & 1:
+            _s ^= _i + 8
+    _BIT_SYNDROME.append(_s)
+
+
+class Hamming:
+    def __init__(self, block=16):
+        if not 1 <= block <= 2047:
+            raise FecError(f'Hamming block must be 1..2047 bytes, not {block}')
+        self.block = block
+        self.spec = f'hamming:{block}'
+        self.bits = 4 + block.bit_length()         # syndrome bits; one more for overall parity
+        self.check = (self.bits + 1 + 7) // 8      # check bytes per block
+        self.rate = block / (block + self.check)
+
+    def encoded_size(self, size):
+        return size + self.check * -(-size // self.block)
+
+    def strip(self, data):
+        return _strip(data, self.block, self.check)
+
+    def _syndrome(self, data):
+        syndrome = parity = 0
+        for j, v in enumerate(data, 1):
+            if _BYTE_PARITY[v]:
+                syndrome ^= j << 4
+                parity ^= 1
+            syndrome ^= _BIT_SYNDROME[v]
+        return syndrome, parity
+
+    def encode(self, data):
+        out = bytearray()
+        view = memoryview(data)
+        for start in range(0, len(view), self.block):
+            chunk = view[start:start + self.block]
+            syndrome, parity = self._syndrome(chunk)
+            # the extra bit makes the parity of the whole block (data + check bits) even
+            word = syndrome | (parity ^ _parity(syndrome)) << self.bits
+            out += chunk
+            out += word.to_bytes(self.check, 'big')
+        return bytes(out)
+
+    #Function to correct and strip the check bytes. Returns (data, corrected bits); blocks with more
+    #errors than the code can fix are passed through as received and left to the CRC.
+    def decode(self, data):
+        out = bytearray()
+        view = memoryview(data)
+        step = self.block + self.check
+        smask = (1 << self.bits) - 1
+        corrected = 0
+        for start in range(0, len(view), step):
+            chunk = bytearray(view[start:min(start + step, len(view)) - self.check])
+            word = int.from_bytes(view[start + len(chunk):start + len(chunk) + self.check], 'big')
+            syndrome, parity = self._syndrome(chunk)
+            syndrome ^= word & smask
+            odd = parity ^ _parity(word & smask) ^ (word >> self.bits & 1)
+            if odd:
+                pos = (syndrome >> 4) - 1
+                if syndrome & (syndrome - 1) == 0:
+                    corrected += 1  # a check bit was hit, the data is fine
+                elif syndrome & 8 and 0 <= pos < len(chunk):
+                    chunk[pos] ^= 1 << (syndrome & 15) - 8
+                    corrected += 1
+            out += chunk
+        return out, corrected
+
+
+# GF(256) arithmetic for Reed-Solomon (primitive polynomial x^8 + x^4 + x^3 + x^2 + 1)
+_EXP = [0] * 512
+_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+for _i in range(255, 512):
+    _EXP[_i] = _EXP[_i - 255]
+
+
+def _mul(a, b):
+    return _EXP[_LOG[a] + _LOG[b]] if a and b else 0
+
+
+def _div(a, b):
+    return _EXP[_LOG[a] + 255 - _LOG[b]] if a else 0
+
+
+#Polynomials below are lists of coefficients, lowest degree first.
+def _eval(poly, x):
+    y = 0
+    for coef in reversed(poly):
+        y = _mul(y, x) ^ coef
+    return y
+
+
+class ReedSolomon:
+    def __init__(self, nsym=16):
+        if not 2 <= nsym <= 128:
+            raise FecError(f'Reed-Solomon parity must be 2..128 bytes, not {nsym}')
+        self.nsym = nsym
+        self.block = 255 - nsym
+        self.spec = f'rs:{nsym}'
+        self.rate = self.block / 255
+        # generator (x - a^0)(x - a^1)...(x - a^(nsym-1)), highest degree first
+        gen = [1]
+        for i in range(nsym):
+            gen = [(gen[k] if k < len(gen) else 0) ^ (_mul(gen[k - 1], _EXP[i]) if k else 0)
+                   for k in range(len(gen) + 1)]
+        # Encoding is a CRC over GF(256) symbols: the nsym-byte remainder register is kept in one
+        # int and table[c] is c times the generator (without its leading 1), as nsym bytes.
+        self._table = [int.from_bytes(bytes(_mul(c, g) for g in gen[1:]), 'big') for c in range(256)]
+
+    def encoded_size(self, size):
+        return size + self.nsym * -(-size // self.block)
+
+    def encode(self, data):
+        out = bytearray()
+        view = memoryview(data)
+        table = self._table
+        shift = 8 * (self.nsym - 1)
+        mask = (1 << 8 * self.nsym) - 1
+        for start in range(0, len(view), self.block):
+            chunk = view[start:start + self.block]
+            # systematic encoding: the parity is the remainder of chunk * x^nsym divided by the generator
+            rem = 0
+            for byte in chunk:
+                rem = ((rem << 8) & mask) ^ table[byte ^ (rem >> shift)]
+            out += chunk
+            out += rem.to_bytes(self.nsym, 'big')
+        return bytes(out)
+
+    def strip(self, data):
+        return _strip(data, self.block, self.nsym)
+
+    def decode(self, data):
+        out = bytearray()
+        view = memoryview(data)
+        step = self.block + self.nsym
+        corrected = 0
+        for start in range(0, len(view), step):
+            block = bytearray(view[start:start + step])
+            corrected += self._correct(block)
+            out += block[:-self.nsym]
+        return out, corrected
+
+    #Function to correct one codeword in place. Returns the number of bytes fixed (0 if it can't).
+    def _correct(self, block):
+        n = len(block)
+        # block[0] is the coefficient of x^(n-1)
+        synd = []
+        for i in range(self.nsym):
+            # Horner's rule at x = a^i, multiplying through logs
+            y = 0
+            for byte in block:
+                y = (_EXP[_LOG[y] + i] if y else 0) ^ byte
+            synd.append(y)
+        if not any(synd):
+            return 0
+
+        # Berlekamp-Massey: error locator polynomial
+        loc, prev, errs, shift, scale = [1], [1], 0, 1, 1
+        for i in range(self.nsym):
+            delta = synd[i]
+            for j in range(1, min(errs + 1, len(loc))):
+                delta ^= _mul(loc[j], synd[i - j])
+            if not delta:
+                shift += 1
+                continue
+            coef = _div(delta, scale)
+            new = loc + [0] * max(0, len(prev) + shift - len(loc))
+            for j, c in enumerate(prev):
+                new[j + shift] ^= _mul(coef, c)
+            if 2 * errs <= i:
+                prev, errs, scale, shift = loc, i + 1 - errs, delta, 1
+            else:
+                shift += 1
+            loc = new
+        loc = loc[:errs + 1]
+        if 2 * errs > self.nsym:
+            return 0
+
+        # Chien search: byte p is wrong if loc(a^-(n-1-p)) == 0
+        positions = [p for p in range(n) if _eval(loc, _EXP[(255 - (n - 1 - p)) % 255]) == 0]
+        if len(positions) != errs:
+            return 0
+
+        # Forney: magnitudes from the evaluator omega = synd * loc mod x^nsym
+        omega = [0] * self.nsym
+        for i, s in enumerate(synd):
+            for j, c in enumerate(loc[:self.nsym - i]):
+                omega[i + j] ^= _mul(s, c)
+        deriv = [c if k & 1 else 0 for k, c in enumerate(loc)][1:]
+        for p in positions:
+            x = _EXP[n - 1 - p]
+            x_inv = _EXP[(255 - (n - 1 - p)) % 255]
+            denom = _eval(deriv, x_inv)
+            if not denom:
+                return 0
+            block[p] ^= _mul(x, _div(_eval(omega, x_inv), denom))
+        return errs
+
+
+CODECS = {'hamming': (Hamming, 16), 'rs': (ReedSolomon, 16)}
+
+
+#Function to build a codec from its spec, e.g. 'hamming:16' or 'rs:32' (no parameter: the default).
+def get_codec(spec):
+    family, _, param = spec.strip().lower().partition(':')
+    try:
+        cls, default = CODECS[family]
+        return cls(int(param) if param else default)
+    except (KeyError, ValueError) as e:
+        raise FecError(f'Unknown FEC codec: {spec} ({e})') from None
+
+
+#Function for the server side of the handshake: the first codec in a peer's comma-separated offer
+#whose family is in `allowed`, or None.
+def select_codec(offered, allowed=tuple(CODECS)):
+    for spec in (offered or '').split(','):
+        if spec.strip() and spec.strip().lower().partition(':')[0] in allowed:
+            try:
+                return get_codec(spec)
+            except FecError:
+                continue
+    return None
+
+
+_coded = {}
+
+
+#Function to attach a codec to a CRC model. Frames built or read with the returned model go through
+#the codec (see framing.py); the same object is returned for the same pair, so frame caches keyed
+#by model are shared by every connection using that combination.
+def with_fec(model, codec):
+    if codec is None:
+        return model
+    key = model.name, codec.spec
+    coded = _coded.get(key)
+    if coded is None:
+        coded = _coded[key] = copy.copy(model)
+        coded.fec = codec
+    return coded
@@ -0,0 +1,312 @@
+import copy
+import random
+import struct
+from collections import namedtuple
+from crc import get_model, introduce_error
+
+# Frame layout (all integers big-endian):
+#   magic (1) | type (1) | flags (1) | payload length (4) | header CRC-8 (1) | payload | payload CRC trailer
+# The trailer is the CRC of the payload with the connection's CRC model, in ceil(width / 8) bytes.
+# The header has its own CRC-8 so a corrupted payload never desynchronises the stream.
+# If the connection's model carries an FEC codec (fec.with_fec), payload + trailer are sent
+# encoded by it; the header still gives the payload length before encoding.
+# If it carries a compression codec (compress.with_compression), payloads worth it are sent
+# compressed with the COMPRESSED flag; the length and the trailer are those of the compressed bytes.
+MAGIC = 0xC7
+HEADER = struct.Struct('>BBBI')
+HEADER_SIZE = HEADER.size + 1
+MAX_PAYLOAD = 1 << 20
+
+# frame types
+HELLO = 1    # client -> server: name, then one "key=value" option per line
+WELCOME = 2  # server -> client: accepted options, one "key=value" per line
+MSG = 3      # chat text (UTF-8)
+ACK = 4      # reliable delivery: sequence numbers received intact (payload: u32 each)
+NACK = 5     # reliable delivery: sequence numbers received corrupted, please resend
+PING = 6     # server -> client keepalive (empty payload); the client answers with a PONG
+PONG = 7
+
+# frame flags
+SEQUENCED = 0x01   # the payload ends with a sequence tag (see seq_tag); used by arq.py
+COMPRESSED = 0x02  # the payload (before any sequence tag) is compressed with the connection's codec
+
+# Sequence tag of a SEQUENCED frame: u32 sequence number + CRC-8 of those 4 bytes.
+# It sits at the end of the payload so the body of a broadcast is still framed once per model,
+# and its own CRC lets a receiver tell which frame was corrupted when the payload CRC fails.
+SEQ_TAG = struct.Struct('>IB')
+SEQ_MOD = 1 << 32
+
+# Handshake frames always use the default model; everything after uses the negotiated one.
+HANDSHAKE_MODEL = get_model()
+# Header and sequence tag CRC-8: a copy of the registered model, so metrics.py can time it apart
+# from the payload CRCs (a connection may use crc-8 too)
+HEADER_MODEL = copy.copy(get_model('crc-8'))
+
+# corrected: bits (Hamming) or bytes (Reed-Solomon) fixed by the FEC codec, if any
+Frame = namedtuple('Frame', 'type flags payload ok corrected', defaults=(0,))
+
+
+#Raised when the byte stream cannot be parsed into frames; the connection should be closed.
+class FramingError(Exception):
+    pass
+
+
+def trailer_size(model):
+    return (model.width + 7) // 8
+
+
+#Bytes after the header of a frame with a `length`-byte payload.
+def body_size(length, model):
+    size = length + trailer_size(model)
+    return size if model.fec is None else model.fec.encoded_size(size)
+
+
+#Function to build the frame header (with its CRC-8) for a payload of `length` bytes.
+def frame_header(ftype, length, flags=0):
+    header = HEADER.pack(MAGIC, ftype, flags, length)
+    return header + bytes((HEADER_MODEL.compute(header),))
+
+
+#Function to build a complete frame around a bytes payload (compressed first if the model says so).
+def pack_frame(ftype, payload, model=None, flags=0):
+    model = get_model(model)
+    if model.compression is not None:
+        payload, flags = _compress(payload, model.compression, flags)
+    return _pack(ftype, payload, model, flags)
+
+
+def _pack(ftype, payload, model, flags):
+    trailer = model.compute(payload).to_bytes(trailer_size(model), 'big')
+    if model.fec is not None:
+        return frame_header(ftype, len(payload), flags) + model.fec.encode(payload + trailer)
+    return b''.join((frame_header(ftype, len(payload), flags), payload, trailer))
+
+
+#Function to build a frame carrying text.
+def pack_text(ftype, text, model=None, flags=0):
+    return pack_frame(ftype, text.encode(), model, flags)
+
+
+#Function to parse one complete frame held in a bytes object (e.g. to check a frame before sending it).
+def unpack_frame(data, model=None):
+    reader = FrameReader(model, size=len(data))
+    reader.feed(data)
+    for frame in reader.frames():
+        return frame
+    raise FramingError('incomplete frame')
+
+
+#Function to compress a payload with `codec` if it is worth it. Returns (payload, flags) to frame.
+def _compress(payload, codec, flags):
+    compressed = codec.compress(payload)
+    if compressed is None:
+        return payload, flags
+    return compressed, flags | COMPRESSED
+
+
+#Frames for one payload, built the first time a CRC model asks for it and then shared
+#(the same bytes object) by every recipient on that model. The payload is compressed at most once
+#per codec, however many models (CRC, FEC) use that codec.
+class FrameCache(dict):
+    def __init__(self, payload, ftype=MSG, flags=0):
+        super().__init__()
+        self.payload = payload.encode() if isinstance(payload, str) else payload
+        self.ftype = ftype
+        self.flags = flags
+        self._prefixes = {}    # model -> (header, CRC state after the payload), for sequenced()
+        self._compressed = {}  # codec -> (payload, flags) to frame
+
+    #Function to get the (payload, flags) that frames for `model` carry.
+    def _body(self, model):
+        codec = model.compression
+        if codec is None:
+            return self.payload, self.flags
+        body = self._compressed.get(codec)
+        if body is None:
+            body = self._compressed[codec] = _compress(self.payload, codec, self.flags)
+        return body
+
+    def __missing__(self, model):
+        payload, flags = self._body(model)
+        frame = self[model] = _pack(self.ftype, payload, model, flags)
+        return frame
+
+    #Function to build the SEQUENCED frame for one recipient. The header and the CRC state after
+    #the payload are computed once per model; each sequence number only costs its 5-byte tag.
+    def sequenced(self, model, seq):
+        try:
+            header, payload, state = self._prefixes[model]
+        except KeyError:
+            payload, flags = self._body(model)
+            header = frame_header(self.ftype, len(payload) + SEQ_TAG.size, flags | SEQUENCED)
+            state = model.update(model.reg_init, payload)
+            self._prefixes[model] = header, payload, state
+        tag = seq_tag(seq)
+        crc = model.finish(model.update(state, tag))
+        if model.fec is not None:
+            return header + model.fec.encode(b''.join((payload, tag, crc.to_bytes(trailer_size(model), 'big'))))
+        return b''.join((header, payload, tag, crc.to_bytes(trailer_size(model), 'big')))
+
+
+#Function to inflate the payload of an intact COMPRESSED frame (its sequence tag, if any, is not
+#compressed). Returns (payload, ok); a payload that does not inflate counts as corrupted.
+def _inflate(payload, flags, codec):
+    if codec is None:
+        return payload, False
+    tag = b''
+    if flags & SEQUENCED:
+        payload, tag = payload[:-SEQ_TAG.size], payload[-SEQ_TAG.size:]
+    try:
+        return codec.decompress(payload) + tag, True
+    except ValueError:
+        return payload, False
+
+
+def seq_tag(seq):
+    seq = seq.to_bytes(4, 'big')
+    return seq + bytes((HEADER_MODEL.compute(seq),))
+
+
+#Function to split a SEQUENCED payload into (body, sequence number). The number is None
+#when the tag itself is damaged.
+def split_seq(payload):
+    if len(payload) < SEQ_TAG.size:
+        return payload, None
+    body, tag = payload[:-SEQ_TAG.size], payload[-SEQ_TAG.size:]
+    seq, check = SEQ_TAG.unpack(tag)
+    return body, (seq if HEADER_MODEL.compute(tag[:4]) == check else None)
+
+
+#ACK/NACK payloads: a list of u32 sequence numbers.
+def pack_seqs(seqs):
+    return b''.join(seq.to_bytes(4, 'big') for seq in seqs)
+
+
+def parse_seqs(payload):
+    return [int.from_bytes(payload[i:i + 4], 'big') for i in range(0, len(payload) - 3, 4)]
+
+
+#Function to flip a random bit in the payload or trailer of a frame (never the header),
+#the framed equivalent of crc.introduce_error. An untouched frame is returned as the same object.
+def introduce_frame_error(frame, error_prob=0.1):
+    if random.random() >= error_prob:
+        return frame
+    return frame[:HEADER_SIZE] + introduce_error(frame[HEADER_SIZE:], 1.0)
+
+
+#Handshake payloads: the first line is the name (HELLO only), the rest are "key=value" options.
+def pack_options(options, first_line=None):
+    lines = [first_line] if first_line is not None else []
+    lines.extend(f'{key}={value}' for key, value in options.items())
+    return '\n'.join(lines)
+
+
+def parse_options(text, has_first_line=False):
+    lines = text.split('\n')
+    first = lines.pop(0) if has_first_line else None
+    options = {}
+    for line in lines:
+        key, sep, value = line.partition('=')
+        if sep:
+            options[key.strip()] = value.strip()
+    return first, options
+
+
+#Incremental frame parser over a reusable receive buffer.
+#recv_into() fills the buffer straight from the socket; frames() yields every complete frame
+#in it, handling several frames per read and frames split across reads.
+#Frame payloads are memoryviews into the buffer: use (or copy) them before the next read.
+class FrameReader:
+    def __init__(self, model=None, size=65536):
+        self.model = model
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0  # first unparsed byte
+        self.end = 0    # end of received data
+
+    #The CRC model used for frame trailers; it may be switched after the handshake.
+    @property
+    def model(self):
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = get_model(model)
+
+    #Function to make room for at least `needed` more bytes after the unparsed data.
+    def _reserve(self, needed):
+        pending = self.end - self.start
+        if self.start and len(self.buf) - self.end < needed:
+            # move the partial frame to the front of the buffer
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        if len(self.buf) - self.end < needed:
+            # a frame larger than the buffer: switch to a bigger one
+            buf = bytearray(max(len(self.buf) * 2, pending + needed))
+            buf[:pending] = self.view[self.start:self.end]
+            self.buf, self.view = buf, memoryview(buf)
+            self.start, self.end = 0, pending
+
+    #Function to read from a socket into the buffer. Returns the number of bytes read (0 on EOF).
+    def recv_into(self, sock, needed=4096):
+        self._reserve(needed)
+        n = sock.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    #Function to append bytes obtained elsewhere (e.g. an asyncio stream) to the buffer.
+    def feed(self, data):
+        self._reserve(len(data))
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    #Function to yield every complete frame currently in the buffer.
+    def frames(self):
+        view = self.view
+        while self.end - self.start >= HEADER_SIZE:
+            start = self.start
+            magic, ftype, flags, length = HEADER.unpack_from(view, start)
+            if magic != MAGIC or HEADER_MODEL.compute(view[start:start + HEADER.size]) != view[start + HEADER.size]:
+                raise FramingError('corrupted frame header')
+            if length > MAX_PAYLOAD:
+                raise FramingError(f'frame too large ({length} bytes)')
+            # the model is looked up per frame: it may change after the handshake
+            model = self.model
+            tsize = trailer_size(model)
+            total = HEADER_SIZE + body_size(length, model)
+            if self.end - start < total:
+                self._reserve(total - (self.end - start))
+                return
+            body = view[start + HEADER_SIZE:start + total]
+            corrected = 0
+            if model.fec is not None:
+                # the codes are systematic: try the CRC on the data as received, correct only if it fails
+                wire, body = body, memoryview(model.fec.strip(body))
+                if model.compute(body[:length]) != int.from_bytes(body[length:length + tsize], 'big'):
+                    body, corrected = model.fec.decode(wire)
+                    body = memoryview(body)
+            payload = body[:length]
+            ok = model.compute(payload) == int.from_bytes(body[length:length + tsize], 'big')
+            if flags & COMPRESSED and ok:
+                payload, ok = _inflate(payload, flags, model.compression)
+            self.start = start + total
+            if self.start == self.end:
+                self.start = self.end = 0
+            yield Frame(ftype, flags, payload, ok, corrected)
+
+    #Function to yield frames from a blocking socket until the peer closes the connection.
+    def iter_socket(self, sock):
+        while True:
+            yield from self.frames()
+            if not self.recv_into(sock):
+                return
+
+    #Function to yield frames from an asyncio StreamReader until the peer closes the connection.
+    async def iter_stream(self, stream, chunk_size=65536):
+        while True:
+            for frame in self.frames():
+                yield frame
+            data = await stream.read(chunk_size)
+            if not data:
+                return
+            self.feed(data)
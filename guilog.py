@@ -0,0 +1,62 @@
+import tkinter as tk
+from collections import deque
+
+# Log pipeline for the Tk windows. Any thread can add lines; the Tk main loop
+# flushes them into the text widget in one insert every `interval_ms`, and the
+# widget keeps at most `max_lines` lines (the oldest are dropped), so chat bursts
+# neither flood the event loop nor grow the widget without bound.
+
+
+class LogPipeline:
+    def __init__(self, root, widget, interval_ms=50, max_lines=1000):
+        self.root = root
+        self.widget = widget
+        self.interval_ms = interval_ms
+        self.max_lines = max_lines
+        # deque.append/popleft are atomic, so worker threads need no lock
+        self.pending = deque()
+        self.lines = 0  # lines currently in the widget
+        self.dropped = 0
+        self.running = True
+        self.root.after(self.interval_ms, self._tick)
+
+    #Function to queue a line from any thread (this object is also usable as a server log sink).
+    def __call__(self, message):
+        self.pending.append(message)
+
+    put = __call__
+
+    def stop(self):
+        self.running = False
+
+    def _tick(self):
+        if not self.running:
+            return
+        try:
+            self.flush()
+        finally:
+            self.root.after(self.interval_ms, self._tick)
+
+    #Function to move all queued lines into the widget (Tk main thread only).
+    def flush(self):
+        n = len(self.pending)
+        if not n:
+            return
+        batch = [self.pending.popleft() for _ in range(n)]
+        # lines that would be scrolled out right away are never inserted
+        if len(batch) > self.max_lines:
+            self.dropped += len(batch) - self.max_lines
+            batch = batch[-self.max_lines:]
+        text = '\n'.join(batch) + '\n'
+        added = text.count('\n')
+
+        self.widget.configure(state='normal')
+        self.widget.insert(tk.END, text)
+        self.lines += added
+        excess = self.lines - self.max_lines
+        if excess > 0:
+            self.widget.delete('1.0', f'{excess + 1}.0')
+            self.lines -= excess
+            self.dropped += excess
+        self.widget.see(tk.END)
+        self.widget.configure(state='disabled')
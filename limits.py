@@ -0,0 +1,98 @@
+import time
+from functools import lru_cache
+from framing import pack_text, PING
+
+# Connection limits shared by both engines (set from the command line, see server.py):
+#   max_clients        connections at a time (handshake included); more are told the server is full
+#                      and closed. With --workers the limit applies to each worker.
+#   msg_rate/msg_burst token bucket on the chat lines of each client (lines per second / at once)
+#   byte_rate/byte_burst  token bucket on the chat payload bytes of each client
+#                      Lines over either limit are dropped and the sender is told (once until a line
+#                      gets through again), like a line with a bad CRC.
+#   handshake_timeout  seconds a new connection has to send its HELLO
+#   keepalive          a client silent for this long is sent a PING (clients answer with a PONG)
+#   idle_timeout       a client silent for this long (PONGs included) is evicted: it is gone or half-open
+# 0 turns a limit off. Every limit has a counter in metrics.py.
+
+MAX_CLIENTS = 0
+MSG_RATE = 0.0
+MSG_BURST = 20
+BYTE_RATE = 0.0
+BYTE_BURST = 64 * 1024
+HANDSHAKE_TIMEOUT = 10.0
+KEEPALIVE = 30.0
+IDLE_TIMEOUT = 120.0
+KEEPALIVE_TICK = 1.0  # how often the keepalive timer looks at the clients
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    #Function to take `amount` tokens. Returns False (taking none) if there are not enough.
+    def take(self, amount=1, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class Limits:
+    def __init__(self, max_clients=MAX_CLIENTS, msg_rate=MSG_RATE, msg_burst=MSG_BURST, byte_rate=BYTE_RATE,
+                 byte_burst=BYTE_BURST, handshake_timeout=HANDSHAKE_TIMEOUT, keepalive=KEEPALIVE,
+                 idle_timeout=IDLE_TIMEOUT):
+        self.max_clients = max_clients
+        self.msg_rate = msg_rate
+        self.msg_burst = msg_burst
+        self.byte_rate = byte_rate
+        self.byte_burst = byte_burst
+        self.handshake_timeout = handshake_timeout or None
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+
+    #Function for admission control: whether a new connection fits next to `connected` others.
+    def admit(self, connected):
+        return not self.max_clients or connected < self.max_clients
+
+    #Function to get a client's (message bucket, byte bucket); None for a limit that is off.
+    def buckets(self):
+        return (TokenBucket(self.msg_rate, self.msg_burst) if self.msg_rate else None,
+                TokenBucket(self.byte_rate, self.byte_burst) if self.byte_rate else None)
+
+    #Function to check a chat line of `size` bytes against a client's buckets. Returns None if it
+    #may go out, else 'messages' or 'bytes' (the limit it hit).
+    def check(self, session, size):
+        now = time.monotonic()
+        if session.msg_bucket is not None and not session.msg_bucket.take(1, now):
+            return 'messages'
+        if session.byte_bucket is not None and not session.byte_bucket.take(size, now):
+            return 'bytes'
+        return None
+
+    #Function for the keepalive timer: what to do with a client last heard from at `last_seen` and
+    #last pinged at `last_ping`: 'evict', 'ping' or None.
+    def keepalive_action(self, last_seen, last_ping, now):
+        idle = now - last_seen
+        if self.idle_timeout and idle >= self.idle_timeout:
+            return 'evict'
+        if self.keepalive and idle >= self.keepalive and now - last_ping >= self.keepalive:
+            return 'ping'
+        return None
+
+    @property
+    def keepalive_on(self):
+        return bool(self.keepalive or self.idle_timeout)
+
+
+#The PING frame for a CRC model, built once.
+@lru_cache(maxsize=64)
+def ping_frame(model):
+    return pack_text(PING, '', model)
@@ -0,0 +1,65 @@
+import logging
+import logging.handlers
+import sys
+import threading
+from collections import deque
+
+# Log sinks for the server. A sink is any callable taking one log line (str);
+# the engines call it from worker threads, so every sink here is thread-safe.
+
+
+#Writes each line to stdout (the default for headless runs).
+class StdoutSink:
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+
+    def __call__(self, message):
+        with self.lock:
+            self.stream.write(message + '\n')
+            self.stream.flush()
+
+
+#Appends lines to a file, rotating it once it reaches max_bytes (keeps `backups` old files).
+class RotatingFileSink:
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=3):
+        self.handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                            encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+
+    def __call__(self, message):
+        self.handler.emit(logging.LogRecord('server', logging.INFO, '', 0, message, None, None))
+
+    def close(self):
+        self.handler.close()
+
+
+#Keeps only the last `maxlen` lines in memory, e.g. for a GUI or a stats endpoint to show.
+class RingBufferSink:
+    def __init__(self, maxlen=1000):
+        self.lines = deque(maxlen=maxlen)
+
+    def __call__(self, message):
+        self.lines.append(message)
+
+    def snapshot(self):
+        return list(self.lines)
+
+
+#Drops everything (benchmarks).
+def null_sink(message):
+    pass
+
+
+#Function to build a sink from a command-line spec: stdout, null, ring[:N] or file:PATH.
+def make_sink(spec):
+    kind, _, arg = spec.partition(':')
+    if kind == 'stdout':
+        return StdoutSink()
+    if kind == 'null':
+        return null_sink
+    if kind == 'ring':
+        return RingBufferSink(int(arg) if arg else 1000)
+    if kind == 'file' and arg:
+        return RotatingFileSink(arg)
+    raise ValueError(f'Unknown log sink: {spec} (expected stdout, null, ring[:N] or file:PATH)')
@@ -0,0 +1,275 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Runtime metrics for the server: counters, gauges and histograms in one registry, exported in the
+# Prometheus text format by a small HTTP endpoint (--metrics-port, GET /metrics) and logged as a
+# one-line snapshot every --metrics-interval seconds.
+# Both engines update the metrics below from their hot paths, so updating one is kept to an
+# attribute add (and a bisect for a histogram) with no lock: two threads may race on the same
+# counter and lose an increment now and then, which is fine for monitoring. Gauges that describe
+# the whole server (connected clients, queue depths) are callbacks, evaluated only when the
+# metrics are read. CRC timing wraps CrcModel.update and is only installed with the exporter on.
+# With --workers every worker has its own metrics, served on --metrics-port + its number.
+# http.server is only imported when the endpoint is started.
+
+# histogram bucket bounds in seconds: 1 us .. 1 s
+BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2,
+           5e-2, 0.1, 0.25, 0.5, 1.0)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, '', self.value
+
+
+#A gauge is set directly or, with `fn`, computed when the metrics are read.
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return 0
+        return self.value
+
+    def samples(self):
+        yield self.name, '', self.get()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    #Function to estimate a quantile (0..1) from the buckets: the bound of the bucket it falls in.
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            yield f'{self.name}_bucket', f'le="{bound:g}"', seen
+        yield f'{self.name}_bucket', 'le="+Inf"', self.count
+        yield f'{self.name}_sum', '', self.sum
+        yield f'{self.name}_count', '', self.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.labels = ''  # constant labels on every sample, e.g. 'worker="2"'
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help, fn=None):
+        return self._add(Gauge(name, help, fn))
+
+    def histogram(self, name, help, buckets=BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    #Function to render every metric in the Prometheus text exposition format.
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                labels = ','.join(label for label in (self.labels, labels) if label)
+                lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    #Function to summarize the metrics on one line: counters and gauges, and for histograms the
+    #count, mean and 99th percentile in microseconds.
+    def snapshot(self):
+        parts = []
+        for metric in self.metrics:
+            short = metric.name.removeprefix('chat_')
+            if isinstance(metric, Histogram):
+                mean = metric.sum / metric.count if metric.count else 0.0
+                parts.append(f'{short}={metric.count}/{mean * 1e6:.0f}us/p99<={metric.quantile(0.99) * 1e6:g}us')
+            elif isinstance(metric, Gauge):
+                parts.append(f'{short}={metric.get()}')
+            else:
+                parts.append(f'{short}={metric.value}')
+        return ' '.join(parts)
+
+
+registry = Registry()
+
+connections = registry.counter('chat_connections_total', 'Connections accepted')
+reconnects = registry.counter('chat_reconnects_total', 'Clients that joined under a name seen before')
+messages_in = registry.counter('chat_messages_in_total', 'Chat frames received from clients')
+messages_out = registry.counter('chat_messages_out_total', 'Frames queued for clients')
+broadcasts = registry.counter('chat_broadcasts_total', 'Messages fanned out to the connected clients')
+crc_failures = registry.counter('chat_crc_failures_total', 'Frames from clients whose CRC did not match')
+drops = registry.counter('chat_queue_drops_total', 'Frames dropped by a full outbound queue')
+dropped_clients = registry.counter('chat_dropped_clients_total', 'Clients disconnected by the queue policy')
+rejected = registry.counter('chat_rejected_total', 'Connections turned away because the server was full')
+handshake_timeouts = registry.counter('chat_handshake_timeouts_total', 'Connections that sent no HELLO in time')
+rate_limited = registry.counter('chat_rate_limited_messages_total', 'Chat lines dropped by the per-client line limit')
+byte_limited = registry.counter('chat_rate_limited_bytes_total', 'Chat lines dropped by the per-client byte limit')
+pings = registry.counter('chat_pings_total', 'Keepalive pings sent to quiet clients')
+evictions = registry.counter('chat_idle_evictions_total', 'Clients evicted for not answering keepalive pings')
+clients = registry.gauge('chat_connected_clients', 'Clients that completed the handshake')
+rooms = registry.gauge('chat_rooms', 'Rooms with at least one member')
+queued = registry.gauge('chat_queued_frames', 'Frames waiting in outbound queues, all clients')
+queue_max = registry.gauge('chat_queue_depth_max', 'Longest outbound queue')
+crc_seconds = registry.histogram('chat_crc_seconds', 'Time to compute one payload CRC (frame or message, encode or check)')
+header_crc_seconds = registry.histogram('chat_header_crc_seconds', 'Time to compute one frame header or sequence tag CRC-8')
+send_seconds = registry.histogram('chat_send_seconds', 'Time to write one batch of frames to a client socket')
+writes = registry.counter('chat_send_writes_total', 'Socket writes to clients (one sendmsg/writelines per batch of frames)')
+coalesced = registry.counter('chat_coalesced_frames_total', 'Frames that shared a write with another frame (writes saved)')
+coalesce_seconds = registry.histogram('chat_coalesce_wait_seconds', 'Time a writer held frames back to coalesce them')
+fanout_seconds = registry.histogram('chat_broadcast_fanout_seconds', 'Time to queue one broadcast for every client')
+
+# names of the clients that joined, least recently joined first; only the last NAMES_MAX are kept,
+# so a name not seen for that many other joins counts as new again
+NAMES_MAX = 10000
+_names = OrderedDict()
+_names_lock = threading.Lock()
+
+
+#Function to count a client joining; a name seen before in this process counts as a reconnect.
+def joined(name):
+    with _names_lock:
+        if name in _names:
+            _names.move_to_end(name)
+            reconnects.inc()
+            return
+        _names[name] = None
+        if len(_names) > NAMES_MAX:
+            _names.popitem(last=False)
+
+
+#Function to make the gauges read an engine's SessionRegistry.
+def watch(sessions):
+    clients.fn = lambda: len(sessions.snapshot())
+    rooms.fn = sessions.room_count
+    queued.fn = lambda: sum(len(s.queue) for s in sessions.snapshot())
+    queue_max.fn = lambda: max((len(s.queue) for s in sessions.snapshot()), default=0)
+
+
+#Function to time every CRC computed in this process. CrcModel.update is the one step they all
+#share: compute() (framing's trailers and checks), crc.encode_message/decode_message and
+#FrameCache.sequenced (the payload once per model, then the tag per recipient). Header CRCs have
+#their own histogram. Idempotent.
+def instrument_crc():
+    from crc import CrcModel
+    from framing import HEADER_MODEL
+    update = CrcModel.update
+    if getattr(update, 'timed', False):
+        return
+
+    def timed_update(self, reg, data):
+        start = time.perf_counter()
+        try:
+            return update(self, reg, data)
+        finally:
+            (header_crc_seconds if self is HEADER_MODEL else crc_seconds).observe(time.perf_counter() - start)
+
+    timed_update.timed = True
+    CrcModel.update = timed_update
+
+
+#Request handler class for MetricsServer, made (and http.server imported) when an endpoint starts.
+def _handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = self.server.registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+#Local stats endpoint: GET http://host:port/metrics, served from a daemon thread.
+class MetricsServer:
+    def __init__(self, port, host='127.0.0.1', registry=registry):
+        from http.server import ThreadingHTTPServer
+        self.httpd = ThreadingHTTPServer((host, port), _handler())
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self.address = self.httpd.server_address
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+#Logs registry.snapshot() every `interval` seconds from a daemon thread.
+class Snapshotter:
+    def __init__(self, interval, log, registry=registry):
+        self.interval = interval
+        self.log = log
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.log(f'[METRICS] {self.registry.snapshot()}')
+
+    def close(self):
+        self.stopped.set()
@@ -0,0 +1,53 @@
+from functools import lru_cache
+from framing import FrameCache, pack_text, MSG
+
+# Fixed server notices. Their frames are built once per CRC model and kept in a small LRU
+# cache, so repeated notices (and join/leave lines for returning names) are never re-encoded.
+SHUTDOWN = 'Server is shutting down. See you again soon!'
+INVALID_NAME = 'Invalid name CRC. Disconnecting.'
+CRC_DROPPED = '[CRC ERROR]: Your message was corrupted and was not delivered.'
+CRC_REBROADCAST = '[CRC ERROR]: Error in broadcast. Rebroadcasting...'
+JOINED = 'Client {name} has joined the chat!'
+LEFT = 'Client {name} has left the chat.'
+SERVER_FULL = 'Server is full. Try again later.'
+RATE_LIMITED = '[RATE LIMIT]: You are sending too fast; messages are being dropped.'
+IDLE = 'Disconnected: no reply to keepalive pings.'
+HANDSHAKE_TIMEOUT = 'Handshake timed out. Disconnecting.'
+JOINED_ROOM = 'Client {name} has joined {room}.'
+LEFT_ROOM = 'Client {name} has left {room}.'
+ROOM_CURRENT = 'You are now talking in {room}.'
+NO_ROOM = 'You are not in any room. Type [join ROOM] to talk.'
+INVALID_ROOM = 'Invalid room name (letters, digits, . _ - and at most 32 characters).'
+TOO_MANY_ROOMS = 'You are in too many rooms. Type [leave ROOM] first.'
+
+
+@lru_cache(maxsize=512)
+def notice_frame(text, model):
+    return pack_text(MSG, text, model)
+
+
+#FrameCache for a notice: frames come from (and go into) the LRU cache above.
+class NoticeFrames(FrameCache):
+    def __init__(self, text):
+        super().__init__(text)
+        self.text = text
+
+    def __missing__(self, model):
+        frame = self[model] = notice_frame(self.text, model)
+        return frame
+
+
+def joined(name):
+    return JOINED.format(name=name)
+
+
+def left(name):
+    return LEFT.format(name=name)
+
+
+def joined_room(name, room):
+    return JOINED_ROOM.format(name=name, room=room)
+
+
+def left_room(name, room):
+    return LEFT_ROOM.format(name=name, room=room)
@@ -0,0 +1,323 @@
+import socket
+import threading
+import time
+from collections import deque
+import metrics
+
+asyncio = None  # imported by the first AsyncOutboundQueue; the thread engine never needs it
+
+# Per-client outbound queues. A broadcast only appends the (shared) frame bytes to each
+# recipient's queue; a writer thread (or asyncio task) per client does the actual sending,
+# so one slow receiver never delays the others.
+# A writer sends everything already queued (up to Coalescing.frames frames) in one write: a single
+# sendmsg (writev) on the thread engine, one writelines on the asyncio engine. With a coalescing
+# delay it also holds the first frame back for more, Nagle-style: it flushes as soon as no new frame
+# came in for `idle` seconds (the burst is over), `frames` frames are waiting, or `delay` seconds have
+# passed since it started waiting (the latency cap). metrics.py counts the writes, the frames that
+# shared one (writes saved) and the time frames were held back.
+
+# What to do when a client's queue is full:
+DROP_OLDEST = 'drop-oldest'    # discard the oldest queued frame to make room
+DISCONNECT = 'disconnect'      # give up on the client
+BACKPRESSURE = 'backpressure'  # make the sender wait for room (up to `timeout` seconds, then disconnect)
+POLICIES = (DROP_OLDEST, DISCONNECT, BACKPRESSURE)
+
+
+# send everything queued in one write, up to this many frames (sendmsg takes at most IOV_MAX buffers)
+COALESCE_FRAMES = 64
+IOV_MAX = 1024
+# default coalescing window (seconds): 0 holds nothing back
+COALESCE_DELAY = 0.0
+COALESCE_IDLE = 0.001
+
+
+class Coalescing:
+    def __init__(self, delay=COALESCE_DELAY, idle=COALESCE_IDLE, frames=COALESCE_FRAMES):
+        if not 1 <= frames <= IOV_MAX:
+            raise ValueError(f'frames per write must be 1..{IOV_MAX}')
+        self.delay = delay
+        self.idle = min(idle, delay) if delay else 0.0
+        self.frames = frames
+
+    def __str__(self):
+        if not self.delay:
+            return f'up to {self.frames} queued frames per write'
+        return f'up to {self.frames} frames per write, held up to {self.delay * 1e3:g} ms ({self.idle * 1e3:g} ms idle)'
+
+
+NO_DELAY = Coalescing()
+
+
+#Function to write a batch of frames with one sendmsg (the remainder with sendall after a short write).
+def send_frames(sock, batch):
+    if len(batch) == 1 or not hasattr(sock, 'sendmsg'):
+        sock.sendall(batch[0] if len(batch) == 1 else b''.join(batch))
+        return
+    sent = sock.sendmsg(batch)
+    total = sum(map(len, batch))
+    if sent < total:
+        sock.sendall(b''.join(batch)[sent:])
+
+
+#Line for the shutdown log: writes saved by coalescing, and how long frames were held back for it.
+def write_report():
+    writes, saved, held = metrics.writes.value, metrics.coalesced.value, metrics.coalesce_seconds
+    frames = writes + saved
+    line = f'frames={frames} writes={writes} saved={saved} ({saved / frames if frames else 0:.0%})'
+    if held.count:
+        line += f' held={held.count} mean={held.sum / held.count * 1e6:.0f}us p99<={held.quantile(0.99) * 1e6:g}us'
+    return line
+
+
+#Function to record one write of `count` frames that were held back `held` seconds.
+def _count_write(count, held, seconds):
+    metrics.writes.inc()
+    if count > 1:
+        metrics.coalesced.inc(count - 1)
+    if held:
+        metrics.coalesce_seconds.observe(held)
+    metrics.send_seconds.observe(seconds)
+
+
+def check_policy(policy):
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown queue policy: {policy} (expected one of {", ".join(POLICIES)})')
+    return policy
+
+
+#Bounded outbound queue drained by its own writer thread (thread engine).
+#The writer owns the socket: it closes it when the queue is closed or a send fails.
+#With BACKPRESSURE put() still accepts the frame, as on the asyncio engine; the sender should then
+#call wait_for_space(), once it holds no lock other senders need.
+class OutboundQueue:
+    def __init__(self, sock, maxsize=256, policy=DROP_OLDEST, timeout=5.0, on_error=None, coalesce=NO_DELAY):
+        self.sock = sock
+        self.maxsize = maxsize
+        self.policy = check_policy(policy)
+        self.timeout = timeout
+        self.on_error = on_error  # called from the writer thread if a send fails
+        self.coalesce = coalesce
+        if coalesce.delay:
+            # the writer does Nagle's job now; the kernel should not hold the batch back again
+            # (asyncio sets TCP_NODELAY on its sockets already)
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+        self.frames = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.flush = True
+        self.sent = 0
+        self.writes = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name='writer', daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def full(self):
+        return len(self.frames) >= self.maxsize
+
+    #Function to queue a frame (bytes) for sending. Returns False if the client should be disconnected.
+    def put(self, frame):
+        with self.cond:
+            if self.closed:
+                return False
+            if len(self.frames) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self.frames.popleft()
+                    self.dropped += 1
+                    metrics.drops.inc()
+                elif self.policy == DISCONNECT:
+                    return False
+            self.frames.append(frame)
+            self.cond.notify_all()
+            metrics.messages_out.inc()
+            return True
+
+    #Function for the sender to wait until the queue has room again. Returns False on timeout.
+    def wait_for_space(self):
+        with self.cond:
+            has_room = lambda: self.closed or len(self.frames) < self.maxsize
+            return self.cond.wait_for(has_room, self.timeout) and not self.closed
+
+    #Function to stop the queue. With flush=True the frames already queued are still sent first.
+    def close(self, flush=True):
+        with self.cond:
+            self.closed = True
+            self.flush = self.flush and flush
+            self.cond.notify_all()
+        if not flush:
+            # wakes the writer up if it is stuck in sendall on a client that stopped reading
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+    #Function for the writer, with the lock held and a frame queued: wait for more frames to coalesce.
+    #Returns the seconds spent waiting.
+    def _linger(self):
+        coalesce = self.coalesce
+        start = time.monotonic()
+        deadline = start + coalesce.delay
+        while not self.closed and len(self.frames) < coalesce.frames:
+            count = len(self.frames)
+            timeout = min(coalesce.idle, deadline - time.monotonic())
+            if timeout <= 0 or not self.cond.wait_for(lambda: self.closed or len(self.frames) > count, timeout):
+                break
+        return time.monotonic() - start
+
+    def _run(self):
+        failed = False
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.frames or self.closed)
+                held = self._linger() if self.coalesce.delay and self.frames else 0.0
+                if not self.frames or (self.closed and not self.flush):
+                    break
+                batch = [self.frames.popleft() for _ in range(min(len(self.frames), self.coalesce.frames))]
+                self.cond.notify_all()
+            start = time.perf_counter()
+            try:
+                send_frames(self.sock, batch)
+            except OSError:
+                failed = True
+                break
+            _count_write(len(batch), held, time.perf_counter() - start)
+            self.sent += len(batch)
+            self.writes += 1
+        with self.cond:
+            self.closed = True
+            self.frames.clear()
+            self.cond.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        if failed and self.on_error is not None:
+            self.on_error()
+
+
+#Bounded outbound queue drained by a writer task (asyncio engine). Must be used on the event loop.
+#With BACKPRESSURE put() still accepts the frame; the sender should then await wait_for_space().
+class AsyncOutboundQueue:
+    def __init__(self, writer, maxsize=256, policy=DROP_OLDEST, timeout=5.0, on_error=None, coalesce=NO_DELAY):
+        self.writer = writer
+        self.maxsize = maxsize
+        self.policy = check_policy(policy)
+        self.timeout = timeout
+        self.on_error = on_error
+        self.coalesce = coalesce
+        global asyncio
+        import asyncio
+        self.frames = deque()
+        self.ready = asyncio.Event()
+        self.space = asyncio.Event()
+        self.space.set()
+        self.closed = False
+        self.sent = 0
+        self.writes = 0
+        self.dropped = 0
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def __len__(self):
+        return len(self.frames)
+
+    def full(self):
+        return len(self.frames) >= self.maxsize
+
+    #Function to queue a frame (bytes) for sending. Returns False if the client should be disconnected.
+    def put(self, frame):
+        if self.closed:
+            return False
+        if len(self.frames) >= self.maxsize:
+            if self.policy == DROP_OLDEST:
+                self.frames.popleft()
+                self.dropped += 1
+                metrics.drops.inc()
+            elif self.policy == DISCONNECT:
+                return False
+        self.frames.append(frame)
+        self.ready.set()
+        metrics.messages_out.inc()
+        if len(self.frames) >= self.maxsize:
+            self.space.clear()
+        return True
+
+    #Function for the sender to wait until the queue has room again. Returns False on timeout.
+    async def wait_for_space(self):
+        try:
+            await asyncio.wait_for(self.space.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        return not self.closed
+
+    #Function to stop the queue. With flush=True the frames already queued are still sent first.
+    def close(self, flush=True):
+        self.closed = True
+        if not flush:
+            self.frames.clear()
+            # unblocks the writer task if it is waiting in drain() on a client that stopped reading
+            self.writer.transport.abort()
+        self.ready.set()
+        self.space.set()
+
+    #Coroutine for the writer, with a frame queued: wait for more frames to coalesce (see the top of
+    #this file). Returns the seconds spent waiting.
+    async def _linger(self):
+        coalesce = self.coalesce
+        start = time.monotonic()
+        deadline = start + coalesce.delay
+        while not self.closed and 0 < len(self.frames) < coalesce.frames:
+            count = len(self.frames)
+            timeout = min(coalesce.idle, deadline - time.monotonic())
+            if timeout <= 0:
+                break
+            await asyncio.sleep(timeout)
+            if len(self.frames) <= count:
+                break
+        return time.monotonic() - start
+
+    async def _run(self):
+        failed = False
+        try:
+            while True:
+                if not self.frames:
+                    if self.closed:
+                        break
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                held = await self._linger() if self.coalesce.delay else 0.0
+                if not self.frames:
+                    continue
+                batch = [self.frames.popleft() for _ in range(min(len(self.frames), self.coalesce.frames))]
+                if len(self.frames) < self.maxsize:
+                    self.space.set()
+                start = time.perf_counter()
+                if len(batch) == 1:
+                    self.writer.write(batch[0])
+                else:
+                    self.writer.writelines(batch)
+                await self.writer.drain()
+                _count_write(len(batch), held, time.perf_counter() - start)
+                self.sent += len(batch)
+                self.writes += 1
+        except (ConnectionError, OSError):
+            failed = True
+        finally:
+            self.closed = True
+            self.frames.clear()
+            self.space.set()
+            self.writer.close()
+        if failed and self.on_error is not None:
+            self.on_error()
@@ -0,0 +1,156 @@
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+# Profiling on demand: a sampling profiler for the live server, started for a time window by
+# SIGUSR1 (headless) or the "[profile N]" command in the server window, and costing nothing when
+# it is not running (no hooks are installed; only the window's own thread runs).
+# During a window a background thread looks at the stack of every other thread every `interval`
+# seconds (sys._current_frames), and tracemalloc traces allocations. At the end it writes:
+#   DIR/profile-<time>-<role>.pstats  samples of the threads with that role, in the pstats format
+#                                     (python -m pstats FILE); times are samples * interval and
+#                                     call counts are sample counts
+#   DIR/profile-<time>.txt            samples per thread, the top functions of each role by own and
+#                                     cumulative time, and the top allocations (tracemalloc has no
+#                                     thread information: allocations are listed by source line)
+# A thread's role is the first word of its name (see the engines): accept, client (per-client
+# handlers, which also run the broadcasts they trigger), writer, arq-timers, bus, chatlog, and for
+# the asyncio engine MainThread or event-loop, which runs every client.
+
+INTERVAL = 0.005  # seconds between samples
+SECONDS = 10.0    # default window
+TOP = 25          # lines per section of the text report
+FRAMES = 8        # traceback depth kept by tracemalloc
+
+
+def role(thread_name):
+    return thread_name.split(' ', 1)[0]
+
+
+def _key(code):
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def _label(key):
+    filename, line, name = key
+    return f'{os.path.basename(filename)}:{line}({name})'
+
+
+#Samples of one role: how often each function was running (own) or on the stack (cumulative),
+#and who called it.
+class _Samples:
+    def __init__(self):
+        self.count = 0
+        self.own = Counter()
+        self.cumulative = Counter()
+        self.callers = defaultdict(Counter)  # function -> caller -> samples
+
+    def add(self, frame):
+        self.count += 1
+        self.own[_key(frame.f_code)] += 1
+        seen = set()
+        callee = None
+        while frame is not None:
+            key = _key(frame.f_code)
+            if key not in seen:  # recursion counts once per sample
+                seen.add(key)
+                self.cumulative[key] += 1
+            if callee is not None:
+                self.callers[callee][key] += 1
+            callee = key
+            frame = frame.f_back
+
+    #Function to convert the samples into the dict pstats.Stats loads: function -> (primitive calls,
+    #calls, own time, cumulative time, {caller: (calls, calls, own time, cumulative time)}).
+    def pstats(self, interval):
+        stats = {}
+        for key, total in self.cumulative.items():
+            callers = {caller: (n, n, n * interval, n * interval) for caller, n in self.callers[key].items()}
+            stats[key] = (total, total, self.own[key] * interval, total * interval, callers)
+        return stats
+
+
+class Profiler:
+    def __init__(self, directory='profiles', log=print, interval=INTERVAL, top=TOP, prefix='profile'):
+        self.directory = directory
+        self.log = log
+        self.interval = interval
+        self.top = top
+        self.prefix = prefix  # file name prefix, e.g. 'worker2' in a sharded server
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    #Function to start a profiling window of `seconds`. Returns False if one is already running.
+    def start(self, seconds=SECONDS, memory=True):
+        if self.running:
+            self.log('[PROFILE] already running')
+            return False
+        self.thread = threading.Thread(target=self._run, args=(seconds, memory), name='profiler', daemon=True)
+        self.thread.start()
+        self.log(f'[PROFILE] sampling every {self.interval * 1000:g} ms for {seconds:g} s')
+        return True
+
+    def _run(self, seconds, memory):
+        import tracemalloc  # only imported once a profile runs
+        traced = memory and not tracemalloc.is_tracing()
+        if traced:
+            tracemalloc.start(FRAMES)
+        roles = defaultdict(_Samples)
+        threads = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.get(ident, f'thread-{ident}')
+                threads[name] += 1
+                roles[role(name)].add(frame)
+            time.sleep(self.interval)
+        snapshot = None
+        if memory and tracemalloc.is_tracing():
+            # leave out the profiler's own bookkeeping
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)))
+        if traced:
+            tracemalloc.stop()
+        try:
+            paths = self._write(roles, threads, snapshot)
+        except OSError as e:
+            self.log(f'[PROFILE] cannot write the report: {e}')
+            return
+        self.log(f'[PROFILE] {sum(threads.values())} samples written to {", ".join(paths)}')
+
+    def _write(self, roles, threads, snapshot):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f'{self.prefix}-{time.strftime("%Y%m%d-%H%M%S")}')
+        paths = []
+        for name, samples in sorted(roles.items()):
+            path = f'{base}-{name}.pstats'
+            with open(path, 'wb') as f:
+                marshal.dump(samples.pstats(self.interval), f)
+            paths.append(path)
+
+        lines = [f'samples every {self.interval * 1000:g} ms', '', 'samples per thread:']
+        lines += [f'  {count:>7}  {name}' for name, count in threads.most_common()]
+        for name, samples in sorted(roles.items(), key=lambda item: -item[1].count):
+            lines += ['', f'role {name}: {samples.count} samples', '  own      cumulative']
+            for key, total in samples.cumulative.most_common(self.top):
+                lines.append(f'  {samples.own[key] / samples.count:>6.1%}  {total / samples.count:>6.1%}  {_label(key)}')
+        if snapshot is not None:
+            lines += ['', f'top {self.top} allocations by source line (size, count):']
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                frame = stat.traceback[0]
+                lines.append(f'  {stat.size / 1024:>9.1f} KiB {stat.count:>8}  {frame.filename}:{frame.lineno}')
+        path = f'{base}.txt'
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        paths.append(path)
+        return paths
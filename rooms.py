@@ -0,0 +1,75 @@
+import re
+from functools import lru_cache
+import notices
+
+# Rooms: independent conversations on one server. A client names the rooms it wants in its HELLO
+# ("rooms=dev,lobby"; the first one is where its lines go) or ends up in DEFAULT, so clients that
+# know nothing about rooms all talk in one room as before. After joining it types commands:
+#   [join dev]    enter dev (or switch to it) and talk there
+#   [leave dev]   leave dev; lines go to another room the client is in
+# A chat line reaches the members of the sender's current room only: the registry keeps a
+# room -> members index (session.py) next to each session's own set of rooms, both updated
+# incrementally. Lines in rooms other than DEFAULT are relayed as "[room] name: text".
+# Joins and leaves of the chat are announced in the client's rooms; server notices go to everyone.
+# The chat log (--history) records DEFAULT only.
+
+DEFAULT = 'lobby'
+MAX_ROOMS = 16  # rooms one client may be in
+_NAME = re.compile(r'[A-Za-z0-9_.-]{1,32}')
+JOIN = 'join'
+LEAVE = 'leave'
+_COMMAND = re.compile(rb'\[(join|leave) ([^\]\s]+)\]')
+
+
+def valid(room):
+    return _NAME.fullmatch(room) is not None
+
+
+#Function to get the rooms a client asked for in its HELLO, e.g. "dev,lobby" (invalid names skipped).
+def parse(option):
+    wanted = []
+    for room in (option or '').split(','):
+        room = room.strip()
+        if valid(room) and room not in wanted and len(wanted) < MAX_ROOMS:
+            wanted.append(room)
+    return wanted or [DEFAULT]
+
+
+#Function to recognize a room command in a chat payload. Returns (JOIN or LEAVE, room) or None.
+def command(payload):
+    if payload[:1] != b'[':
+        return None
+    match = _COMMAND.fullmatch(bytes(payload))
+    if match is None:
+        return None
+    return match.group(1).decode(), match.group(2).decode('utf-8', 'replace')
+
+
+#What goes before "name: " on a line relayed in `room`.
+@lru_cache(maxsize=1024)
+def label(room):
+    return b'' if room == DEFAULT else f'[{room}] '.encode()
+
+
+#The room a client's lines go to once it joins or leaves `room`.
+def switched(session, verb, room):
+    if verb == JOIN:
+        return room
+    if session.room != room:
+        return session.room
+    return min(session.rooms - {room}, default=None)
+
+
+#Function to apply a room change once it takes effect (at once, or when it comes back from the
+#cluster bus): `session` (None for a client of another worker) enters or leaves `room`, and the
+#room's members are told. `broadcast` is the engine's broadcast_raw. With `switch` false the
+#session's current room is left alone (a worker switched it when it published the change).
+def apply(sessions, broadcast, session, name, verb, room, switch=True):
+    if verb == JOIN:
+        if session is not None and sessions.enter(session, room) and switch:
+            session.room = room
+        broadcast(notices.NoticeFrames(notices.joined_room(name, room)), None, (room,))
+    else:
+        broadcast(notices.NoticeFrames(notices.left_room(name, room)), None, (room,))
+        if session is not None and sessions.leave(session, room) and switch and session.room == room:
+            session.room = min(session.rooms, default=None)
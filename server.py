@@ -1,65 +1,147 @@
+import signal
 import socket
 import threading
-import tkinter as tk
-from tkinter import scrolledtext
+import time
 import sys
-from crc import encode_message, decode_message, introduce_error
-
-HOST = socket.gethostbyname(socket.gethostname())
+from functools import partial
+import arq
+import chatlog
+import common
+import compress
+import fec
+import limits
+import metrics
+import profiling
+import rooms
+from crc import get_model
+import notices
+from outbound import OutboundQueue, Coalescing, COALESCE_IDLE, DROP_OLDEST, BACKPRESSURE, POLICIES, write_report
+from logsink import StdoutSink, make_sink
+from channel import make_channel
+from session import Session, SessionRegistry
+from framing import FrameReader, FrameCache, FramingError, pack_text, pack_options, HANDSHAKE_MODEL, HELLO, WELCOME
+
+# Address to listen on when none is given (None: this host's IP, see common.default_host)
+HOST = None
 PORT = 1234
 
-clients = []  # list of client sockets
-names = {}    # map socket -> name
+sessions = SessionRegistry()  # map socket -> Session (name, CRC model, outbound queue, counters)
 server_socket = None
 server_running = False
 accept_thread = None
-lock = threading.Lock()  # ensures threads don’t modify clients/names at the same time.
-
-
-def start_server(port=1234):
-    global server_socket, server_running, accept_thread
+arq_thread = None
+keepalive_thread = None
+# Which engine runs the server: 'thread' (one thread per client, below) or 'asyncio' (aserver.py).
+# Set with --engine on the command line.
+ENGINE = 'thread'
+# Where log lines go (see logsink.py); server_gui.py points this at its window.
+log_sink = StdoutSink()
+# Outbound queue length per client, and what to do when it fills up (see outbound.py)
+QUEUE_SIZE = 256
+QUEUE_POLICY = DROP_OLDEST
+# How writers batch frames into one send: frames per write, and an optional window to wait for more
+COALESCE = Coalescing()
+# Largest ARQ window offered to clients that ask for reliable delivery (0 turns it off), and how
+# often the retransmit timers run (see arq.py)
+ARQ_WINDOW = arq.WINDOW
+ARQ_TICK = 0.05
+# FEC codec families clients may ask for (see fec.py); empty turns FEC off
+FEC_CODECS = tuple(fec.CODECS)
+# Compression codec families clients may ask for (see compress.py; empty turns it off), and the
+# smallest payload worth compressing
+COMPRESS_CODECS = tuple(compress.CODECS)
+COMPRESS_MIN = compress.MIN_SIZE
+# Simulated noisy link for server-typed broadcasts (see channel.py); the seed makes a run repeatable
+CHANNEL = 'flips:1@0.1'
+channel = make_channel(CHANNEL)
+# Worker processes sharing the port (--workers, see cluster.py). In a worker, REUSE_PORT is set and
+# `bus` is its cluster.WorkerBus: chat lines, joins and notices go through it instead of straight out.
+WORKERS = 1
+REUSE_PORT = False
+# How the supervisor passes events to the workers: a shared-memory ring of BUS_SLOTS slots (see shmring.py) or sockets
+BUS = 'shm'
+BUS_SLOTS = 4096
+BUS_SLOT_SIZE = 1024
+# Persistent chat history (--history DIR, see chatlog.py): the ChatLog, or a read-only LogReader in a
+# worker process. Clients ask for up to HISTORY_MAX lines of it in their HELLO.
+history = None
+HISTORY_MAX = 1000
+# Held while a line of rooms.DEFAULT is logged and broadcast, and while a client is sent its history
+# and joined, so each line reaches a joining client once: from the log or live, never both or neither
+history_lock = threading.Lock()
+bus = None
+# Profiling on demand (SIGUSR1 or "[profile N]" in the server window, see profiling.py): reports go to
+# PROFILE_DIR, a window lasts PROFILE_SECONDS unless the command says otherwise
+PROFILE_DIR = 'profiles'
+PROFILE_SECONDS = profiling.SECONDS
+PROFILE_PREFIX = 'profile'
+profiler = None
+# Connection limits: max clients, per-client rate limits, handshake timeout and keepalive (see limits.py)
+LIMITS = limits.Limits()
+
+
+def log(message):
+    log_sink(message)
+
+
+def start_server(port=1234, host=None):
+    global server_socket, server_running, accept_thread, arq_thread, keepalive_thread
+    host = host or HOST or common.default_host()
     if server_running:
-        gui_log('Server already running')
+        log('Server already running')
         return
     
     #Creating the main listening socket that clients will connect to
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     #Allows the OS to reuse the port immediately after the server closes..
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    #Worker processes all listen on the same port; the kernel spreads connections over them.
+    if REUSE_PORT:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     
     try:
-        server_socket.bind((HOST, port))
+        server_socket.bind((host, port))
         server_socket.listen()
     except Exception as e:
-        gui_log(f'Failed to start server: {e}')
+        log(f'Failed to start server: {e}')
         return
     
     server_running = True
-    gui_log(f'Server started successfully! Server running on {HOST}:{port}')
-    gui_log(f'IP Address: {HOST}')
-    gui_log(f'Port: {port}')
-    gui_log('Waiting for connections...\n')
+    log(f'Server started successfully! Server running on {host}:{port}')
+    log(f'IP Address: {host}')
+    log(f'Port: {port}')
+    log('Waiting for connections...\n')
 
     #Starts a daemon thread to accept clients continuously in the background.
-    accept_thread = threading.Thread(target=accept_clients, daemon=True)
+    accept_thread = threading.Thread(target=accept_clients, name='accept', daemon=True)
     accept_thread.start()
+    arq_thread = threading.Thread(target=arq_timers, name='arq-timers', daemon=True)
+    arq_thread.start()
+    if LIMITS.keepalive_on:
+        keepalive_thread = threading.Thread(target=keepalive_timers, name='keepalive', daemon=True)
+        keepalive_thread.start()
 
 
 def stop_server():
     global server_running, server_socket
     if not server_running:
-        gui_log('Server not running')
+        log('Server not running')
         return
-    gui_log('[SERVER SHUTDOWN]')
-    broadcast_notice('Server is shutting down. See you again soon!')
-    with lock:
-        for c in clients[:]:
-            try:
-                c.close()
-            except:
-                pass
-        clients.clear()
-        names.clear()
+    log('[SERVER SHUTDOWN]')
+    log(f'[CHANNEL] {channel.stats}')
+    for codec in compress.codecs():
+        log(f'[COMPRESS] {codec.spec}: {codec.stats}')
+    log(f'[WRITES] {write_report()}')
+    if history is not None:
+        history.flush()
+    #Only this process's clients are told (every worker shuts down on its own)
+    broadcast_raw(notices.NoticeFrames(notices.SHUTDOWN))
+    closing = [s.queue for s in sessions.clear()]
+    #Each writer sends what is still queued (the shutdown notice) and then closes its socket
+    for q in closing:
+        q.close()
+    for q in closing:
+        q.join(timeout=1.0)
     try:
         server_socket.close()
     except:
@@ -68,57 +150,82 @@ def stop_server():
     server_running = False
 
 
-#This function sends a string message over a TCP socket safely.
-def safe_send(conn, text):
-    try:
-        conn.send(text.encode())
-    except Exception:
-        raise
-
-
-#This function sends a message to all connected clients, except optionally the sender.
-def broadcast_raw(encoded_text, sender_socket=None):
-    with lock:
-        for client in clients[:]:
-            if client != sender_socket:
-                try:
-                    safe_send(client, encoded_text)
-
-                except Exception:
-                    try:
-                        client.close()
-                    except:
-                        pass
-                    try:
-                        clients.remove(client)
-                        if client in names:
-                            del names[client]
-                    except ValueError:
-                        pass
+#This function removes a client and closes its connection (its writer thread closes the socket).
+def drop_client(client, flush=False):
+    common.drop_client(sessions, client, flush)
+
+
+#This function sends a message to all connected clients (or the members of `in_rooms`), except
+#optionally the sender. `message` is text, payload bytes, or a FrameCache. The message is serialized to bytes once and
+#framed once per CRC model; the same bytes object is queued for every client on that model.
+#Recipients come from the registry's copy-on-write snapshot, so no lock is taken here, and queuing
+#never blocks: it returns the queues that are over their limit, which the sender should wait on
+#(wait_for_space) when the policy is backpressure, after letting go of any shared lock.
+def broadcast_raw(message, sender_socket=None, in_rooms=None):
+    start = time.perf_counter()
+    frames = message if isinstance(message, FrameCache) else FrameCache(message)
+    congested = []
+    for session in sessions.recipients(in_rooms):
+        if session.conn is sender_socket:
+            continue
+        if session.arq_out is not None:
+            session.arq_out.send(frames)
+            sent = session.conn in sessions
+        else:
+            sent = common.deliver(sessions, session, frames[session.model])
+        if sent and session.queue.full():
+            congested.append((session.conn, session.queue))
+    metrics.broadcasts.inc()
+    metrics.fanout_seconds.observe(time.perf_counter() - start)
+    return congested
+
+
+#This function applies backpressure: the sender waits until every congested recipient has room.
+def wait_for_space(congested):
+    for client, q in congested:
+        if q.policy == BACKPRESSURE and not q.wait_for_space():
+            drop_client(client)
+
+
+#Notices come from the pre-encoded notice cache. In a worker they go through the bus, so every
+#worker sends them in the same order.
+def broadcast_notice(notice_text, in_rooms=None):
+    if bus is not None:
+        bus.notice(notice_text, in_rooms)
+    else:
+        broadcast_raw(notices.NoticeFrames(notice_text), in_rooms=in_rooms)
 
 
-
-def broadcast_notice(notice_text):
-    encoded = encode_message(notice_text)
-    broadcast_raw(encoded)
+def broadcast_with_retry(message, sender_socket=None):
+    #The trial is simulated with the default model; clients on other models get a clean copy.
+    model = get_model()
+    frames = FrameCache(message)
+    encoded = frames[model]
+
+    #Sends the trial through the simulated channel (by default a 10% chance of one flipped bit),
+    #which also checks if the trial message would be considered valid.
+    trial, ok = channel.transmit(encoded, model)
+    if ok: #valid send to all clients
+        frames[model] = trial
+        broadcast_raw(frames, sender_socket)
+    else: #invalid/corrupted send error message and retransmit original message
+        log(notices.CRC_REBROADCAST)
+        broadcast_notice(notices.CRC_REBROADCAST)
+        broadcast_raw(frames, sender_socket)
 
 
-def broadcast_with_retry(message, sender_socket=None):
-    encoded = encode_message(message)
+#Retransmit timers of every ARQ session, run from one background thread.
+def arq_timers():
+    while server_running:
+        time.sleep(ARQ_TICK)
+        common.poll_arq(sessions, time.monotonic())
 
-    #Simulates a 10% chance of corruption.
-    trial = introduce_error(encoded, error_prob=0.1)
 
-    #Checks if the trial message would be considered valid.
-    _, ok = decode_message(trial)
-    if ok: #valid send to all clients
-        broadcast_raw(trial, sender_socket)
-    else: #invalid/corrupted send error message and retransmit original message
-        notice = "[CRC ERROR]: Error in broadcast. Rebroadcasting..."
-        gui_log(notice) 
-        notice_encoded = encode_message(notice)
-        broadcast_raw(notice_encoded)
-        broadcast_raw(encoded, sender_socket)
+#Pings quiet clients and evicts the ones that stopped answering, from one background thread.
+def keepalive_timers():
+    while server_running:
+        time.sleep(limits.KEEPALIVE_TICK)
+        common.keepalive(sessions, LIMITS, log, time.monotonic())
 
 
 def accept_clients():
@@ -128,133 +235,321 @@ def accept_clients():
             client, addr = server_socket.accept()
         except Exception:
             break
-        with lock:
-            clients.append(client)
-        gui_log(f'[CONNECTED] {addr}')
-        threading.Thread(target=handle_client, args=(client,), daemon=True).start()
+        #Admission control: over --max-clients the connection is told the server is full and closed
+        if not LIMITS.admit(len(sessions)):
+            metrics.rejected.inc()
+            log(f'[REJECTED] {addr}: server is full.')
+            try:
+                client.sendall(notices.notice_frame(notices.SERVER_FULL, HANDSHAKE_MODEL))
+            except OSError:
+                pass
+            client.close()
+            continue
+        #Every client gets its own bounded outbound queue and writer thread
+        session = Session(client, addr)
+        session.queue = OutboundQueue(client, QUEUE_SIZE, QUEUE_POLICY, on_error=lambda c=client: drop_client(c),
+                                      coalesce=COALESCE)
+        sessions.add(session)
+        metrics.connections.inc()
+        log(f'[CONNECTED] {addr}')
+        threading.Thread(target=handle_client, args=(session,), name=f'client {addr[0]}:{addr[1]}', daemon=True).start()
 
 
 #This function handles communication with a client.
-def handle_client(client):
+def handle_client(session):
+    client = session.conn
+    #Frames are parsed out of one reusable buffer, so a recv may hold several messages or part of one
+    reader = FrameReader(HANDSHAKE_MODEL)
+    frames = reader.iter_socket(client)
     try:
-        raw = client.recv(4096).decode()
-        name, ok = decode_message(raw)
-
-        if not ok or name is None:
-            try:
-                client.send(encode_message("Invalid name CRC. Disconnecting.").encode())
-            except:
-                pass
-            try:
-                client.close()
-            except:
-                pass
-            with lock:
-                if client in clients:
-                    clients.remove(client)
+        #The first frame is the name, followed by the CRC models the client offers, e.g. "Alice\ncrc=crc-32,crc-3"
+        #A connection has --handshake-timeout seconds to send it
+        client.settimeout(LIMITS.handshake_timeout)
+        hello = next(frames, None)
+        client.settimeout(None)
+        if hello is None or hello.type != HELLO or not hello.ok:
+            common.send(sessions, session, notices.notice_frame(notices.INVALID_NAME, HANDSHAKE_MODEL))
+            drop_client(client, flush=True)
             return
 
-        #Add the client to the names dictionary
-        with lock:
-            names[client] = name
-        #Log the new connection in the GUI and broadcast to all clients
-        gui_log(f'[NEW CONNECTION] Client {name} connected.')
-        broadcast_notice(f'Client {name} has joined the chat!')
-
-        while True:
-            incoming = client.recv(4096).decode()
-            if not incoming:
-                break
-
-            #decode the incoming client message to check for crc validity
-            msg, ok = decode_message(incoming)
-
-            #CORRUPTED/INVALID:
-            if not ok:
-                #Display the CRC error in the server GUI.
-                gui_log(f'[CRC ERROR]: Dropped corrupted message from {name}.')
-                try:
-                    #Display in the client GUI that their message was not delivered.
-                    client.send(encode_message("[CRC ERROR]: Your message was corrupted and was not delivered.").encode())
-                except:
-                    pass
-                #Does not broadcast this message.
+        #The server answers with what it agreed to; every later frame uses the model it picked
+        agreement = common.negotiate(hello, ARQ_WINDOW, FEC_CODECS, COMPRESS_CODECS, COMPRESS_MIN, history)
+        name, wanted = agreement.name, agreement.wanted
+        common.send(sessions, session, pack_text(WELCOME, pack_options(agreement.accepted), HANDSHAKE_MODEL))
+        reader.model = agreement.model
+        common.start_session(sessions, session, agreement, LIMITS)
+
+        #Add the client to the broadcast recipients (only now, so the WELCOME and history come first)
+        replay = None
+        if agreement.wants_history:
+            replay = partial(common.send_history, sessions, session, agreement.options, history, HISTORY_MAX, log)
+        if bus is not None:
+            #Worker: the join takes effect when the bus hands it back, at the same point on every worker
+            bus.join(session, replay, wanted)
+        else:
+            with history_lock:
+                if replay is not None:
+                    replay()
+                if not sessions.join(session):
+                    return
+                for room in wanted:
+                    sessions.enter(session, room)
+                session.room = wanted[0]
+            #Broadcast to the clients in its rooms
+            broadcast_notice(notices.joined(name), wanted)
+        #Log the new connection in the GUI
+        log(f'[NEW CONNECTION] Client {name} connected.')
+        #"name: " is encoded once; each chat line is this prefix plus the payload bytes as received
+        prefix = f'{name}: '.encode()
+
+        for frame in frames:
+            for payload in common.received(sessions, session, frame, log):
+                #To handle the [bye] exit message (compared straight in the receive buffer)
+                if payload == b'[bye]':
+                    break
+                room = common.chat_room(sessions, session, payload, LIMITS, log, broadcast_raw, bus)
+                if room is None:
+                    continue
+                line = rooms.label(room) + prefix + payload
+                #Broadcasts it to the other clients in the room (on every worker, when sharded)
+                if bus is not None:
+                    bus.chat(session, room, line)
+                elif history is not None and room == rooms.DEFAULT:
+                    with history_lock:
+                        history.append(line)
+                        congested = broadcast_raw(line, sender_socket=client, in_rooms=(room,))
+                    #Stop reading from this client while a recipient's queue is full (backpressure
+                    #policy), without holding up joins and other senders
+                    wait_for_space(congested)
+                else:
+                    wait_for_space(broadcast_raw(line, sender_socket=client, in_rooms=(room,)))
+            else:
                 continue
-            
-            #To handle the [bye] exit message
-            if msg == '[bye]':
-                gui_log(f'[DISCONNECTED] {name}')
-                broadcast_notice(f'Client {name} has left the chat.')
-                break
-
-            #NOT CORRUPTED/VALID: Logs the message in the server GUI in the format
-            gui_log(f'{name} > {msg}')
-            #Broadcasts it to all other clients using
-            broadcast_raw(encode_message(f'{name}: {msg}'), sender_socket=client)
+            log(f'[DISCONNECTED] {name}')
+            broadcast_notice(notices.left(name), tuple(session.rooms))
+            break
 
+    except socket.timeout:
+        #Only the handshake has a timeout
+        metrics.handshake_timeouts.inc()
+        log(f'[HANDSHAKE TIMEOUT] {session.addr}')
+        common.send(sessions, session, notices.notice_frame(notices.HANDSHAKE_TIMEOUT, HANDSHAKE_MODEL))
+        drop_client(client, flush=True)
+    except FramingError as e:
+        log(f'[PROTOCOL ERROR] {e}')
     except Exception as e:
         pass
     finally: #cleanup if connection crash or client disconnects
+        drop_client(client)
+        if bus is not None:
+            bus.forget(session)
+        if session.arq_out is not None:
+            log(f'[ARQ] {session.name}: {session.arq_out.stats}')
+        if session.model is not None and session.model.fec is not None:
+            log(f'[FEC] {session.name}: {session.model.fec.spec}, corrected {session.corrected}')
+
+
+#Function to profile the running server for `seconds` (default PROFILE_SECONDS); either engine.
+def start_profile(seconds=None):
+    global profiler
+    if profiler is None:
+        profiler = profiling.Profiler(PROFILE_DIR, log, prefix=PROFILE_PREFIX)
+    return profiler.start(seconds or PROFILE_SECONDS)
+
+
+#Function to get the module implementing an engine (start_server, stop_server, broadcast_with_retry).
+def engine(name=None):
+    if (name or ENGINE) == 'asyncio':
+        import aserver
+        aserver.log_sink = log_sink
+        aserver.QUEUE_SIZE, aserver.QUEUE_POLICY, aserver.COALESCE = QUEUE_SIZE, QUEUE_POLICY, COALESCE
+        aserver.ARQ_WINDOW, aserver.FEC_CODECS = ARQ_WINDOW, FEC_CODECS
+        aserver.COMPRESS_CODECS, aserver.COMPRESS_MIN = COMPRESS_CODECS, COMPRESS_MIN
+        aserver.channel = channel
+        aserver.REUSE_PORT = REUSE_PORT
+        aserver.history, aserver.HISTORY_MAX = history, HISTORY_MAX
+        aserver.LIMITS = LIMITS
+        return aserver
+    return sys.modules[__name__]
+
+
+def parse_args(argv=None):
+    import argparse  # only the command line needs it, not an importer of this module
+    parser = argparse.ArgumentParser(description='CRC chat server')
+    parser.add_argument('--host', default=None, help='address to listen on (default: this host\'s IP)')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--engine', choices=('thread', 'asyncio'), default=ENGINE)
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help='outbound frames queued per client')
+    parser.add_argument('--queue-policy', choices=POLICIES, default=QUEUE_POLICY, help='what to do when a queue is full')
+    parser.add_argument('--coalesce', type=float, default=COALESCE.delay * 1e3, metavar='MS',
+                        help='hold frames up to MS milliseconds to send a burst in one write (0: send at once)')
+    parser.add_argument('--coalesce-idle', type=float, default=COALESCE_IDLE * 1e3, metavar='MS',
+                        help='with --coalesce, send as soon as no new frame came in for MS milliseconds')
+    parser.add_argument('--coalesce-frames', type=int, default=COALESCE.frames,
+                        help='most frames sent in one write')
+    parser.add_argument('--arq-window', type=int, default=ARQ_WINDOW,
+                        help='largest reliable-delivery window granted to clients (0 disables ARQ)')
+    parser.add_argument('--fec', default=','.join(FEC_CODECS),
+                        help='FEC codecs clients may negotiate: comma-separated from hamming,rs, or off')
+    parser.add_argument('--compress', default=','.join(COMPRESS_CODECS),
+                        help='compression clients may negotiate: comma-separated from zlib,zlib-dict, or off')
+    parser.add_argument('--compress-min', type=int, default=COMPRESS_MIN,
+                        help='smallest payload (bytes) that is compressed')
+    parser.add_argument('--channel', default=CHANNEL,
+                        help='simulated errors on server broadcasts: none, flips:K@P, ber:R or ge:PGB,PBG[,RG,RB]')
+    parser.add_argument('--channel-seed', type=int, default=None, help='seed for the simulated channel')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='worker processes sharing the port with SO_REUSEPORT (see cluster.py)')
+    parser.add_argument('--bus', choices=('shm', 'socket'), default=BUS,
+                        help='how events reach the workers: shared-memory ring or socketpairs')
+    parser.add_argument('--bus-slots', type=int, default=BUS_SLOTS, help='entries in the shared-memory ring')
+    parser.add_argument('--bus-slot-size', type=int, default=BUS_SLOT_SIZE,
+                        help='bytes per ring slot (bigger frames go over the socket)')
+    parser.add_argument('--history', default=None, metavar='DIR',
+                        help='keep a chat log in DIR and replay it to clients that ask (see chatlog.py)')
+    parser.add_argument('--max-clients', type=int, default=limits.MAX_CLIENTS,
+                        help='connections at a time, per worker (0: no limit)')
+    parser.add_argument('--msg-rate', type=float, default=limits.MSG_RATE,
+                        help='chat lines per second per client; more are dropped (0: no limit)')
+    parser.add_argument('--msg-burst', type=int, default=limits.MSG_BURST, help='lines a client may send at once')
+    parser.add_argument('--byte-rate', type=float, default=limits.BYTE_RATE,
+                        help='chat bytes per second per client (0: no limit)')
+    parser.add_argument('--byte-burst', type=int, default=limits.BYTE_BURST, help='bytes a client may send at once')
+    parser.add_argument('--handshake-timeout', type=float, default=limits.HANDSHAKE_TIMEOUT,
+                        help='seconds a new connection has to send its name (0: no limit)')
+    parser.add_argument('--keepalive', type=float, default=limits.KEEPALIVE,
+                        help='ping clients quiet for this many seconds (0: never)')
+    parser.add_argument('--idle-timeout', type=float, default=limits.IDLE_TIMEOUT,
+                        help='evict clients quiet for this many seconds, pongs included (0: never)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve Prometheus metrics on 127.0.0.1:PORT/metrics (see metrics.py)')
+    parser.add_argument('--metrics-interval', type=float, default=0,
+                        help='log a metrics snapshot every this many seconds (0: never)')
+    parser.add_argument('--profile-dir', default=PROFILE_DIR,
+                        help='where profiling reports go (profile with SIGUSR1 or "[profile N]" in the window)')
+    parser.add_argument('--profile-seconds', type=float, default=PROFILE_SECONDS, help='length of a profiling window')
+    parser.add_argument('--log', default='stdout', help='log sink: stdout, null, ring[:N] or file:PATH')
+    parser.add_argument('--gui', action='store_true', help='open the Tk window instead of running headless')
+    parser.add_argument('--scrollback', type=int, default=1000, help='lines kept in the Tk window (with --gui)')
+    return parser.parse_args(argv)
+
+
+#Function to apply command-line settings to the engines.
+def configure(args):
+    global ENGINE, QUEUE_SIZE, QUEUE_POLICY, COALESCE, ARQ_WINDOW, FEC_CODECS, COMPRESS_CODECS, COMPRESS_MIN, WORKERS
+    global channel, history, log_sink, PROFILE_DIR, PROFILE_SECONDS, LIMITS
+    ENGINE = args.engine
+    QUEUE_SIZE = args.queue_size
+    QUEUE_POLICY = args.queue_policy
+    COALESCE = Coalescing(args.coalesce / 1e3, args.coalesce_idle / 1e3, args.coalesce_frames)
+    ARQ_WINDOW = args.arq_window
+    FEC_CODECS = () if args.fec == 'off' else tuple(name.strip() for name in args.fec.split(',') if name.strip())
+    for name in FEC_CODECS:
+        if name not in fec.CODECS:
+            raise ValueError(f'Unknown FEC codec: {name} (expected {", ".join(fec.CODECS)} or off)')
+    COMPRESS_CODECS = () if args.compress == 'off' else tuple(
+        name.strip() for name in args.compress.split(',') if name.strip())
+    for name in COMPRESS_CODECS:
+        if name not in compress.CODECS:
+            raise ValueError(f'Unknown compression codec: {name} (expected {", ".join(compress.CODECS)} or off)')
+    COMPRESS_MIN = args.compress_min
+    channel = make_channel(args.channel, args.channel_seed)
+    PROFILE_DIR, PROFILE_SECONDS = args.profile_dir, args.profile_seconds
+    LIMITS = limits.Limits(args.max_clients, args.msg_rate, args.msg_burst, args.byte_rate, args.byte_burst,
+                           args.handshake_timeout, args.keepalive, args.idle_timeout)
+    if LIMITS.idle_timeout and LIMITS.keepalive and LIMITS.idle_timeout <= LIMITS.keepalive:
+        raise ValueError('--idle-timeout must be longer than --keepalive, or clients are evicted before a ping')
+    WORKERS = args.workers
+    if WORKERS > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        raise ValueError('--workers needs SO_REUSEPORT, which this platform does not have')
+    if WORKERS > 1 and args.gui:
+        raise ValueError('--workers runs headless and cannot be combined with --gui')
+    log_sink = make_sink(args.log)
+    #With --workers the supervisor writes the log (cluster.py) and the workers only read it
+    if args.history and WORKERS == 1 and history is None:
+        history = chatlog.ChatLog(args.history)
+        if history.recovered_bad:
+            log(f'[HISTORY] {history.recovered_bad} damaged records in {args.history}')
+
+
+#Headless entry point: python -m server [--host H] [--port P] [--engine thread|asyncio] ...
+def main(argv=None):
+    args = parse_args(argv)
+    if args.gui:
+        import server_gui
+        return server_gui.main(args)
+    configure(args)
+    if WORKERS > 1:
+        import cluster
+        return cluster.run(args)
+    return serve(args)
+
+
+#Function to run the configured engine in this process until Ctrl+C or SIGTERM.
+def serve(args):
+    return run_engine(args, _serve)
+
+
+#Function to run `body(args, selected engine)` between the startup and shutdown steps shared by
+#the headless server and the Tk window (server_gui.py): the metrics exporters and the SIGUSR1
+#profiling trigger before, closing them and the history log after.
+def run_engine(args, body):
+    selected = engine()
+    exporters = start_metrics(args, selected)
+    #kill -USR1 <pid> profiles the server for --profile-seconds
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: start_profile())
+    try:
+        return body(args, selected)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+        _close_history()
+
+
+#Function to start the metrics endpoint and/or periodic snapshot the command line asks for.
+def start_metrics(args, selected):
+    metrics.watch(selected.sessions)
+    exporters = []
+    if args.metrics_port is not None:
+        metrics.instrument_crc()
         try:
-            with lock:
-                if client in clients:
-                    clients.remove(client)
-                if client in names:
-                    del names[client]
-        except:
-            pass
-        try:
-            client.close()
-        except:
-            pass
-
-
-# tkinter gui
-root = tk.Tk()
-root.title('Server Chat')
-
-txt = scrolledtext.ScrolledText(root, state='disabled', width=60, height=20)
-txt.grid(row=0, column=0, columnspan=4, padx=8, pady=8)
+            exporter = metrics.MetricsServer(args.metrics_port)
+        except OSError as e:
+            log(f'[METRICS] cannot serve on port {args.metrics_port}: {e}')
+        else:
+            log(f'[METRICS] http://{exporter.address[0]}:{exporter.address[1]}/metrics')
+            exporters.append(exporter)
+    if args.metrics_interval > 0:
+        metrics.instrument_crc()
+        exporters.append(metrics.Snapshotter(args.metrics_interval, log))
+    return exporters
+
+
+def _serve(args, selected):
+    if selected is not sys.modules[__name__]:
+        selected.run(args.host, args.port)
+        return
 
-def gui_log(message):
-    txt.configure(state='normal')
-    txt.insert(tk.END, message + '\n')
-    txt.see(tk.END)
-    txt.configure(state='disabled')
+    #Thread engine: serve until Ctrl+C or SIGTERM
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    start_server(args.port, args.host)
+    if not server_running:
+        return 1
+    try:
+        while not stopped.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    stop_server()
 
-entry_msg = tk.Entry(root, width=50)
-entry_msg.grid(row=1, column=0, padx=8, pady=4)
 
-def send_server_message():
-    msg = entry_msg.get().strip()
-    if not msg:
-        return
-    # o handle the [bye] as a shutdown request
-    if msg == '[bye]':
-        gui_log('[SERVER SHUTDOWN] (requested)')
-        stop_server()
-        entry_msg.delete(0, tk.END)
-        return
-    
-    gui_log(f'Server > {msg}')
-    # Messages typed from the server uses broadcast_with_retry to simulate possible corruption:
-    # The initial broadcast is simulated (10% chance error). If corrupted, send error message and rebroadcast.
-    broadcast_with_retry(f'Server: {msg}')
-    entry_msg.delete(0, tk.END)
-
-btn_send = tk.Button(root, text='Send', width=10, command=send_server_message)
-btn_send.grid(row=1, column=1, padx=4)
-btn_stop = tk.Button(root, text='Stop Server', width=12, command=stop_server)
-btn_stop.grid(row=1, column=2, padx=4)
-btn_start = tk.Button(root, text='Start Server', width=12, command=lambda: start_server(PORT))
-btn_start.grid(row=1, column=3, padx=4)
-
-def on_closing():
-    stop_server()
-    root.destroy()
+def _close_history():
+    if history is not None:
+        log(f'[HISTORY] {history}')
+        history.close()
 
-root.protocol('WM_DELETE_WINDOW', on_closing)
 
 if __name__ == '__main__':
-    start_server(PORT)
-    root.mainloop()
+    sys.exit(main())
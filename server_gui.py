@@ -0,0 +1,98 @@
+import sys
+import tkinter as tk
+from tkinter import scrolledtext
+import server
+from guilog import LogPipeline
+
+# Tk front end for the server. All networking lives in server.py / aserver.py;
+# this window only starts and stops the selected engine and shows its log.
+# Run with: python server_gui.py [server options]   or   python -m server --gui
+
+root = None
+txt = None
+entry_msg = None
+log_pipeline = None
+# how often queued log lines are flushed into the window, and how many lines it keeps
+LOG_FLUSH_MS = 50
+SCROLLBACK_LINES = 1000
+
+
+#Log lines from any thread are queued and written to the window in batches
+def gui_log(message):
+    log_pipeline(message)
+
+
+def send_server_message():
+    msg = entry_msg.get().strip()
+    if not msg:
+        return
+    # o handle the [bye] as a shutdown request
+    if msg == '[bye]':
+        gui_log('[SERVER SHUTDOWN] (requested)')
+        server.engine().stop_server()
+        entry_msg.delete(0, tk.END)
+        return
+    # [profile] or [profile SECONDS] profiles the running server (see profiling.py)
+    if msg.startswith('[profile') and msg.endswith(']'):
+        try:
+            seconds = float(msg[len('[profile'):-1] or 0)
+        except ValueError:
+            gui_log('Usage: [profile] or [profile SECONDS]')
+        else:
+            server.start_profile(seconds)
+        entry_msg.delete(0, tk.END)
+        return
+
+    gui_log(f'Server > {msg}')
+    # Messages typed from the server uses broadcast_with_retry to simulate possible corruption:
+    # The initial broadcast is simulated (10% chance error). If corrupted, send error message and rebroadcast.
+    server.engine().broadcast_with_retry(f'Server: {msg}')
+    entry_msg.delete(0, tk.END)
+
+
+def build_gui(host=None, port=server.PORT, scrollback=SCROLLBACK_LINES):
+    global root, txt, entry_msg, log_pipeline
+    root = tk.Tk()
+    root.title('Server Chat')
+
+    txt = scrolledtext.ScrolledText(root, state='disabled', width=60, height=20)
+    txt.grid(row=0, column=0, columnspan=4, padx=8, pady=8)
+    log_pipeline = LogPipeline(root, txt, LOG_FLUSH_MS, scrollback)
+
+    entry_msg = tk.Entry(root, width=50)
+    entry_msg.grid(row=1, column=0, padx=8, pady=4)
+
+    btn_send = tk.Button(root, text='Send', width=10, command=send_server_message)
+    btn_send.grid(row=1, column=1, padx=4)
+    btn_stop = tk.Button(root, text='Stop Server', width=12, command=lambda: server.engine().stop_server())
+    btn_stop.grid(row=1, column=2, padx=4)
+    btn_start = tk.Button(root, text='Start Server', width=12, command=lambda: server.engine().start_server(port, host))
+    btn_start.grid(row=1, column=3, padx=4)
+
+    def on_closing():
+        server.engine().stop_server()
+        log_pipeline.stop()
+        root.destroy()
+
+    root.protocol('WM_DELETE_WINDOW', on_closing)
+    # the engines log into the window through the pipeline
+    server.log_sink = log_pipeline
+    return root
+
+
+def main(args=None):
+    if args is None:
+        args = server.parse_args()
+    server.configure(args)
+    build_gui(args.host, args.port, args.scrollback)
+    #Same metrics, profiling and history shutdown as the headless server
+    return server.run_engine(args, _run_window)
+
+
+def _run_window(args, selected):
+    selected.start_server(args.port, args.host)
+    root.mainloop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import itertools
+import threading
+import time
+
+# Connection registry shared by both engines. Each connection has one Session object;
+# the registry maps its socket (or StreamWriter) to it, so lookup and removal are O(1).
+# Broadcasts read an immutable tuple of the joined sessions that is rebuilt only when
+# someone joins or leaves (copy-on-write), so they never take the lock. Rooms work the same way:
+# a room -> members tuple per room (rooms.py), rebuilt only when that room's membership changes,
+# and each session's frozenset of rooms, so a room change never looks at the other clients.
+
+_ids = itertools.count(1)
+
+
+#Per-connection state. `conn` is the socket (thread engine) or StreamWriter (asyncio engine).
+class Session:
+    __slots__ = ('id', 'conn', 'addr', 'name', 'model', 'queue', 'arq_out', 'arq_in', 'joined', 'connected_at', 'received',
+                 'crc_errors', 'corrected', 'last_seen', 'last_ping', 'msg_bucket', 'byte_bucket', 'limited',
+                 'rooms', 'room')
+
+    def __init__(self, conn, addr=None):
+        self.id = next(_ids)  # unique in this process; names a client on the worker bus (cluster.py)
+        self.conn = conn
+        self.addr = addr
+        self.name = None
+        self.model = None   # CRC model negotiated in the handshake (with its FEC codec, if any)
+        self.queue = None   # OutboundQueue / AsyncOutboundQueue feeding this client's writer
+        self.arq_out = None  # ArqSender / ArqReceiver when the client negotiated reliable delivery (arq.py)
+        self.arq_in = None
+        self.joined = False
+        self.connected_at = time.monotonic()
+        self.received = 0   # chat frames received from the client
+        self.crc_errors = 0
+        self.corrected = 0  # bits/bytes fixed by FEC in frames from the client
+        self.last_seen = self.connected_at  # last frame from the client (keepalive, see limits.py)
+        self.last_ping = self.connected_at
+        self.msg_bucket = None  # limits.TokenBucket per client for chat lines and bytes, if limited
+        self.byte_bucket = None
+        self.limited = False    # the client was told it hit a rate limit (and nothing got through since)
+        self.rooms = frozenset()  # rooms it is a member of (see rooms.py)
+        self.room = None          # the room its chat lines go to
+
+    def __repr__(self):
+        return f'Session({self.name!r}, {self.addr})'
+
+
+class SessionRegistry:
+    def __init__(self):
+        self._sessions = {}  # map conn -> Session, every open connection
+        self._joined = ()    # snapshot of the sessions that completed the handshake
+        self._rooms = {}     # room name -> tuple of its members (joined sessions)
+        self._lock = threading.Lock()  # only writers take it
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, conn):
+        return conn in self._sessions
+
+    def get(self, conn):
+        return self._sessions.get(conn)
+
+    #Function to register a new connection (not yet a broadcast recipient).
+    def add(self, session):
+        with self._lock:
+            self._sessions[session.conn] = session
+        return session
+
+    #Function to make a session a broadcast recipient once its handshake is done.
+    def join(self, session):
+        with self._lock:
+            if self._sessions.get(session.conn) is not session or session.joined:
+                return False
+            session.joined = True
+            self._joined = self._joined + (session,)
+            return True
+
+    #Function to remove a connection. Returns its Session, or None if it was already gone.
+    def remove(self, conn):
+        with self._lock:
+            session = self._sessions.pop(conn, None)
+            if session is not None and session.joined:
+                self._joined = tuple(s for s in self._joined if s is not session)
+                for room in session.rooms:
+                    self._drop_member(room, session)
+            return session
+
+    #Function to add a joined session to a room. Returns False if it is gone or already a member.
+    def enter(self, session, room):
+        with self._lock:
+            if self._sessions.get(session.conn) is not session or not session.joined or room in session.rooms:
+                return False
+            session.rooms = session.rooms | {room}
+            self._rooms[room] = self._rooms.get(room, ()) + (session,)
+            return True
+
+    #Function to take a session out of a room. Returns False if it was not a member.
+    def leave(self, session, room):
+        with self._lock:
+            if room not in session.rooms:
+                return False
+            session.rooms = session.rooms - {room}
+            if self._sessions.get(session.conn) is session:
+                self._drop_member(room, session)
+            return True
+
+    def _drop_member(self, room, session):
+        members = tuple(s for s in self._rooms.get(room, ()) if s is not session)
+        if members:
+            self._rooms[room] = members
+        else:
+            self._rooms.pop(room, None)
+
+    #Function to remove every connection (shutdown). Returns the removed sessions.
+    def clear(self):
+        with self._lock:
+            removed = list(self._sessions.values())
+            self._sessions.clear()
+            self._joined = ()
+            self._rooms = {}
+            return removed
+
+    #The joined sessions at this moment; the tuple never changes, so it is safe to iterate without the lock.
+    def snapshot(self):
+        return self._joined
+
+    #The members of `rooms` (None: every joined session), each once; safe to iterate without the lock.
+    def recipients(self, rooms=None):
+        if rooms is None:
+            return self._joined
+        if len(rooms) == 1:
+            for room in rooms:
+                return self._rooms.get(room, ())
+        members = {}
+        for room in rooms:
+            for session in self._rooms.get(room, ()):
+                members[session.id] = session
+        return tuple(members.values())
+
+    def room_count(self):
+        return len(self._rooms)
+
+    def names(self):
+        return [s.name for s in self._joined]
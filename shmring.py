@@ -0,0 +1,130 @@
+import struct
+from multiprocessing import shared_memory
+
+# Ring buffer in shared memory: one writer, any number of readers (other processes or threads),
+# fixed-size slots. Entry n goes to slot n % slots and is written once; every reader reads it in
+# place through a memoryview, so fan-out to R readers costs one copy in, not R sends.
+# Readers keep their own next sequence number. The writer never waits for them: a reader that
+# falls more than `slots` entries behind finds its entries overwritten, skips to the oldest one
+# still there and counts the rest as lost (overflow).
+# Each slot starts with a stamp (sequence number + 1) that the writer zeroes before copying the
+# data in and sets after, so a reader can tell a complete entry from one being overwritten, and
+# check again after using an entry that it was not overwritten meanwhile.
+# Layout: header | one wakeup flag per reader | slots. The flag lets an idle reader ask the writer
+# for a doorbell (see cluster.py) instead of polling.
+
+HEADER = struct.Struct('<4sIIIQ')  # magic, slots, slot size, readers, entries written (head)
+HEAD_OFFSET = 16
+FLAG = struct.Struct('<I')         # per reader: 1 while it waits for a doorbell
+FLAG_STRIDE = 8
+SLOT = struct.Struct('<QII')       # stamp, data length, entry flags
+MAGIC = b'RNG1'
+
+# entry flags
+EXTERNAL = 0x01  # placeholder: the entry was too big for a slot and went another way
+
+
+class SharedRing:
+    #Creates a new ring, or attaches to an existing one when `name` is given (the layout comes from its header).
+    def __init__(self, slots=1024, slot_size=4096, readers=1, name=None):
+        if name is None:
+            if slots < 2 or slot_size <= SLOT.size:
+                raise ValueError(f'ring needs at least 2 slots of more than {SLOT.size} bytes')
+            size = HEADER.size + readers * FLAG_STRIDE + slots * slot_size
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, slots, slot_size, readers, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            magic, slots, slot_size, readers, _ = HEADER.unpack_from(self.shm.buf)
+            if magic != MAGIC:
+                raise ValueError(f'{name} is not a shared ring')
+        self.name = self.shm.name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.readers = readers
+        self.capacity = slot_size - SLOT.size  # largest entry
+        self.buf = self.shm.buf
+        self._base = HEADER.size + readers * FLAG_STRIDE
+
+    @property
+    def head(self):
+        return struct.unpack_from('<Q', self.buf, HEAD_OFFSET)[0]
+
+    def _slot(self, seq):
+        return self._base + (seq % self.slots) * self.slot_size
+
+    #Function to append an entry (writer only). Returns its sequence number.
+    def write(self, data, flags=0):
+        if len(data) > self.capacity:
+            raise ValueError(f'entry of {len(data)} bytes does not fit a {self.capacity}-byte slot')
+        seq = self.head
+        offset = self._slot(seq)
+        SLOT.pack_into(self.buf, offset, 0, 0, 0)
+        self.buf[offset + SLOT.size:offset + SLOT.size + len(data)] = data
+        SLOT.pack_into(self.buf, offset, seq + 1, len(data), flags)
+        struct.pack_into('<Q', self.buf, HEAD_OFFSET, seq + 1)
+        return seq
+
+    #Function for the writer: whether reader `index` is waiting for a doorbell (the flag is cleared).
+    def wants_wakeup(self, index):
+        offset = HEADER.size + index * FLAG_STRIDE
+        if FLAG.unpack_from(self.buf, offset)[0]:
+            FLAG.pack_into(self.buf, offset, 0)
+            return True
+        return False
+
+    def reader(self, index=0, start=None):
+        return RingReader(self, index, start)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class RingReader:
+    def __init__(self, ring, index=0, start=None):
+        self.ring = ring
+        self.index = index
+        self.next = ring.head if start is None else start
+        self.lost = 0  # entries overwritten before this reader got to them
+
+    #Function to get the next entry as (seq, flags, memoryview of its data), or None when caught up.
+    #The view points into the ring: use it (or copy it) and then call check(seq).
+    def read(self):
+        ring = self.ring
+        while self.next < ring.head:
+            offset = ring._slot(self.next)
+            stamp, length, flags = SLOT.unpack_from(ring.buf, offset)
+            if stamp != self.next + 1:
+                self._skip()  # lapped by the writer
+                continue
+            seq = self.next
+            self.next += 1
+            return seq, flags, ring.buf[offset + SLOT.size:offset + SLOT.size + length]
+        return None
+
+    #Function to confirm that entry `seq` was not overwritten while it was being used.
+    #If it was, it is counted as lost and the reader moves on to the oldest entry left.
+    def check(self, seq):
+        if SLOT.unpack_from(self.ring.buf, self.ring._slot(seq))[0] == seq + 1:
+            return True
+        self.lost += 1
+        self._skip()
+        return False
+
+    def _skip(self):
+        # one slot short of a full lap: the writer may be in the middle of the oldest one
+        oldest = self.ring.head - self.ring.slots + 1
+        if oldest > self.next:
+            self.lost += oldest - self.next
+            self.next = oldest
+
+    #Function to tell the writer whether this reader is about to block waiting for a doorbell.
+    def waiting(self, flag=True):
+        FLAG.pack_into(self.ring.buf, HEADER.size + self.index * FLAG_STRIDE, int(flag))
+
+    def __len__(self):
+        return self.ring.head - self.next
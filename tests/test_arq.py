@@ -0,0 +1,148 @@
+import random
+import pytest
+import arq
+import framing
+from crc import get_model
+
+# Selective-repeat ARQ over a simulated link that loses, reorders and corrupts frames in both
+# directions. The classes are sans-IO, so the link is a list, and arq's clock is a fake one that
+# the tests advance.
+
+MODEL = get_model('crc-32')
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(arq, 'time', fake)
+    return fake
+
+
+def unpack(frame):
+    return framing.unpack_frame(frame, MODEL)
+
+
+def corrupt(frame):
+    frame = bytearray(frame)
+    frame[framing.HEADER_SIZE] ^= 0x04  # first payload byte: the header stays intact
+    return bytes(frame)
+
+
+#Function to push `messages` through sender -> receiver until everything is delivered or the
+#simulated clock runs out. Returns (payloads delivered in order, sender, receiver).
+def run_link(clock, messages, loss=0.0, reorder=0.0, corruption=0.0, ack_loss=0.0, window=8, seed=1, seconds=120):
+    rng = random.Random(seed)
+    wire = []
+    sender = arq.ArqSender(wire.append, MODEL, window, max_retries=50)
+    receiver = arq.ArqReceiver(MODEL, window)
+    delivered = []
+    for message in messages:
+        sender.send(message)
+    while (len(sender) or sender.backlog) and clock.now < seconds:
+        frames, wire[:] = list(wire), []
+        if rng.random() < reorder:
+            rng.shuffle(frames)
+        for frame in frames:
+            if rng.random() < loss:
+                continue
+            if rng.random() < corruption:
+                frame = corrupt(frame)
+            payloads, replies = receiver.receive(unpack(frame))
+            delivered += payloads
+            for reply in replies:
+                if rng.random() >= ack_loss:
+                    sender.on_control(unpack(reply))
+        clock.now += 0.05
+        sender.poll()
+    return delivered, sender, receiver
+
+
+MESSAGES = [f'message {i}'.encode() for i in range(200)]
+
+
+def test_clean_link_delivers_in_order(clock):
+    delivered, sender, receiver = run_link(clock, MESSAGES)
+    assert delivered == MESSAGES
+    assert sender.stats.retransmits == 0
+    assert sender.stats.max_in_flight <= 8
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_loss_and_reorder(clock, seed):
+    delivered, sender, receiver = run_link(clock, MESSAGES, loss=0.2, reorder=0.5, seed=seed)
+    assert delivered == MESSAGES
+    assert sender.stats.retransmits > 0
+    assert receiver.stats.out_of_order > 0
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_corruption_is_nacked_and_resent(clock, seed):
+    delivered, sender, receiver = run_link(clock, MESSAGES, corruption=0.2, seed=seed)
+    assert delivered == MESSAGES
+    assert receiver.stats.crc_errors > 0
+    assert sender.stats.nacks_received > 0
+
+
+#Each ACK also carries the next number expected, so it covers earlier ACKs that were lost.
+def test_lost_acks(clock):
+    delivered, sender, receiver = run_link(clock, MESSAGES, ack_loss=0.5, seed=3)
+    assert delivered == MESSAGES
+    assert sender.stats.acked == len(MESSAGES)
+
+
+#A frame received again (its ACK was lost) is ACKed again but not delivered twice.
+def test_duplicate_is_acked_not_delivered():
+    wire = []
+    sender = arq.ArqSender(wire.append, MODEL, 4)
+    sender.send(b'once')
+    receiver = arq.ArqReceiver(MODEL, 4)
+    assert receiver.receive(unpack(wire[0]))[0] == [b'once']
+    payloads, replies = receiver.receive(unpack(wire[0]))
+    assert payloads == [] and unpack(replies[0]).type == framing.ACK
+    assert receiver.stats.duplicates == 1
+
+
+def test_out_of_order_frames_are_buffered():
+    wire = []
+    sender = arq.ArqSender(wire.append, MODEL, 4)
+    for message in (b'a', b'b', b'c'):
+        sender.send(message)
+    receiver = arq.ArqReceiver(MODEL, 4)
+    assert receiver.receive(unpack(wire[2]))[0] == []
+    assert receiver.receive(unpack(wire[1]))[0] == []
+    assert receiver.receive(unpack(wire[0]))[0] == [b'a', b'b', b'c']
+
+
+def test_window_holds_back_the_rest():
+    wire = []
+    sender = arq.ArqSender(wire.append, MODEL, 4)
+    for message in MESSAGES[:10]:
+        sender.send(message)
+    assert len(wire) == 4 and len(sender.backlog) == 6
+    receiver = arq.ArqReceiver(MODEL, 4)
+    _, replies = receiver.receive(unpack(wire[0]))
+    sender.on_control(unpack(replies[0]))
+    assert len(wire) == 5
+
+
+def test_gives_up_after_max_retries(clock):
+    gave_up = []
+    sender = arq.ArqSender(lambda frame: None, MODEL, 4, max_retries=2, on_give_up=lambda: gave_up.append(True))
+    sender.send(b'lost')
+    while not gave_up and clock.now < 60:
+        clock.now += 1.0
+        sender.poll()
+    assert gave_up and sender.stats.given_up == 1
+
+
+@pytest.mark.parametrize('offered, expected', [(None, 0), ('x', 0), ('16', 16), ('64', 32), ('-3', 0)])
+def test_negotiate(offered, expected):
+    assert arq.negotiate(offered, 32) == expected
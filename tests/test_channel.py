@@ -0,0 +1,73 @@
+import random
+import pytest
+import crc
+from channel import make_channel
+from framing import HEADER_SIZE
+
+# Simulated channel: a seed reproduces a run exactly, for every error model and for both the
+# per-frame and the batch paths; headers are never touched; the error rates come out as asked.
+
+SPECS = ['flips:1@0.1', 'flips:3@0.5', 'ber:1e-3', 'ge:0.001,0.1', 'ge:0.01,0.2,0.0001,0.3']
+_rng = random.Random(14)
+FRAMES = [bytes(_rng.randrange(256) for _ in range(_rng.randrange(HEADER_SIZE, 300))) for _ in range(300)]
+
+
+def run(spec, seed):
+    channel = make_channel(spec, seed)
+    return [channel.apply(frame) for frame in FRAMES], channel.stats.as_dict()
+
+
+def run_batch(spec, seed, use_numpy):
+    channel = make_channel(spec, seed)
+    buffer, offsets = crc.pack_batch(FRAMES)
+    out, hit = channel.corrupt_batch(buffer, offsets, use_numpy=use_numpy)
+    return bytes(out), hit, channel.stats.as_dict()
+
+
+@pytest.mark.parametrize('spec', SPECS)
+def test_same_seed_same_errors(spec):
+    received, stats = run(spec, 7)
+    assert stats['corrupted'] > 0
+    assert run(spec, 7) == (received, stats)
+    assert run(spec, 8)[0] != received
+
+
+@pytest.mark.parametrize('use_numpy', [False, True])
+@pytest.mark.parametrize('spec', SPECS)
+def test_same_seed_same_batch(spec, use_numpy):
+    first = run_batch(spec, 7, use_numpy)
+    assert first[2]['corrupted'] > 0
+    assert run_batch(spec, 7, use_numpy) == first
+    assert run_batch(spec, 8, use_numpy)[0] != first[0]
+
+
+@pytest.mark.parametrize('spec', SPECS)
+def test_headers_untouched(spec):
+    received, _ = run(spec, 3)
+    assert all(got[:HEADER_SIZE] == sent[:HEADER_SIZE] for got, sent in zip(received, FRAMES))
+
+
+def test_fixed_flips():
+    channel = make_channel('flips:2@1.0', 1)
+    for frame in FRAMES:
+        got = channel.apply(frame)
+        flipped = sum(bin(a ^ b).count('1') for a, b in zip(got, frame))
+        assert flipped == (2 if len(frame) > HEADER_SIZE else 0)
+
+
+def test_bit_error_rate():
+    channel = make_channel('ber:1e-2', 5)
+    buffer, offsets = crc.pack_batch(FRAMES * 10)
+    channel.corrupt_batch(buffer, offsets, skip=0, use_numpy=False)
+    rate = channel.stats.bit_errors / (len(buffer) * 8)
+    assert 0.008 < rate < 0.012
+
+
+def test_no_errors():
+    channel = make_channel('none', 1)
+    assert all(channel.apply(frame) is frame for frame in FRAMES)
+
+
+def test_bad_spec():
+    with pytest.raises(ValueError):
+        make_channel('ber:lots')
@@ -0,0 +1,194 @@
+import os
+import threading
+import pytest
+import chatlog
+from chatlog import ChatLog, LogReader
+from crc import get_model
+
+# Chat log: appends, lookups by sequence number and time, segments, and recovery after a crash.
+
+
+def lines(count, start=0):
+    return [f'user: line {i}'.encode() for i in range(start, start + count)]
+
+
+def open_log(directory, **options):
+    options.setdefault('sync', False)
+    return ChatLog(str(directory), **options)
+
+
+def read_payloads(log, since=None, last=None):
+    first, count, chunks = log.read(since, last)
+    payloads = chatlog.payloads(chunks)
+    assert len(payloads) == count
+    return first, payloads
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = open_log(tmp_path, segment_bytes=2048)
+    yield log
+    log.close()
+
+
+def test_append_numbers_lines(log):
+    assert [log.append(line) for line in lines(5)] == [0, 1, 2, 3, 4]
+    assert log.head() == 5
+
+
+def test_read_last_and_since(log):
+    for line in lines(300):
+        log.append(line)
+    assert read_payloads(log, last=10) == (290, lines(10, 290))
+    assert read_payloads(log, since=123) == (123, lines(177, 123))
+    assert read_payloads(log, since=100, last=5) == (295, lines(5, 295))
+    assert read_payloads(log, since=300) == (300, [])
+    assert read_payloads(log) == (0, lines(300))
+
+
+#Small segments: reads that start anywhere in any segment, including exactly at a segment's start.
+def test_reads_across_segments(log):
+    for line in lines(500):
+        log.append(line)
+    log.flush()
+    assert len(log.segments) > 3
+    for since in sorted(set(log.segments) | {1, 63, 64, 65, 250, 499}):
+        assert read_payloads(log, since=since) == (since, lines(500 - since, since)), since
+
+
+#Every INDEX_INTERVAL-th record of a segment, counted from its first one, has an index entry.
+def test_index_is_sparse(log):
+    for line in lines(200):
+        log.append(line)
+    log.flush()
+    for base in log.segments:
+        seqs = [seq for seq, _, _ in log.index[base]]
+        assert seqs and seqs[0] == base
+        assert all((seq - base) % chatlog.INDEX_INTERVAL == 0 for seq in seqs)
+
+
+def test_seq_at(tmp_path):
+    log = open_log(tmp_path)
+    for i, line in enumerate(lines(300)):
+        log.append(line, timestamp=1000 + i)
+    log.flush()
+    seq = log.seq_at(1000 + 200)
+    assert 200 - chatlog.INDEX_INTERVAL <= seq <= 200  # early by at most the index interval
+    assert log.seq_at(0) == 0
+    log.close()
+
+
+#The log as a client on LOG_MODEL receives it; other models get the lines re-framed.
+def test_frames_for_other_models(log):
+    for line in lines(3):
+        log.append(line)
+    _, _, chunks = log.read(0)
+    assert chatlog.frames_for(chunks, chatlog.LOG_MODEL) is chunks
+    reframed = chatlog.frames_for(chunks, get_model('crc-16/ccitt'))
+    assert len(reframed) == 3
+
+
+def test_reopen_continues_numbering(tmp_path):
+    log = open_log(tmp_path, segment_bytes=2048)
+    for line in lines(300):
+        log.append(line)
+    log.close()
+    log = open_log(tmp_path, segment_bytes=2048)
+    assert log.head() == 300
+    assert log.append(b'after restart') == 300
+    assert read_payloads(log, since=298) == (298, lines(2, 298) + [b'after restart'])
+    log.close()
+
+
+#A frame left half-written by a crash is cut off, with any index entry pointing past the cut.
+def test_recovers_from_a_torn_write(tmp_path):
+    log = open_log(tmp_path)
+    for line in lines(129):
+        log.append(line)
+    log.close()
+    path = os.path.join(str(tmp_path), chatlog._name(0, 'log'))
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 3)  # record 128, which also has an index entry
+    log = open_log(tmp_path)
+    assert log.head() == 128
+    assert [seq for seq, _, _ in log.index[0]] == [0, 64]
+    assert log.append(b'next') == 128
+    assert read_payloads(log, since=127) == (127, [lines(1, 127)[0], b'next'])
+    log.close()
+
+
+def test_counts_damaged_records(tmp_path):
+    log = open_log(tmp_path)
+    for line in lines(10):
+        log.append(line)
+    log.close()
+    path = os.path.join(str(tmp_path), chatlog._name(0, 'log'))
+    with open(path, 'r+b') as f:
+        f.seek(20)
+        byte = f.read(1)
+        f.seek(20)
+        f.write(bytes((byte[0] ^ 0xFF,)))
+    log = open_log(tmp_path)
+    assert log.recovered_bad == 1 and log.head() == 10
+    log.close()
+
+
+#A reader in another process (a cluster worker) sees what the writer flushed.
+def test_reader_follows_the_writer(tmp_path):
+    log = open_log(tmp_path, segment_bytes=2048)
+    reader = LogReader(str(tmp_path))
+    assert reader.head() == 0
+    for line in lines(200):
+        log.append(line)
+    log.flush()
+    assert reader.head() == 200
+    assert read_payloads(reader, since=150) == (150, lines(50, 150))
+    reader.close()
+    log.close()
+
+
+#A reader opened after many segments were written (or that fell behind by several) has the index of
+#every one of them, not just the last two.
+def test_reader_indexes_every_segment(tmp_path):
+    log = open_log(tmp_path, segment_bytes=2048)
+    reader = LogReader(str(tmp_path))
+    reader.head()
+    for line in lines(1000):
+        log.append(line)
+    log.flush()
+    assert reader.head() == 1000
+    assert len(reader.segments) > 4
+    assert all(reader.index[base] for base in reader.segments)
+    assert read_payloads(reader, since=70) == (70, lines(930, 70))
+    reader.close()
+    reader = LogReader(str(tmp_path))
+    assert reader.head() == 1000
+    assert all(reader.index[base] for base in reader.segments)
+    reader.close()
+    log.close()
+
+
+#A worker calls head() from client threads while the bus thread reads: the index is loaded once.
+def test_reader_shared_by_threads(tmp_path):
+    log = open_log(tmp_path, segment_bytes=2048)
+    for line in lines(1000):
+        log.append(line)
+    log.flush()
+    for _ in range(100):
+        reader = LogReader(str(tmp_path))
+        start = threading.Barrier(9)
+
+        def together(call, *args):
+            start.wait()
+            call(*args)
+        threads = [threading.Thread(target=together, args=(reader.head,)) for _ in range(8)]
+        threads.append(threading.Thread(target=together, args=(reader.read, 500)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(set(reader.segments)) == reader.segments
+        for base in reader.segments:
+            assert sorted(set(reader.index[base])) == reader.index[base]
+        reader.close()
+    log.close()
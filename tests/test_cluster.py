@@ -0,0 +1,121 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import pytest
+import framing
+import notices
+from crc import get_model
+
+# Sharded server (cluster.py) end to end: python -m server --workers 2 in a subprocess, clients on
+# plain sockets.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL = get_model('crc-32')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope='module', params=('thread', 'asyncio'))
+def cluster(request):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, '-m', 'server', '--host', '127.0.0.1', '--port', str(port),
+                             '--engine', request.param, '--workers', '2', '--log', 'null'], cwd=ROOT)
+    deadline = time.monotonic() + 15
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                proc.kill()
+                pytest.fail('server did not start')
+            time.sleep(0.05)
+    time.sleep(0.5)  # both workers listening
+    yield port
+    proc.terminate()
+    proc.wait(10)
+
+
+def hello(name, **options):
+    return framing.pack_text(framing.HELLO, framing.pack_options({'crc': 'crc-32', **options}, first_line=name),
+                             framing.HANDSHAKE_MODEL)
+
+
+def chat(text):
+    return framing.pack_text(framing.MSG, text, MODEL)
+
+
+#A client on a blocking socket: lines() yields the text of every chat frame after the WELCOME.
+class Client:
+    def __init__(self, port, data):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=10)
+        self.sock.sendall(data)
+        self.reader = framing.FrameReader(framing.HANDSHAKE_MODEL)
+        self.frames = self.reader.iter_socket(self.sock)
+        welcome = next(self.frames)
+        assert welcome.type == framing.WELCOME
+        self.accepted = framing.parse_options(str(welcome.payload, 'utf-8'))[1]
+        self.reader.model = MODEL
+
+    def lines(self):
+        for frame in self.frames:
+            if frame.type == framing.MSG and frame.ok:
+                yield str(frame.payload, 'utf-8')
+
+    def wait_for(self, wanted, timeout=10):
+        wanted, seen = set(wanted), []
+        self.sock.settimeout(timeout)
+        try:
+            for line in self.lines():
+                seen.append(line)
+                wanted.discard(line)
+                if not wanted:
+                    break
+        except socket.timeout:
+            pass
+        return wanted, seen
+
+    def close(self):
+        self.sock.close()
+
+
+def joined(port, name, **options):
+    client = Client(port, hello(name, **options))
+    missing, _ = client.wait_for([notices.joined(name)])
+    assert not missing
+    return client
+
+
+#A line sent in the same write as the HELLO is published before the worker hears its own JOIN back
+#from the hub; it must still go to the client's room.
+def test_line_pipelined_with_hello(cluster):
+    listener = joined(cluster, 'listener')
+    clients = [Client(cluster, hello(f'early{i}') + chat(f'first line {i}')) for i in range(40)]
+    try:
+        missing, seen = listener.wait_for(f'early{i}: first line {i}' for i in range(40))
+        assert not missing, f'{len(missing)} first lines lost'
+        assert notices.NO_ROOM not in seen
+    finally:
+        for client in clients + [listener]:
+            client.close()
+
+
+#A line right after "[join dev]" goes to dev, as on a single server.
+def test_line_pipelined_with_join(cluster):
+    lobby = joined(cluster, 'lobbyist')
+    dev = joined(cluster, 'developer', rooms='dev')
+    mover = Client(cluster, hello('mover') + chat('[join dev]') + chat('now in dev'))
+    try:
+        missing, _ = dev.wait_for(['[dev] mover: now in dev'])
+        assert not missing
+        _, seen = lobby.wait_for(['mover: now in dev'], 0.5)
+        assert 'mover: now in dev' not in seen
+    finally:
+        for client in (lobby, dev, mover):
+            client.close()
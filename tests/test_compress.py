@@ -0,0 +1,135 @@
+import zlib
+import pytest
+import common
+import compress
+import fec
+import framing
+from crc import get_model
+
+# Compression codecs: round trips, what is left uncompressed, the inflated-size limit, negotiation,
+# and compressed frames (SEQUENCED and FEC ones included).
+
+MODEL = get_model('crc-32')
+CHAT = b'hello everyone, what do you think of the new build? I think it sounds good, thanks'
+
+
+def raw_deflate(data):
+    deflate = zlib.compressobj(9, zlib.DEFLATED, compress.WBITS)
+    return deflate.compress(data) + deflate.flush()
+
+
+@pytest.mark.parametrize('spec', ['zlib:1', 'zlib', 'zlib:9', 'zlib-dict', 'zlib-dict:9'])
+@pytest.mark.parametrize('payload', [CHAT, CHAT * 50, bytes(5000), compress.DICTIONARY])
+def test_round_trip(spec, payload):
+    codec = compress.get_codec(spec)
+    data = codec.compress(payload)
+    assert data is not None and len(data) < len(payload)
+    assert codec.decompress(data) == payload
+
+
+#The preset dictionary is what makes short chat lines worth compressing.
+def test_dictionary_helps_short_lines():
+    plain, preset = compress.Zlib(), compress.Zlib(dictionary=compress.DICTIONARY)
+    assert len(preset.compress(CHAT)) < len(plain.compress(CHAT))
+
+
+def test_short_and_incompressible_payloads_are_skipped():
+    codec = compress.Zlib()
+    assert codec.compress(b'hi') is None
+    assert codec.compress(bytes(range(256))) is None
+    assert codec.stats.skipped == 2 and codec.stats.compressed == 0
+
+
+#A small frame that inflates beyond MAX_PAYLOAD (a zlib bomb) is refused, not inflated.
+def test_inflated_size_is_capped():
+    codec = compress.Zlib()
+    bomb = raw_deflate(bytes(framing.MAX_PAYLOAD + 1))
+    assert len(bomb) < 2048
+    with pytest.raises(compress.CompressError):
+        codec.decompress(bomb)
+    assert codec.decompress(raw_deflate(bytes(framing.MAX_PAYLOAD))) == bytes(framing.MAX_PAYLOAD)
+
+
+@pytest.mark.parametrize('data', [b'not deflate at all', raw_deflate(CHAT)[:-4]])
+def test_bad_and_truncated_payloads(data):
+    with pytest.raises(compress.CompressError):
+        compress.Zlib().decompress(data)
+
+
+#In a frame the bomb (or any payload that does not inflate) just counts as corrupted.
+def test_bomb_frame_is_not_ok():
+    model = compress.with_compression(MODEL, compress.get_codec('zlib'))
+    frame = framing.pack_frame(framing.MSG, raw_deflate(bytes(framing.MAX_PAYLOAD + 1)), MODEL,
+                               flags=framing.COMPRESSED)
+    assert not framing.unpack_frame(frame, model).ok
+
+
+def models():
+    codec = compress.get_codec('zlib-dict')
+    return [compress.with_compression(MODEL, codec),
+            compress.with_compression(fec.with_fec(MODEL, fec.get_codec('rs:16')), codec)]
+
+
+@pytest.mark.parametrize('model', models(), ids=['plain', 'rs:16'])
+def test_frames(model):
+    frame = framing.pack_frame(framing.MSG, CHAT, model)
+    uncompressed = fec.with_fec(MODEL, model.fec)
+    assert len(frame) < len(framing.pack_frame(framing.MSG, CHAT, uncompressed))
+    got = framing.unpack_frame(frame, model)
+    assert got.ok and got.flags & framing.COMPRESSED and bytes(got.payload) == CHAT
+    short = framing.unpack_frame(framing.pack_frame(framing.MSG, b'hi', model), model)
+    assert short.ok and not short.flags & framing.COMPRESSED and bytes(short.payload) == b'hi'
+
+
+#SEQUENCED frames (ARQ): the payload is compressed, the sequence tag after it is not.
+@pytest.mark.parametrize('model', models(), ids=['plain', 'rs:16'])
+def test_sequenced_frames(model):
+    frames = framing.FrameCache(CHAT)
+    for seq in (0, 1, 2**32 - 1):
+        got = framing.unpack_frame(frames.sequenced(model, seq), model)
+        assert got.ok and got.flags & framing.COMPRESSED and got.flags & framing.SEQUENCED
+        body, got_seq = framing.split_seq(got.payload)
+        assert bytes(body) == CHAT and got_seq == seq
+
+
+#A damaged compressed frame is caught by the CRC before anything is inflated.
+def test_damaged_frame_is_not_inflated():
+    model = models()[0]
+    codec = model.compression
+    frame = bytearray(framing.pack_frame(framing.MSG, CHAT, model))
+    frame[framing.HEADER_SIZE + 3] ^= 0x10
+    inflated = codec.stats.inflated
+    assert not framing.unpack_frame(bytes(frame), model).ok
+    assert codec.stats.inflated == inflated
+
+
+@pytest.mark.parametrize('offered, allowed, expected', [
+    ('zlib-dict,zlib', ('zlib', 'zlib-dict'), 'zlib-dict:6'),
+    ('zlib-dict:9,zlib:1', ('zlib',), 'zlib:1'),
+    ('bogus,zlib:12,zlib', ('zlib',), 'zlib:6'),
+    ('zlib', (), None),
+    (None, ('zlib',), None),
+])
+def test_select_codec(offered, allowed, expected):
+    codec = compress.select_codec(offered, allowed)
+    assert (codec and codec.spec) == expected
+
+
+def hello(**options):
+    data = framing.pack_text(framing.HELLO, framing.pack_options({'crc': 'crc-32', **options}, first_line='alice'),
+                             framing.HANDSHAKE_MODEL)
+    return framing.unpack_frame(data, framing.HANDSHAKE_MODEL)
+
+
+#The server accepts the first codec it allows and attaches it to the connection's model.
+def test_handshake():
+    agreement = common.negotiate(hello(compress='zlib-dict'), 0, (), ('zlib', 'zlib-dict'), 64)
+    assert agreement.accepted['compress'] == 'zlib-dict:6'
+    assert agreement.model.compression is compress.get_codec('zlib-dict', 64)
+    refused = common.negotiate(hello(compress='zlib-dict'), 0, (), ('zlib',), 64)
+    assert 'compress' not in refused.accepted and refused.model.compression is None
+
+
+def test_unknown_codec():
+    with pytest.raises(compress.CompressError):
+        compress.get_codec('lz4')
@@ -0,0 +1,101 @@
+import random
+import pytest
+import crc
+from crc_tables import TABLES
+
+# The table-driven CRC code against the bit-string mod2_division it replaced, and the registered
+# models against their published check values.
+
+MODELS = sorted(crc.models)
+
+
+def random_samples(count=2000, seed=1234):
+    rng = random.Random(seed)
+    samples = ['', 'a', '[bye]', 'Client Alice has joined the chat!', 'ÿé', 'café ☃ \U0001f600']
+    for _ in range(count):
+        length = rng.randint(0, 64)
+        samples.append(''.join(chr(rng.choice((rng.randint(0, 127), rng.randint(0, 255), rng.randint(0, 0x10FFFF))))
+                               for _ in range(length)))
+    return samples
+
+
+SAMPLES = random_samples()
+#the batch API works on latin-1 text
+NARROW = [sample for sample in SAMPLES if all(ord(c) < 256 for c in sample)]
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_precomputed_table_matches(name):
+    model = crc.get_model(name)
+    assert model.table_key in TABLES
+    assert list(TABLES[model.table_key]) == model._make_table()
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_check_value(name):
+    model = crc.get_model(name)
+    assert model.compute(b'123456789') == model.check
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_incremental_matches_one_shot(name):
+    model = crc.get_model(name)
+    state = crc.new_state(model)
+    for chunk in (b'1', b'2345', b'', b'6789'):
+        state = crc.update(state, memoryview(chunk))
+    assert crc.finalize(state) == model.check
+
+
+def test_default_model_matches_mod2_division():
+    for sample in SAMPLES:
+        expected = crc.mod2_division(crc.str_to_bin(sample) + '0' * (len(crc.generator) - 1), crc.generator)
+        assert crc.crc_remainder(sample) == expected, repr(sample)
+        assert crc.decode_message(sample + expected) == (sample, True), repr(sample)
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_encode_decode_round_trip(name):
+    model = crc.get_model(name)
+    for sample in SAMPLES:
+        assert crc.decode_message(crc.encode_message(sample, model), model) == (sample, True), repr(sample)
+
+
+#Models with no initial register or reflection are plain polynomial division.
+@pytest.mark.parametrize('name', [name for name in MODELS
+                                  if not crc.get_model(name).reflected and crc.get_model(name).init == 0])
+def test_plain_models_match_mod2_division(name):
+    model = crc.get_model(name)
+    for sample in SAMPLES:
+        expected = crc.mod2_division(crc.str_to_bin(sample) + '0' * model.width, model.generator)
+        assert crc.crc_remainder(sample, model) == expected, repr(sample)
+
+
+def test_decode_detects_a_flipped_bit():
+    encoded = crc.encode_message('hello world', crc.get_model('crc-32'))
+    assert crc.decode_message(crc.introduce_error(encoded, 1.0), 'crc-32')[1] is False
+
+
+BATCH_PATHS = (False, True) if crc.load_numpy() is not None else (False,)
+
+
+#The batch API must agree with decode_message message for message, corrupted and short ones included.
+@pytest.mark.parametrize('use_numpy', BATCH_PATHS)
+@pytest.mark.parametrize('name', MODELS)
+def test_verify_batch_matches_decode_message(name, use_numpy):
+    model = crc.get_model(name)
+    random.seed(7)
+    encoded = [crc.encode_message(sample, model) for sample in NARROW]
+    for i in range(0, len(encoded), 7):
+        encoded[i] = crc.introduce_error(encoded[i], 1.0)
+    encoded.append('01'[:model.width - 1])
+    buffer, offsets = crc.pack_batch(encoded)
+    mask, payloads = crc.verify_batch(buffer, offsets, model, use_numpy=use_numpy)
+    assert list(zip(payloads, mask)) == [crc.decode_message(e, model) for e in encoded]
+
+
+@pytest.mark.parametrize('use_numpy', BATCH_PATHS)
+@pytest.mark.parametrize('name', MODELS)
+def test_encode_batch_matches_encode_message(name, use_numpy):
+    model = crc.get_model(name)
+    expected = crc.pack_batch([crc.encode_message(sample, model) for sample in NARROW])
+    assert crc.encode_batch(*crc.pack_batch(NARROW), model, use_numpy=use_numpy) == expected
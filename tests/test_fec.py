@@ -0,0 +1,107 @@
+import random
+import pytest
+import fec
+import framing
+from crc import get_model
+
+# FEC codecs: round trips, how many errors each one corrects, and correction inside frames.
+
+_rng = random.Random(5)
+DATA = bytes(_rng.randrange(256) for _ in range(1000))
+SIZES = (0, 1, 15, 16, 17, 239, 240, 241, 1000)
+
+
+@pytest.mark.parametrize('spec', ['hamming:1', 'hamming:4', 'hamming:16', 'hamming:64', 'rs:2', 'rs:16', 'rs:32'])
+@pytest.mark.parametrize('size', SIZES)
+def test_round_trip(spec, size):
+    codec = fec.get_codec(spec)
+    data = DATA[:size]
+    encoded = codec.encode(data)
+    assert len(encoded) == codec.encoded_size(size)
+    assert bytes(codec.strip(encoded)) == data
+    assert codec.decode(encoded) == (bytearray(data), 0)
+
+
+#Hamming corrects one flipped bit per block, wherever it is (check bits included; the padding bits
+#of the check bytes carry nothing, so flipping one needs no correction).
+@pytest.mark.parametrize('block', [4, 16, 64])
+def test_hamming_corrects_one_bit_per_block(block):
+    codec = fec.Hamming(block)
+    encoded = codec.encode(DATA)
+    step = block + codec.check
+    for bit in range(0, step * 8, 3):
+        damaged = bytearray(encoded)
+        flipped = 0
+        for start in range(0, len(damaged), step):
+            end = min(start + step, len(damaged))  # the last block may be short
+            pos = start + bit // 8
+            if pos >= end:
+                continue
+            damaged[pos] ^= 1 << bit % 8
+            check_bit = (end - 1 - pos) * 8 + bit % 8  # bit of the check word, if pos is a check byte
+            flipped += pos < end - codec.check or check_bit <= codec.bits
+        decoded, corrected = codec.decode(damaged)
+        assert bytes(decoded) == DATA, bit
+        assert corrected == flipped, bit
+
+
+@pytest.mark.parametrize('nsym', [4, 16, 32])
+def test_reed_solomon_corrects_half_its_parity(nsym):
+    rng = random.Random(nsym)
+    codec = fec.ReedSolomon(nsym)
+    encoded = codec.encode(DATA)
+    step = codec.block + nsym
+    for _ in range(20):
+        damaged = bytearray(encoded)
+        for start in range(0, len(damaged), step):
+            end = min(start + step, len(damaged))
+            for pos in rng.sample(range(start, end), min(nsym // 2, end - start)):
+                damaged[pos] ^= rng.randrange(1, 256)
+        decoded, corrected = codec.decode(damaged)
+        assert bytes(decoded) == DATA
+
+
+#A burst of nsym // 2 bytes is as easy as scattered errors for Reed-Solomon.
+def test_reed_solomon_corrects_a_burst():
+    codec = fec.ReedSolomon(16)
+    damaged = bytearray(codec.encode(DATA[:200]))
+    damaged[50:58] = bytes(8)
+    decoded, corrected = codec.decode(damaged)
+    assert bytes(decoded) == DATA[:200] and corrected == 8
+
+
+#A frame the codec fixes arrives intact and counts what was corrected; one it cannot fix is still
+#caught by the CRC.
+@pytest.mark.parametrize('spec', ['hamming:16', 'rs:16'])
+def test_correction_in_frames(spec):
+    model = fec.with_fec(get_model('crc-32'), fec.get_codec(spec))
+    frame = bytearray(framing.pack_frame(framing.MSG, DATA[:100], model))
+    frame[framing.HEADER_SIZE + 10] ^= 0x20
+    fixed = framing.unpack_frame(bytes(frame), model)
+    assert fixed.ok and bytes(fixed.payload) == DATA[:100] and fixed.corrected == 1
+    for pos in range(framing.HEADER_SIZE + 10, framing.HEADER_SIZE + 30):
+        frame[pos] ^= 0xFF
+    assert not framing.unpack_frame(bytes(frame), model).ok
+
+
+def test_with_fec_shares_the_model():
+    model = get_model('crc-32')
+    assert fec.with_fec(model, fec.get_codec('rs:16')) is fec.with_fec(model, fec.get_codec('rs:16'))
+    assert fec.with_fec(model, None) is model
+
+
+@pytest.mark.parametrize('offered, allowed, expected', [
+    ('rs:16', ('rs', 'hamming'), 'rs:16'),
+    ('hamming:4,rs:16', ('rs',), 'rs:16'),
+    ('bogus,rs:x,hamming', ('rs', 'hamming'), 'hamming:16'),
+    ('rs:16', (), None),
+    (None, ('rs',), None),
+])
+def test_select_codec(offered, allowed, expected):
+    codec = fec.select_codec(offered, allowed)
+    assert (codec and codec.spec) == expected
+
+
+def test_unknown_codec():
+    with pytest.raises(fec.FecError):
+        fec.get_codec('turbo:3')
@@ -0,0 +1,124 @@
+import socket
+import threading
+import pytest
+import framing
+from crc import get_model
+from framing import FrameReader, FramingError, MSG, HELLO, pack_frame, pack_text
+
+# FrameReader over partial and coalesced reads, and the frame builders it parses.
+
+MODEL = get_model('crc-32')
+PAYLOADS = [b'', b'a', b'hello world', bytes(range(256)) * 3, 'café ☃'.encode()]
+
+
+def parsed(reader):
+    return [(f.type, bytes(f.payload), f.ok) for f in reader.frames()]
+
+
+def test_coalesced_frames_in_one_read():
+    reader = FrameReader(MODEL)
+    reader.feed(b''.join(pack_frame(MSG, p, MODEL) for p in PAYLOADS))
+    assert parsed(reader) == [(MSG, p, True) for p in PAYLOADS]
+    assert reader.start == reader.end == 0
+
+
+def test_frames_split_byte_by_byte():
+    reader = FrameReader(MODEL, size=16)
+    stream = b''.join(pack_frame(MSG, p, MODEL) for p in PAYLOADS)
+    got = []
+    for i in range(len(stream)):
+        reader.feed(stream[i:i + 1])
+        got += parsed(reader)
+    assert got == [(MSG, p, True) for p in PAYLOADS]
+
+
+#A read that ends in the middle of a frame keeps the partial frame for the next one.
+@pytest.mark.parametrize('cut', [1, framing.HEADER_SIZE - 1, framing.HEADER_SIZE, framing.HEADER_SIZE + 5])
+def test_partial_frame_after_complete_ones(cut):
+    reader = FrameReader(MODEL)
+    first, second = pack_frame(MSG, b'one', MODEL), pack_frame(MSG, b'two and more', MODEL)
+    reader.feed(first + second[:cut])
+    assert parsed(reader) == [(MSG, b'one', True)]
+    reader.feed(second[cut:])
+    assert parsed(reader) == [(MSG, b'two and more', True)]
+
+
+def test_frame_larger_than_the_buffer():
+    reader = FrameReader(MODEL, size=64)
+    payload = bytes(range(256)) * 40
+    reader.feed(pack_frame(MSG, payload, MODEL))
+    assert parsed(reader) == [(MSG, payload, True)]
+
+
+#A corrupted payload is reported, and the stream stays in sync for the next frame.
+def test_corrupted_payload_keeps_the_stream_in_sync():
+    frame = bytearray(pack_frame(MSG, b'hello', MODEL))
+    frame[framing.HEADER_SIZE] ^= 0x01
+    reader = FrameReader(MODEL)
+    reader.feed(bytes(frame) + pack_frame(MSG, b'next', MODEL))
+    assert parsed(reader) == [(MSG, b'iello', False), (MSG, b'next', True)]
+
+
+def test_corrupted_header_raises():
+    frame = bytearray(pack_frame(MSG, b'hello', MODEL))
+    frame[3] ^= 0x10
+    reader = FrameReader(MODEL)
+    reader.feed(bytes(frame))
+    with pytest.raises(FramingError):
+        list(reader.frames())
+
+
+def test_oversized_length_raises():
+    reader = FrameReader(MODEL)
+    reader.feed(framing.frame_header(MSG, framing.MAX_PAYLOAD + 1))
+    with pytest.raises(FramingError):
+        list(reader.frames())
+
+
+#The handshake uses HANDSHAKE_MODEL; frames after it use the negotiated model, even in the same read.
+def test_model_switch_after_the_handshake():
+    reader = FrameReader(framing.HANDSHAKE_MODEL)
+    reader.feed(pack_text(HELLO, 'alice\ncrc=crc-32', framing.HANDSHAKE_MODEL) + pack_text(MSG, 'hi', MODEL))
+    frames = reader.frames()
+    hello = next(frames)
+    assert (hello.type, hello.ok) == (HELLO, True)
+    reader.model = MODEL
+    msg = next(frames)
+    assert (msg.type, bytes(msg.payload), msg.ok) == (MSG, b'hi', True)
+
+
+def test_iter_socket_with_split_writes():
+    ours, theirs = socket.socketpair()
+    stream = b''.join(pack_frame(MSG, p, MODEL) for p in PAYLOADS)
+
+    def write():
+        with theirs:
+            for i in range(0, len(stream), 7):
+                theirs.sendall(stream[i:i + 7])
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    with ours:
+        got = [(f.type, bytes(f.payload), f.ok) for f in FrameReader(MODEL, size=32).iter_socket(ours)]
+    writer.join()
+    assert got == [(MSG, p, True) for p in PAYLOADS]
+
+
+#A FrameCache frames its payload once per model, and every recipient shares those bytes.
+def test_frame_cache_shares_frames():
+    frames = framing.FrameCache('hello')
+    assert frames[MODEL] is frames[MODEL]
+    assert frames[MODEL] == pack_frame(MSG, b'hello', MODEL)
+    assert framing.unpack_frame(frames[get_model('crc-8')], 'crc-8').payload == b'hello'
+
+
+def test_sequenced_frame_carries_its_number():
+    frame = framing.unpack_frame(framing.FrameCache(b'hello').sequenced(MODEL, 41), MODEL)
+    assert frame.ok and frame.flags & framing.SEQUENCED
+    body, seq = framing.split_seq(frame.payload)
+    assert (bytes(body), seq) == (b'hello', 41)
+
+
+def test_options_round_trip():
+    text = framing.pack_options({'crc': 'crc-32,crc-3', 'arq': 8}, first_line='alice')
+    assert framing.parse_options(text, has_first_line=True) == ('alice', {'crc': 'crc-32,crc-3', 'arq': '8'})
@@ -0,0 +1,75 @@
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from test_cluster import ROOT, free_port, hello, chat, Client, joined
+
+# History replay (--history) end to end: a client that joins while lines are being sent gets every
+# line once, from the log or live, never both and never neither; and only lobby clients get any.
+
+LINES = 3000
+
+
+@pytest.fixture(params=('thread', 'asyncio'))
+def server(request, tmp_path):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, '-m', 'server', '--host', '127.0.0.1', '--port', str(port),
+                             '--engine', request.param, '--history', str(tmp_path), '--queue-size', '4096',
+                             '--log', 'null'], cwd=ROOT)
+    deadline = time.monotonic() + 15
+    while True:
+        try:
+            Client(port, hello('probe')).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                proc.kill()
+                pytest.fail('server did not start')
+            time.sleep(0.05)
+    yield port
+    proc.terminate()
+    proc.wait(10)
+
+
+def test_join_while_lines_arrive(server):
+    writer = joined(server, 'writer')
+    sending = threading.Thread(target=lambda: [writer.sock.sendall(chat(f'line {i}')) for i in range(LINES)])
+    sending.start()
+    clients = []
+    try:
+        for i in range(20):
+            clients.append(Client(server, hello(f'late{i}', history=str(LINES))))
+            time.sleep(0.005)
+        sending.join()
+        last = f'writer: line {LINES - 1}'
+        for client in clients:
+            missing, seen = client.wait_for([last])
+            assert not missing
+            numbers = [int(line.rsplit(' ', 1)[1]) for line in seen if line.startswith('writer: ')]
+            assert numbers == list(range(numbers[0], LINES)), 'lines lost or repeated around the join'
+    finally:
+        for client in clients + [writer]:
+            client.close()
+
+
+#The log holds the lobby only: a client that does not join the lobby is not replayed it.
+def test_history_only_for_the_lobby(server):
+    talker = joined(server, 'talker')
+    listener = joined(server, 'listener')
+    try:
+        talker.sock.sendall(b''.join(chat(f'hello {i}') for i in range(5)))
+        missing, _ = listener.wait_for(f'talker: hello {i}' for i in range(5))
+        assert not missing
+        dev = Client(server, hello('dev', rooms='dev', history='5'))
+        both = Client(server, hello('both', rooms='dev,lobby', history='5'))
+        assert 'seq' not in dev.accepted and both.accepted['seq'] == '5'
+        missing, _ = both.wait_for(f'talker: hello {i}' for i in range(5))
+        assert not missing
+        _, seen = dev.wait_for(['nothing'], 0.5)
+        assert not any(line.startswith('talker: ') for line in seen)
+        dev.close()
+        both.close()
+    finally:
+        talker.close()
+        listener.close()
@@ -0,0 +1,133 @@
+import socket
+import subprocess
+import sys
+import time
+import pytest
+import common
+import framing
+import limits
+import notices
+from crc import get_model
+from session import Session, SessionRegistry
+from test_cluster import ROOT, free_port
+
+# Connection limits: token buckets, admission, the keepalive ping/evict decisions (and what the timer
+# does with them), and the handshake timeout end to end.
+
+MODEL = get_model('crc-32')
+
+
+def test_bucket_burst_then_rate():
+    bucket = limits.TokenBucket(rate=2, burst=3)
+    now = bucket.stamp
+    assert [bucket.take(1, now) for _ in range(4)] == [True, True, True, False]
+    assert not bucket.take(1, now + 0.4)
+    assert bucket.take(1, now + 0.6)  # 2 per second: one more after half a second
+    assert bucket.take(2, now + 100) and bucket.tokens == 1  # never more than the burst
+
+
+#A refused take() costs nothing, so a smaller one may still fit.
+def test_bucket_refusal_takes_nothing():
+    bucket = limits.TokenBucket(rate=0, burst=10)
+    now = bucket.stamp
+    assert not bucket.take(11, now)
+    assert bucket.take(10, now)
+
+
+def limited_session(**options):
+    session = Session(None)
+    session.msg_bucket, session.byte_bucket = limits.Limits(**options).buckets()
+    return session
+
+
+def test_line_limit():
+    policy = limits.Limits(msg_rate=1, msg_burst=2)
+    session = limited_session(msg_rate=1, msg_burst=2)
+    assert [policy.check(session, 10) for _ in range(3)] == [None, None, 'messages']
+
+
+def test_byte_limit():
+    policy = limits.Limits(byte_rate=100, byte_burst=100)
+    session = limited_session(byte_rate=100, byte_burst=100)
+    assert policy.check(session, 60) is None
+    assert policy.check(session, 60) == 'bytes'
+    assert policy.check(session, 40) is None
+
+
+def test_limits_off():
+    assert limits.Limits().buckets() == (None, None)
+    assert limits.Limits().check(Session(None), 10 ** 9) is None
+    assert limits.Limits().admit(10 ** 6)
+    assert limits.Limits(max_clients=2).admit(1) and not limits.Limits(max_clients=2).admit(2)
+
+
+@pytest.mark.parametrize('silent, since_ping, expected', [
+    (5, 5, None),
+    (30, 30, 'ping'),
+    (40, 5, None),       # pinged recently: wait for the PONG
+    (40, 30, 'ping'),    # pinged again every keepalive seconds
+    (120, 0, 'evict'),
+])
+def test_keepalive_action(silent, since_ping, expected):
+    policy = limits.Limits(keepalive=30, idle_timeout=120)
+    now = 1000.0
+    assert policy.keepalive_action(now - silent, now - since_ping, now) == expected
+
+
+def test_keepalive_off():
+    policy = limits.Limits(keepalive=0, idle_timeout=0)
+    assert policy.keepalive_action(0, 0, 10 ** 6) is None and not policy.keepalive_on
+
+
+class ListQueue(list):
+    def put(self, frame):
+        self.append(frame)
+        return True
+
+    def close(self, flush=True):
+        self.flushed = flush
+
+
+#The keepalive timer pings a quiet client once per keepalive period, and evicts a silent one
+#with a goodbye.
+def test_keepalive_timer():
+    sessions = SessionRegistry()
+    session = Session(object())
+    session.name, session.model, session.queue = 'quiet', MODEL, ListQueue()
+    sessions.add(session)
+    sessions.join(session)
+    policy = limits.Limits(keepalive=30, idle_timeout=120)
+    start = session.last_seen
+    common.keepalive(sessions, policy, print, start + 31)
+    common.keepalive(sessions, policy, print, start + 32)
+    assert session.queue == [limits.ping_frame(MODEL)]
+    session.queue.clear()
+    common.keepalive(sessions, policy, print, start + 121)
+    assert session.queue == [notices.notice_frame(notices.IDLE, MODEL)]
+    assert session.queue.flushed and session.conn not in sessions
+
+
+#A connection that never sends its HELLO is told so and closed after --handshake-timeout.
+@pytest.mark.parametrize('engine', ['thread', 'asyncio'])
+def test_handshake_timeout(engine):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, '-m', 'server', '--host', '127.0.0.1', '--port', str(port),
+                             '--engine', engine, '--handshake-timeout', '0.3', '--log', 'null'], cwd=ROOT)
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+                break
+            except OSError:
+                assert time.monotonic() < deadline, 'server did not start'
+                time.sleep(0.05)
+        with sock:
+            start = time.monotonic()
+            reader = framing.FrameReader(framing.HANDSHAKE_MODEL)
+            frames = list(reader.iter_socket(sock))
+            assert time.monotonic() - start < 3
+        assert [str(frame.payload, 'utf-8') for frame in frames] == [notices.HANDSHAKE_TIMEOUT]
+    finally:
+        proc.terminate()
+        proc.wait(10)
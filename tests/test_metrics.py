@@ -0,0 +1,64 @@
+import pytest
+import crc
+import framing
+import metrics
+
+# Reconnect counting (a name seen before is a reconnect; only the last NAMES_MAX names are kept) and
+# CRC timing.
+
+
+@pytest.fixture(autouse=True)
+def names(monkeypatch):
+    monkeypatch.setattr(metrics, '_names', metrics.OrderedDict())
+    monkeypatch.setattr(metrics, 'NAMES_MAX', 3)
+    monkeypatch.setattr(metrics.reconnects, 'value', 0)
+
+
+def test_reconnect_counted():
+    for name in ('alice', 'bob', 'alice'):
+        metrics.joined(name)
+    assert metrics.reconnects.value == 1
+
+
+def test_names_are_bounded():
+    for i in range(100):
+        metrics.joined(f'user{i}')
+    assert list(metrics._names) == ['user97', 'user98', 'user99']
+    metrics.joined('user0')
+    assert metrics.reconnects.value == 0
+
+
+#A name that keeps reconnecting stays in, however many other names join.
+def test_recent_names_stay():
+    for i in range(10):
+        metrics.joined('regular')
+        metrics.joined(f'user{i}')
+    assert metrics.reconnects.value == 9
+    assert 'regular' in metrics._names
+
+
+@pytest.fixture
+def timed(monkeypatch):
+    monkeypatch.setattr(crc.CrcModel, 'update', crc.CrcModel.update)  # undone after the test
+    metrics.instrument_crc()
+    for histogram in (metrics.crc_seconds, metrics.header_crc_seconds):
+        monkeypatch.setattr(histogram, 'count', 0)
+
+
+#The text messages of crc.py and SEQUENCED frames are timed too, not just CrcModel.compute.
+def test_crc_entry_points_are_timed(timed):
+    message = crc.encode_message('hello', 'crc-32')
+    assert crc.decode_message(message, 'crc-32')[1]
+    assert metrics.crc_seconds.count == 2
+    frames = framing.FrameCache(b'payload')
+    frames.sequenced(crc.get_model('crc-32'), 1)
+    frames.sequenced(crc.get_model('crc-32'), 2)
+    assert metrics.crc_seconds.count == 2 + 3  # the payload once, then each tag
+
+
+#Header CRC-8s go to their own histogram, even for a connection on crc-8.
+def test_header_crc_timed_apart(timed):
+    frame = framing.pack_frame(framing.MSG, b'payload', 'crc-8')
+    assert metrics.crc_seconds.count == 1 and metrics.header_crc_seconds.count == 1
+    assert framing.unpack_frame(frame, 'crc-8').ok
+    assert metrics.crc_seconds.count == 2
@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+import pytest
+from outbound import OutboundQueue, AsyncOutboundQueue, Coalescing, DROP_OLDEST, DISCONNECT, BACKPRESSURE
+
+# Outbound queues over a fake socket (or stream writer) whose writes block until the test lets them
+# go, i.e. a client that stopped reading: what each full-queue policy does, and how frames are
+# coalesced into writes.
+
+
+class StalledSocket:
+    def __init__(self):
+        self.sent = []
+        self.go = threading.Event()
+
+    def sendall(self, data):
+        self.go.wait()
+        self.sent.append(bytes(data))
+
+    def setsockopt(self, *args):
+        pass
+
+    def shutdown(self, how):
+        self.go.set()
+
+    def close(self):
+        pass
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+#Function to get a queue whose writer has taken frame 0 and is stuck sending it.
+def stalled_queue(policy, maxsize=2, **options):
+    sock = StalledSocket()
+    q = OutboundQueue(sock, maxsize, policy, **options)
+    q.put(b'0')
+    wait_until(lambda: len(q) == 0)
+    return sock, q
+
+
+def sent(sock, q):
+    sock.go.set()
+    q.close()
+    q.join(1)
+    return b''.join(sock.sent)
+
+
+def test_drop_oldest():
+    sock, q = stalled_queue(DROP_OLDEST)
+    assert all(q.put(b'%d' % i) for i in range(1, 5))
+    assert len(q) == 2 and q.dropped == 2
+    assert sent(sock, q) == b'034'
+
+
+def test_disconnect():
+    sock, q = stalled_queue(DISCONNECT)
+    assert q.put(b'1') and q.put(b'2')
+    assert not q.put(b'3')
+    assert sent(sock, q) == b'012'
+
+
+#A full queue never blocks put(): the sender waits afterwards, holding no lock other senders need.
+def test_backpressure_put_does_not_block():
+    sock, q = stalled_queue(BACKPRESSURE, timeout=0.2)
+    start = time.monotonic()
+    assert all(q.put(b'%d' % i) for i in range(1, 5))
+    assert time.monotonic() - start < 0.1
+    assert len(q) == 4 and q.full()
+    assert not q.wait_for_space()  # still stuck after the timeout
+    sock.go.set()
+    wait_until(lambda: not q.full())
+    assert q.wait_for_space()
+    q.close()
+    q.join(1)
+    assert b''.join(sock.sent) == b'01234'
+
+
+def test_backpressure_closed_queue_has_no_space():
+    sock, q = stalled_queue(BACKPRESSURE)
+    q.put(b'1')
+    q.put(b'2')
+    q.close(flush=False)
+    assert not q.wait_for_space()
+    assert not q.put(b'3')
+
+
+#Everything queued goes out in one write, at most Coalescing.frames frames at a time.
+def test_frames_per_write():
+    sock, q = stalled_queue(DROP_OLDEST, maxsize=16, coalesce=Coalescing(frames=3))
+    for i in range(1, 8):
+        q.put(b'%d' % i)
+    sent(sock, q)
+    assert sock.sent == [b'0', b'123', b'456', b'7']
+    assert q.writes == 4 and q.sent == 8
+
+
+def open_queue(coalesce):
+    sock = StalledSocket()
+    sock.go.set()
+    return sock, OutboundQueue(sock, 64, coalesce=coalesce)
+
+
+#With a delay a burst is held back and sent together once no frame came in for `idle` seconds,
+#long before the delay cap.
+def test_idle_flush():
+    sock, q = open_queue(Coalescing(delay=2.0, idle=0.02))
+    start = time.monotonic()
+    for i in range(3):
+        q.put(b'%d' % i)
+    wait_until(lambda: sock.sent)
+    assert time.monotonic() - start < 1.0
+    assert sock.sent == [b'012']
+    q.close()
+
+
+#Frames that keep coming are still sent every `delay` seconds.
+def test_delay_caps_the_wait():
+    sock, q = open_queue(Coalescing(delay=0.05, idle=0.05))
+    deadline = time.monotonic() + 0.3
+    while time.monotonic() < deadline:
+        q.put(b'.')
+        time.sleep(0.005)
+    q.close()
+    q.join(1)
+    assert 3 <= len(sock.sent) < q.sent
+    assert b''.join(sock.sent) == b'.' * q.sent
+
+
+def test_coalescing_settings():
+    with pytest.raises(ValueError):
+        Coalescing(frames=0)
+    assert Coalescing(delay=0.001, idle=0.01).idle == 0.001
+    assert Coalescing(idle=0.01).idle == 0.0  # no delay: nothing is held back
+
+
+#The asyncio queue: the same policies, with the writer task stuck in drain().
+class StalledWriter:
+    def __init__(self):
+        self.sent = []
+        self.go = asyncio.Event()
+        self.transport = self
+
+    def write(self, data):
+        self.sent.append(bytes(data))
+
+    def writelines(self, batch):
+        self.sent.extend(map(bytes, batch))
+
+    async def drain(self):
+        await self.go.wait()
+
+    def abort(self):
+        self.go.set()
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize('policy, accepted, left', [
+    (DROP_OLDEST, [True] * 4, b'34'),
+    (DISCONNECT, [True, True, False, False], b'12'),
+    (BACKPRESSURE, [True] * 4, b'1234'),
+])
+def test_async_policies(policy, accepted, left):
+    async def run():
+        writer = StalledWriter()
+        q = AsyncOutboundQueue(writer, 2, policy, timeout=0.1)
+        q.put(b'0')
+        await asyncio.sleep(0)  # the writer task takes frame 0 and waits in drain()
+        assert [q.put(b'%d' % i) for i in range(1, 5)] == accepted
+        assert b''.join(q.frames) == left
+        if policy == BACKPRESSURE:
+            assert q.full() and not await q.wait_for_space()
+        writer.go.set()
+        q.close()
+        await q.task
+        return b''.join(writer.sent)
+
+    assert asyncio.run(run()) == b'0' + left
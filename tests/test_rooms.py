@@ -0,0 +1,102 @@
+import pytest
+import notices
+import rooms
+from session import Session, SessionRegistry
+
+# Rooms: the registry's room -> members index and the helpers in rooms.py.
+
+
+@pytest.fixture
+def sessions():
+    return SessionRegistry()
+
+
+def member(sessions, *names):
+    session = sessions.add(Session(object()))
+    sessions.join(session)
+    for name in names:
+        sessions.enter(session, name)
+    return session
+
+
+def test_recipients_by_room(sessions):
+    a, b, c = member(sessions, 'lobby'), member(sessions, 'lobby', 'dev'), member(sessions, 'dev')
+    assert sessions.recipients(('lobby',)) == (a, b)
+    assert sessions.recipients(('dev',)) == (b, c)
+    assert sorted(s.id for s in sessions.recipients(('lobby', 'dev'))) == sorted(s.id for s in (a, b, c))
+    assert sessions.recipients(('nowhere',)) == ()
+    assert sessions.recipients() == (a, b, c)
+    assert sessions.room_count() == 2
+
+
+def test_enter_and_leave(sessions):
+    a = member(sessions, 'lobby')
+    assert not sessions.enter(a, 'lobby')  # already a member
+    assert sessions.enter(a, 'dev') and a.rooms == {'lobby', 'dev'}
+    assert sessions.leave(a, 'dev') and a.rooms == {'lobby'}
+    assert not sessions.leave(a, 'dev')
+    assert sessions.room_count() == 1  # empty rooms are dropped
+
+
+def test_enter_needs_a_joined_session(sessions):
+    session = sessions.add(Session(object()))
+    assert not sessions.enter(session, 'lobby')
+    sessions.remove(session.conn)
+    sessions.join(session)
+    assert not sessions.enter(session, 'lobby')
+
+
+#A disconnect takes the session out of every room it was in, and leaves other rooms' tuples alone.
+def test_remove_drops_memberships(sessions):
+    a, b = member(sessions, 'lobby', 'dev'), member(sessions, 'lobby', 'ops')
+    ops = sessions.recipients(('ops',))
+    sessions.remove(a.conn)
+    assert sessions.recipients(('lobby',)) == (b,)
+    assert sessions.recipients(('dev',)) == ()
+    assert sessions.recipients(('ops',)) is ops
+
+
+def test_parse():
+    assert rooms.parse(None) == [rooms.DEFAULT]
+    assert rooms.parse('dev, lobby,dev,bad name,') == ['dev', 'lobby']
+    assert rooms.parse(','.join(f'r{i}' for i in range(40))) == [f'r{i}' for i in range(rooms.MAX_ROOMS)]
+
+
+@pytest.mark.parametrize('payload, expected', [
+    (b'[join dev]', ('join', 'dev')),
+    (b'[leave dev]', ('leave', 'dev')),
+    (b'[join dev] now', None),
+    (b'hello [join dev]', None),
+    (b'[bye]', None),
+    (b'', None),
+])
+def test_command(payload, expected):
+    assert rooms.command(memoryview(payload)) == expected
+
+
+def test_switched():
+    session = Session(object())
+    session.rooms, session.room = frozenset({'lobby', 'dev'}), 'dev'
+    assert rooms.switched(session, rooms.JOIN, 'ops') == 'ops'
+    assert rooms.switched(session, rooms.LEAVE, 'lobby') == 'dev'
+    assert rooms.switched(session, rooms.LEAVE, 'dev') == 'lobby'
+
+
+def test_apply_join_and_leave(sessions):
+    sent = []
+    a, b = member(sessions, 'lobby'), member(sessions, 'dev')
+    a.room = 'lobby'
+    broadcast = lambda message, sender, in_rooms: sent.append((message.text, in_rooms))
+    rooms.apply(sessions, broadcast, a, 'alice', rooms.JOIN, 'dev')
+    assert a.room == 'dev' and sessions.recipients(('dev',)) == (b, a)
+    rooms.apply(sessions, broadcast, a, 'alice', rooms.LEAVE, 'dev')
+    assert a.room == 'lobby' and sessions.recipients(('dev',)) == (b,)
+    assert sent == [(notices.joined_room('alice', 'dev'), ('dev',)), (notices.left_room('alice', 'dev'), ('dev',))]
+
+
+#On a worker the room was switched when the change was published; applying it only updates the index.
+def test_apply_without_switch(sessions):
+    a = member(sessions, 'lobby')
+    a.room = 'ops'
+    rooms.apply(sessions, lambda *args: None, a, 'alice', rooms.JOIN, 'dev', switch=False)
+    assert a.room == 'ops' and 'dev' in a.rooms
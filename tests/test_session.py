@@ -0,0 +1,70 @@
+import threading
+from session import Session, SessionRegistry
+
+# SessionRegistry: connections, the joined snapshot broadcasts iterate without the lock.
+
+
+def registry_with(count, joined=True):
+    sessions = SessionRegistry()
+    added = [sessions.add(Session(object(), ('127.0.0.1', i))) for i in range(count)]
+    if joined:
+        for session in added:
+            sessions.join(session)
+    return sessions, added
+
+
+def test_join_makes_a_recipient():
+    sessions = SessionRegistry()
+    session = sessions.add(Session(object()))
+    assert session.conn in sessions and len(sessions) == 1
+    assert sessions.snapshot() == ()
+    assert sessions.join(session)
+    assert sessions.snapshot() == (session,)
+    assert not sessions.join(session)  # only once
+
+
+def test_join_after_remove_is_refused():
+    sessions = SessionRegistry()
+    session = sessions.add(Session(object()))
+    assert sessions.remove(session.conn) is session
+    assert not sessions.join(session)
+    assert sessions.remove(session.conn) is None
+
+
+#A snapshot taken before a change is not affected by it (copy-on-write).
+def test_snapshot_is_copy_on_write():
+    sessions, added = registry_with(3)
+    before = sessions.snapshot()
+    sessions.remove(added[1].conn)
+    assert before == tuple(added)
+    assert sessions.snapshot() == (added[0], added[2])
+    assert sessions.names() == [None, None]
+
+
+def test_clear():
+    sessions, added = registry_with(3)
+    assert set(sessions.clear()) == set(added)
+    assert len(sessions) == 0 and sessions.snapshot() == () and sessions.recipients() == ()
+
+
+def test_concurrent_joins_and_removes():
+    sessions, added = registry_with(400, joined=False)
+
+    def churn(part):
+        for session in part:
+            sessions.join(session)
+        for session in part[::2]:
+            sessions.remove(session.conn)
+
+    threads = [threading.Thread(target=churn, args=(added[i::4],)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expected = {session for i in range(4) for session in added[i::4][1::2]}
+    assert set(sessions.snapshot()) == expected and len(sessions.snapshot()) == len(expected)
+    assert len(sessions) == len(expected)
+
+
+def test_session_ids_are_unique():
+    assert len({Session(object()).id for _ in range(100)}) == 100
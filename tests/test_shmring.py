@@ -0,0 +1,95 @@
+import pytest
+from shmring import SharedRing, EXTERNAL
+
+# Shared-memory ring: in-place reads, several readers, and overflow when a reader falls a lap behind.
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing(slots=8, slot_size=64, readers=2)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def entries(reader):
+    out = []
+    while True:
+        entry = reader.read()
+        if entry is None:
+            return out
+        seq, flags, view = entry
+        data = bytes(view)
+        del view
+        if reader.check(seq):
+            out.append((seq, flags, data))
+
+
+def test_every_reader_gets_every_entry(ring):
+    first, second = ring.reader(0), ring.reader(1)
+    for i in range(5):
+        assert ring.write(b'entry %d' % i) == i
+    expected = [(i, 0, b'entry %d' % i) for i in range(5)]
+    assert entries(first) == expected
+    assert entries(second) == expected
+    assert len(first) == 0
+
+
+def test_reader_starts_at_the_head(ring):
+    ring.write(b'before')
+    reader = ring.reader()
+    ring.write(b'after')
+    assert entries(reader) == [(1, 0, b'after')]
+
+
+def test_placeholder_flags(ring):
+    reader = ring.reader()
+    ring.write(b'', EXTERNAL)
+    assert entries(reader) == [(0, EXTERNAL, b'')]
+
+
+def test_entry_too_big(ring):
+    with pytest.raises(ValueError):
+        ring.write(bytes(ring.capacity + 1))
+
+
+#A reader more than a lap behind skips to the oldest entry still in the ring and counts the rest lost.
+def test_overflow_counts_lost_entries(ring):
+    reader = ring.reader()
+    for i in range(20):
+        ring.write(b'%d' % i)
+    got = entries(reader)
+    assert [seq for seq, _, _ in got] == list(range(20 - ring.slots + 1, 20))
+    assert reader.lost == 20 - len(got)
+
+
+#An entry overwritten while the reader was using it fails check() and counts as lost.
+def test_check_detects_an_overwrite(ring):
+    reader = ring.reader()
+    ring.write(b'first')
+    seq, _, view = reader.read()
+    del view
+    for i in range(ring.slots):
+        ring.write(b'lap %d' % i)
+    assert not reader.check(seq)
+    assert reader.lost >= 1
+    assert all(data.startswith(b'lap') for _, _, data in entries(reader))
+
+
+def test_attach_by_name(ring):
+    other = SharedRing(name=ring.name)
+    try:
+        assert (other.slots, other.slot_size, other.readers) == (8, 64, 2)
+        reader = other.reader()
+        ring.write(b'shared')
+        assert entries(reader) == [(0, 0, b'shared')]
+    finally:
+        other.close()
+
+
+def test_wakeup_flag(ring):
+    reader = ring.reader(1)
+    assert not ring.wants_wakeup(1)
+    reader.waiting()
+    assert ring.wants_wakeup(1)
+    assert not ring.wants_wakeup(1)  # cleared by the writer